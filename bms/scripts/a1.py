@@ -0,0 +1,56 @@
+import re
+from functools import lru_cache
+
+# Column letters for the first 702 columns (A..ZZ) cover every sheet in the
+# workbooks we process; wider sheets fall back to the memoized conversion.
+_PRECOMPUTED_COLUMNS = 702
+
+CELL_PATTERN = re.compile(r'^\$?([A-Za-z]{1,3})\$?(\d+)$')
+
+
+@lru_cache(maxsize=None)
+def _column_letter_slow(col_idx):
+    col_str = ""
+    while col_idx >= 0:
+        col_str = chr(col_idx % 26 + ord('A')) + col_str
+        col_idx = col_idx // 26 - 1
+    return col_str
+
+
+COLUMN_LETTERS = tuple(_column_letter_slow(i) for i in range(_PRECOMPUTED_COLUMNS))
+
+
+def column_letter(col_idx):
+    """Returns the A1 column letters for a zero-based column index (0 -> 'A')."""
+    if col_idx < _PRECOMPUTED_COLUMNS:
+        return COLUMN_LETTERS[col_idx]
+    return _column_letter_slow(col_idx)
+
+
+def column_index(col_str):
+    """Returns the zero-based column index for A1 column letters ('A' -> 0)."""
+    col_idx = 0
+    for ch in col_str.upper():
+        col_idx = col_idx * 26 + ord(ch) - ord('A') + 1
+    return col_idx - 1
+
+
+def cell_name(row_idx, col_idx):
+    """Returns the A1 name of a cell from zero-based row and column indexes."""
+    return f"{column_letter(col_idx)}{row_idx + 1}"
+
+
+def parse_cell(a1_notation):
+    """
+    Returns the zero-based (row, column) of an A1 cell name such as 'H19' or
+    '$B$19'. Raises ValueError for anything else.
+    """
+    match = CELL_PATTERN.match(a1_notation)
+    if not match:
+        raise ValueError(f"Not an A1 cell reference: {a1_notation!r}")
+    return int(match.group(2)) - 1, column_index(match.group(1))
+
+
+def quote_sheet_name(sheet_name):
+    """Returns a sheet name quoted for use in A1 ranges ("Bob's" -> "'Bob''s'")."""
+    return "'" + sheet_name.replace("'", "''") + "'"
@@ -0,0 +1,250 @@
+"""
+Per-call instrumentation for Google API clients.
+
+instrument(service, metrics) wraps a googleapiclient service (or the
+offline fake) so every request's execute() is timed and measured: latency,
+response body bytes (as received over HTTP; the offline fake reports 0),
+cells returned, retries of the same request and quota errors.
+get_authenticated_service(..., metrics=...) hands out services wrapped this
+way. ApiMetrics aggregates the calls per sheet and per phase (metadata,
+template, other, house) and writes them as a JSON report and, optionally, a
+Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev).
+
+A batchGet covering several sheets is attributed to each of them in
+proportion to the cells it returned for that sheet.
+"""
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+
+from googleapiclient.errors import HttpError
+
+METADATA_PHASE = 'metadata'
+QUOTA_REASONS = ('rateLimitExceeded', 'userRateLimitExceeded', 'quotaExceeded', 'RESOURCE_EXHAUSTED')
+
+
+def is_quota_error(err):
+    status = err.resp.status
+    if status == 429:
+        return True
+    content = err.content.decode('utf-8', 'replace') if isinstance(err.content, bytes) else str(err.content)
+    return status == 403 and any(reason in content for reason in QUOTA_REASONS)
+
+
+def _sheet_from_range(a1_range):
+    sheet = a1_range.rpartition('!')[0] if '!' in a1_range else a1_range
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    return sheet
+
+
+def _count_cells(value_range):
+    return sum(len(row) for row in value_range.get('values', []))
+
+
+class ApiMetrics:
+    """Thread-safe collector of API call records."""
+
+    def __init__(self):
+        self.calls = []
+        self.phases = {}
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._threads = {}
+
+    def set_phases(self, targets):
+        """Maps sheet names to their extraction phase from SheetTargets."""
+        for target in targets:
+            self.phases[target[0]] = target[2]
+
+    def record(self, call):
+        with self._lock:
+            call['thread'] = self._threads.setdefault(threading.get_ident(), len(self._threads))
+            self.calls.append(call)
+
+    def _shares(self, call):
+        """Yields (sheet, phase, share of the call, cells) for every sheet a call touched."""
+        if not call['sheets']:
+            yield None, METADATA_PHASE, 1.0, call['cells']
+            return
+        total = sum(call['sheet_cells']) or len(call['sheets'])
+        for sheet, cells in zip(call['sheets'], call['sheet_cells']):
+            share = (cells if sum(call['sheet_cells']) else 1) / total
+            yield sheet, self.phases.get(sheet, 'other'), share, cells
+
+    def summary(self):
+        """Returns totals for the run, per phase and per sheet."""
+        def empty():
+            return {'calls': 0, 'latency_ms': 0.0, 'bytes': 0, 'cells': 0, 'retries': 0, 'quota_errors': 0}
+
+        def add(bucket, call, share, cells, counted=True):
+            if counted:
+                bucket['calls'] += 1
+                bucket['retries'] += call['attempt'] > 0
+                bucket['quota_errors'] += call['quota_error']
+            bucket['latency_ms'] += call['duration'] * 1000 * share
+            bucket['bytes'] += round(call['bytes'] * share)
+            bucket['cells'] += cells
+
+        totals = empty()
+        phases = defaultdict(empty)
+        sheets = defaultdict(empty)
+        for call in self.calls:
+            add(totals, call, 1.0, call['cells'])
+            seen_phases = set()
+            for sheet, phase, share, cells in self._shares(call):
+                # A call is counted once per phase, however many of its sheets belong to it.
+                add(phases[phase], call, share, cells, counted=phase not in seen_phases)
+                seen_phases.add(phase)
+                if sheet is not None:
+                    add(sheets[sheet], call, share, cells)
+
+        def rounded(bucket):
+            return dict(bucket, latency_ms=round(bucket['latency_ms'], 2))
+
+        return {
+            'wall_seconds': round(time.perf_counter() - self.started, 3),
+            'totals': rounded(totals),
+            'phases': {phase: rounded(bucket) for phase, bucket in phases.items()},
+            'sheets': {sheet: rounded(bucket) for sheet, bucket in sheets.items()},
+        }
+
+    def write_json(self, path):
+        report = self.summary()
+        report['calls'] = [{
+            'method': call['method'],
+            'sheets': call['sheets'],
+            'start_ms': round((call['start'] - self.started) * 1000, 3),
+            'latency_ms': round(call['duration'] * 1000, 3),
+            'bytes': call['bytes'],
+            'cells': call['cells'],
+            'attempt': call['attempt'],
+            'status': call['status'],
+        } for call in self.calls]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        return path
+
+    def write_trace(self, path):
+        """Writes the calls as complete ('X') events in the Chrome trace event format."""
+        events = []
+        for call in self.calls:
+            phases = {phase for _, phase, _, _ in self._shares(call)}
+            phase = phases.pop() if len(phases) == 1 else 'mixed'
+
+            label = call['sheets'][0] if len(call['sheets']) == 1 else f"{len(call['sheets'])} sheets"
+            events.append({
+                'name': f"{call['method']} {label}" if call['sheets'] else call['method'],
+                'cat': phase,
+                'ph': 'X',
+                'ts': round((call['start'] - self.started) * 1e6),
+                'dur': round(call['duration'] * 1e6),
+                'pid': 1,
+                'tid': call['thread'],
+                'args': {key: call[key] for key in ('sheets', 'bytes', 'cells', 'attempt', 'status')},
+            })
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f, ensure_ascii=False)
+        return path
+
+
+class InstrumentedRequest:
+    """Wraps a request so each execute() (including retries) becomes one call record."""
+
+    def __init__(self, request, metrics, method, kwargs):
+        self._request = request
+        self._metrics = metrics
+        self._method = method
+        self._attempts = 0
+        self._received = 0
+        if hasattr(request, 'postproc'):
+            # HttpRequest.execute hands the raw body to postproc; measuring it
+            # there avoids re-serializing large responses.
+            postproc = request.postproc
+
+            def measured(resp, content):
+                self._received = len(content or b'')
+                return postproc(resp, content)
+            request.postproc = measured
+        if 'ranges' in kwargs:
+            self._sheets = [_sheet_from_range(a1_range) for a1_range in kwargs['ranges']]
+        elif 'range' in kwargs:
+            self._sheets = [_sheet_from_range(kwargs['range'])]
+        else:
+            self._sheets = []
+
+    def __getattr__(self, name):
+        return getattr(self._request, name)
+
+    def execute(self, *args, **kwargs):
+        attempt = self._attempts
+        self._attempts += 1
+        call = {'method': self._method, 'sheets': self._sheets, 'attempt': attempt,
+                'bytes': 0, 'cells': 0, 'sheet_cells': [0] * len(self._sheets),
+                'quota_error': False, 'status': 200}
+        call['start'] = time.perf_counter()
+        try:
+            response = self._request.execute(*args, **kwargs)
+        except HttpError as err:
+            call['duration'] = time.perf_counter() - call['start']
+            call['status'] = err.resp.status
+            call['quota_error'] = is_quota_error(err)
+            call['bytes'] = len(err.content or b'')
+            self._metrics.record(call)
+            raise
+        call['duration'] = time.perf_counter() - call['start']
+        call['bytes'] = self._received
+        if 'valueRanges' in response:
+            call['sheet_cells'] = [_count_cells(value_range) for value_range in response['valueRanges']]
+        elif 'values' in response:
+            call['sheet_cells'] = [_count_cells(response)]
+        call['cells'] = sum(call['sheet_cells'])
+        self._metrics.record(call)
+        return response
+
+
+class InstrumentedResource:
+    """Proxies a service or resource; request-building methods return InstrumentedRequests."""
+
+    def __init__(self, resource, metrics, path=()):
+        self._resource = resource
+        self._metrics = metrics
+        self._path = path
+
+    def __getattr__(self, name):
+        attr = getattr(self._resource, name)
+        if not callable(attr):
+            return attr
+        path = self._path + (name,)
+
+        def wrapper(*args, **kwargs):
+            result = attr(*args, **kwargs)
+            if hasattr(result, 'execute'):
+                return InstrumentedRequest(result, self._metrics, '.'.join(path), kwargs)
+            return InstrumentedResource(result, self._metrics, path)
+        return wrapper
+
+
+def instrument(service, metrics):
+    """Returns a proxy of service that records every executed request in metrics."""
+    return InstrumentedResource(service, metrics)
+
+
+def print_totals(metrics):
+    """Prints the API totals of a run."""
+    totals = metrics.summary()['totals']
+    print(f"\nAPI: {totals['calls']} calls, {totals['latency_ms'] / 1000:.2f}s, {totals['bytes']:,} bytes, "
+          f"{totals['cells']:,} cells, {totals['retries']} retries, {totals['quota_errors']} quota errors")
+
+
+def write_metrics(metrics, output_dir, timestamp, trace=False, prefix=''):
+    """
+    Prints the API totals of a run and writes <prefix>metrics_<timestamp>.json
+    (and <prefix>trace_<timestamp>.json) into output_dir.
+    """
+    print_totals(metrics)
+    print(f"Metrics saved to: {metrics.write_json(os.path.join(output_dir, f'{prefix}metrics_{timestamp}.json'))}")
+    if trace:
+        print(f"Trace saved to: {metrics.write_trace(os.path.join(output_dir, f'{prefix}trace_{timestamp}.json'))}")
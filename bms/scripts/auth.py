@@ -1,15 +1,30 @@
+import datetime
+import json
 import os.path
+import threading
+from functools import lru_cache
 
+import google_auth_httplib2
+import httplib2
+from google.auth.exceptions import RefreshError
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
+from googleapiclient.discovery import DISCOVERY_URI, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 
+from api_metrics import instrument
+
 # Define the paths relative to this file's location
 AUTH_DIR = os.path.dirname(os.path.abspath(__file__))
 CREDENTIALS_PATH = os.path.join(AUTH_DIR, 'credentials.json')
 TOKEN_PATH = os.path.join(AUTH_DIR, 'token.json')
+DISCOVERY_CACHE_DIR = os.path.join(AUTH_DIR, 'discovery_cache')
+
+# Credentials are refreshed this long before they expire, so a request never
+# starts with a token that runs out mid-flight.
+REFRESH_MARGIN = datetime.timedelta(minutes=5)
 
 # If modifying these scopes, delete the file token.json.
 SCOPES = [
@@ -17,33 +32,166 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive.file" # Added scope to manage files (for deletion)
 ]
 
-def get_authenticated_service(service_name, version):
+# Spreadsheet revision checks (--incremental, --watch) also read Drive
+# metadata. Only those runs ask for it; a token without it is sent through
+# the consent screen once.
+REVISION_SCOPES = SCOPES + ["https://www.googleapis.com/auth/drive.metadata.readonly"]
+
+_credentials = None
+_credentials_lock = threading.Lock()
+_thread_state = threading.local()
+_fake_backend = None
+
+def _needs_refresh(creds):
+    if not creds.valid:
+        return True
+    # google-auth stores expiry as a naive UTC datetime
+    now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+    return creds.expiry is not None and creds.expiry - REFRESH_MARGIN <= now
+
+def _save_token(creds):
+    """Writes token.json, unless it already holds exactly these credentials."""
+    token_json = creds.to_json()
+    if os.path.exists(TOKEN_PATH):
+        with open(TOKEN_PATH, "r") as token:
+            if token.read() == token_json:
+                return
+    with open(TOKEN_PATH, "w") as token:
+        token.write(token_json)
+
+def _run_consent_flow(scopes):
+    flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_PATH, scopes)
+    return flow.run_local_server(port=0)
+
+def get_credentials(scopes=SCOPES):
+    """
+    Returns valid user credentials covering the given scopes.
+    Handles the OAuth 2.0 flow, including token creation and refresh.
+    Credentials are kept for the life of the process and refreshed once they
+    are within REFRESH_MARGIN of expiring. A token is always refreshed with
+    the scopes it was granted; when more are needed, or the refresh is
+    rejected, the user is asked to consent again.
+    """
+    global _credentials
+    with _credentials_lock:
+        creds = _credentials
+        if creds is not None and creds.has_scopes(scopes) and not _needs_refresh(creds):
+            return creds
+
+        # The file token.json stores the user's access and refresh tokens, and is
+        # created automatically when the authorization flow completes for the first
+        # time. It is loaded with its own scopes: refreshing with a scope that
+        # was never granted fails with invalid_scope.
+        if creds is None and os.path.exists(TOKEN_PATH):
+            creds = Credentials.from_authorized_user_file(TOKEN_PATH)
+
+        # Asking for more access keeps what the token already had.
+        if creds and not creds.has_scopes(scopes):
+            scopes = sorted(set(scopes) | set(creds.scopes or []))
+            creds = None
+
+        # If there are no (valid) credentials available, let the user log in.
+        if not creds or _needs_refresh(creds):
+            if creds and creds.refresh_token:
+                try:
+                    creds.refresh(Request())
+                except RefreshError as err:
+                    print(f"Could not refresh the saved token, asking for consent again: {err}")
+                    creds = _run_consent_flow(sorted(set(scopes) | set(creds.scopes or [])))
+            else:
+                creds = _run_consent_flow(scopes)
+
+            # Save the credentials for the next run
+            _save_token(creds)
+
+        _credentials = creds
+        return creds
+
+@lru_cache(maxsize=None)
+def discovery_document(service_name, version):
+    """
+    Returns the parsed discovery document of an API without a network round
+    trip when possible: first the local discovery cache, then the static
+    documents bundled with google-api-python-client. Only an API missing from
+    both is downloaded, and the download is cached for the next run.
+    """
+    path = os.path.join(DISCOVERY_CACHE_DIR, f"{service_name}.{version}.json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    document = get_static_doc(service_name, version)
+    if document is None:
+        uri = DISCOVERY_URI.format(api=service_name, apiVersion=version)
+        response, document = httplib2.Http().request(uri)
+        if response.status >= 400:
+            raise HttpError(response, document, uri=uri)
+        os.makedirs(DISCOVERY_CACHE_DIR, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(document)
+    return json.loads(document)
+
+def use_fake_backend(workbook):
+    """
+    Serves every API client from an offline FakeWorkbook (or the live APIs
+    again with None). No credentials are loaded while a fake is active.
+    Only test harnesses call this, e.g. `fake_sheets.py replay`.
+    """
+    global _fake_backend
+    _fake_backend = workbook
+
+def fake_backend():
+    """Returns the FakeWorkbook installed with use_fake_backend, if any."""
+    return _fake_backend
+
+def thread_http(scopes=SCOPES):
+    """
+    Returns this thread's authorized HTTP transport. The transport is created
+    once per thread and keeps its connections alive between requests.
+    Returns None while a fake backend is active.
+    """
+    if fake_backend() is not None:
+        return None
+    creds = get_credentials(scopes)
+    http = getattr(_thread_state, 'http', None)
+    if http is None or http.credentials is not creds:
+        http = _thread_state.http = authorized_http(creds)
+        _thread_state.services = {}
+    return http
+
+def get_authenticated_service(service_name, version, scopes=SCOPES, metrics=None):
     """
     Authenticates with a Google API and returns a service object.
     Handles the OAuth 2.0 flow, including token creation and refresh.
+    Service objects are built from the cached discovery document and reused
+    within a thread, on top of the thread's pooled transport. With metrics
+    (an api_metrics.ApiMetrics), every executed request is recorded in it.
     """
-    creds = None
-    # The file token.json stores the user's access and refresh tokens, and is
-    # created automatically when the authorization flow completes for the first
-    # time.
-    if os.path.exists(TOKEN_PATH):
-        creds = Credentials.from_authorized_user_file(TOKEN_PATH, SCOPES)
-
-    # If there are no (valid) credentials available, let the user log in.
-    if not creds or not creds.valid:
-        if creds and creds.expired and creds.refresh_token:
-            creds.refresh(Request())
-        else:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                CREDENTIALS_PATH, SCOPES
+    if fake_backend() is not None:
+        service = fake_backend()
+    else:
+        http = thread_http(scopes)
+        services = _thread_state.services
+        service = services.get((service_name, version))
+        if service is None:
+            service = services[(service_name, version)] = build_from_document(
+                discovery_document(service_name, version), http=http
             )
-            creds = flow.run_local_server(port=0)
-            
-        # Save the credentials for the next run
-        with open(TOKEN_PATH, "w") as token:
-            token.write(creds.to_json())
+    return instrument(service, metrics) if metrics is not None else service
 
-    return build(service_name, version, credentials=creds)
+def clear_client_cache():
+    """Forgets the cached credentials, discovery documents and this thread's clients."""
+    global _credentials
+    with _credentials_lock:
+        _credentials = None
+    discovery_document.cache_clear()
+    _thread_state.__dict__.clear()
+
+def authorized_http(creds):
+    """
+    Returns a new authorized HTTP transport for the given credentials.
+    httplib2 is not thread-safe, so every thread needs its own transport.
+    """
+    return google_auth_httplib2.AuthorizedHttp(creds, http=httplib2.Http())
 
 def main():
     """
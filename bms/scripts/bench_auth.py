@@ -0,0 +1,81 @@
+"""
+Start-up benchmark for API client construction.
+
+Compares the original per-call path (read token.json, build() with a fresh
+HTTP transport and a freshly parsed discovery document) with the cached
+client factory in auth.py, cold (first call in a process) and warm (every
+later call). Runs offline: the token is a placeholder that is valid for an
+hour, written to a temporary token.json, so no refresh or request is made.
+
+Usage: python3 bench_auth.py [--repeat N]
+"""
+import argparse
+import datetime
+import json
+import os
+import tempfile
+import time
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+import auth
+
+APIS = [("sheets", "v4"), ("drive", "v3")]
+
+
+def write_placeholder_token(path):
+    expiry = datetime.datetime.now(datetime.timezone.utc) + datetime.timedelta(hours=1)
+    with open(path, 'w') as f:
+        json.dump({
+            'token': 'benchmark', 'refresh_token': 'benchmark', 'client_id': 'benchmark',
+            'client_secret': 'benchmark', 'scopes': auth.SCOPES,
+            'expiry': expiry.strftime('%Y-%m-%dT%H:%M:%SZ'),
+        }, f)
+
+
+def legacy_start():
+    """The original get_authenticated_service: load the token and build() for every API."""
+    for service_name, version in APIS:
+        creds = Credentials.from_authorized_user_file(auth.TOKEN_PATH, auth.SCOPES)
+        build(service_name, version, credentials=creds)
+
+
+def factory_start():
+    for service_name, version in APIS:
+        auth.get_authenticated_service(service_name, version)
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API client construction, cold and warm.")
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        auth.TOKEN_PATH = os.path.join(directory, 'token.json')
+        write_placeholder_token(auth.TOKEN_PATH)
+        modified = os.path.getmtime(auth.TOKEN_PATH)
+
+        legacy = min(timed(legacy_start) for _ in range(args.repeat))
+        cold = []
+        for _ in range(args.repeat):
+            auth.clear_client_cache()
+            cold.append(timed(factory_start))
+        warm = min(timed(factory_start) for _ in range(args.repeat))
+        rewritten = os.path.getmtime(auth.TOKEN_PATH) != modified
+
+    print(f"Clients for {', '.join(f'{name} {version}' for name, version in APIS)} (best of {args.repeat})")
+    print(f"{'legacy build()':>16}: {legacy * 1000:8.2f} ms")
+    print(f"{'factory, cold':>16}: {min(cold) * 1000:8.2f} ms  ({legacy / min(cold):.1f}x)")
+    print(f"{'factory, warm':>16}: {warm * 1000:8.3f} ms  ({legacy / warm:.0f}x)")
+    print(f"token.json rewritten: {'yes' if rewritten else 'no'}")
+
+
+if __name__ == "__main__":
+    main()
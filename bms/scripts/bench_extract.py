@@ -0,0 +1,147 @@
+"""
+Offline benchmark suite for the formula extractor.
+
+Runs main.py's extraction pipeline against synthetic BMS workbooks served by
+fake_sheets.py at 1x, 10x and 100x the base size: the template, the summary
+sheets and BASE_HOUSE_SHEETS house sheets per 1x. The benchmark system has no
+template configured, so every house sheet is extracted. Each scale runs in a
+fresh process, which keeps the peak RSS figures independent.
+
+Reports wall time, API calls, peak RSS and formulas (rows) per second, and
+flags regressions against bench_baseline.json: wall time or peak RSS more
+than TOLERANCE above the baseline, or more API calls. The exit status is 1
+when a regression is found.
+
+Usage: python3 bench_extract.py [--mode sequential|batch|workers|paged] [--scales 1 10 100]
+                                [--export export_csv] [--save-baseline]
+"""
+import argparse
+import contextlib
+import csv
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+import auth
+import main
+from fake_sheets import latest_export, synthetic_workbook
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(SCRIPTS_DIR, 'bench_baseline.json')
+BASE_HOUSE_SHEETS = 10
+DEFAULT_SCALES = [1, 10, 100]
+MODES = ('sequential', 'batch', 'workers', 'paged')
+TOLERANCE = 0.25
+
+BENCH_SYSTEM = 'bench'
+BENCH_CONFIG = {
+    'templateSheetName': None,
+    'houseSheetNamePattern': r'^(Copy of \d{4} E \d{2} ST \d?|\d{4} E \d{2} ST \d?)$',
+    'otherSheetsToProcess': ['Summary', 'Monthly payment'],
+}
+
+
+def run_scale(scale, mode, export_csv):
+    """Runs one extraction in this process and returns its measurements."""
+    workbook = synthetic_workbook(export_csv, BASE_HOUSE_SHEETS * scale)
+    auth.use_fake_backend(workbook)
+    with tempfile.TemporaryDirectory() as directory:
+        os.chdir(directory)
+        with open('config.json', 'w') as f:
+            json.dump({BENCH_SYSTEM: {'spreadsheet_id': 'bench', 'config': BENCH_CONFIG}}, f)
+        options = {
+            'sequential': {},
+            'batch': {'batch_size': main.DEFAULT_BATCH_SIZE},
+            'workers': {'workers': main.DEFAULT_MAX_WORKERS, 'requests_per_minute': 10 ** 9},
+            'paged': {'page_cells': main.DEFAULT_PAGE_CELLS, 'requests_per_minute': 10 ** 9},
+        }[mode]
+        start = time.perf_counter()
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            main.main(BENCH_SYSTEM, **options)
+        wall = time.perf_counter() - start
+        export_dir = os.path.join('formula_exports', BENCH_SYSTEM)
+        rows = 0
+        for name in os.listdir(export_dir):
+            if not name.startswith('formulas_'):
+                continue
+            with open(os.path.join(export_dir, name), 'r', encoding='utf-8', newline='') as f:
+                rows += sum(1 for _ in csv.reader(f)) - 1
+        os.chdir(SCRIPTS_DIR)
+    return {
+        'scale': scale,
+        'sheets': len(workbook.sheets),
+        'rows': rows,
+        'wall_seconds': round(wall, 3),
+        'api_calls': sum(workbook.calls.values()),
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'rows_per_second': round(rows / wall) if wall else None,
+    }
+
+
+def regressions(result, baseline):
+    """Returns a description of every metric that got worse than the baseline."""
+    if not baseline:
+        return []
+    found = []
+    for key in ('wall_seconds', 'peak_rss_mb'):
+        if result[key] > baseline[key] * (1 + TOLERANCE):
+            found.append(f"{key} {baseline[key]} -> {result[key]}")
+    if result['api_calls'] > baseline['api_calls']:
+        found.append(f"api_calls {baseline['api_calls']} -> {result['api_calls']}")
+    return found
+
+
+def main_suite():
+    parser = argparse.ArgumentParser(description="Benchmark the extractor offline at several workbook sizes.")
+    parser.add_argument('--mode', choices=MODES, default='batch')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES)
+    parser.add_argument('--export', default=latest_export(), help="Formula export the workbooks are built from")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the new baseline")
+    parser.add_argument('--run-scale', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if not args.export:
+        parser.error("No export CSV found; pass one with --export.")
+
+    if args.run_scale is not None:
+        print(json.dumps(run_scale(args.run_scale, args.mode, os.path.abspath(args.export))))
+        return 0
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, 'r') as f:
+            baselines = json.load(f)
+    mode_baseline = baselines.get(args.mode, {})
+
+    print(f"Mode: {args.mode}, {BASE_HOUSE_SHEETS} house sheets per 1x, export {os.path.basename(args.export)}")
+    print(f"{'scale':>6} {'sheets':>7} {'rows':>10} {'wall s':>8} {'calls':>6} {'RSS MB':>8} {'rows/s':>10}")
+    results = {}
+    failed = False
+    for scale in args.scales:
+        output = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '--mode', args.mode, '--export', args.export,
+             '--run-scale', str(scale)],
+            cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True,
+        ).stdout
+        result = results[str(scale)] = json.loads(output.strip().splitlines()[-1])
+        print(f"{str(scale) + 'x':>6} {result['sheets']:>7} {result['rows']:>10} {result['wall_seconds']:>8.2f} "
+              f"{result['api_calls']:>6} {result['peak_rss_mb']:>8.1f} {result['rows_per_second']:>10}")
+        for problem in regressions(result, mode_baseline.get(str(scale))):
+            print(f"       REGRESSION: {problem}")
+            failed = True
+
+    if args.save_baseline:
+        baselines[args.mode] = dict(mode_baseline, **results)
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=2)
+        print(f"Baseline saved to: {BASELINE_PATH}")
+    elif not mode_baseline:
+        print("No baseline for this mode yet; run with --save-baseline to store one.")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main_suite())
@@ -0,0 +1,63 @@
+"""
+Throughput benchmark for formula_parser.py over the formula exports.
+
+Reports tokenizer throughput, uncached parsing, and parsing through the
+memoized parse_formula with a cold and a warm cache.
+
+Usage: python3 bench_parser.py [export_csv ...]
+"""
+import csv
+import glob
+import os
+import sys
+import time
+
+from formula_parser import (
+    FormulaSyntaxError, _Parser, clear_parse_cache, normalize_formula,
+    parse_cache_info, parse_formula, tokenize,
+)
+
+EXPORTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exports')
+
+
+def load_formulas(paths):
+    formulas = []
+    for path in paths:
+        with open(path, 'r', encoding='utf-8') as f:
+            formulas.extend(row['Formula'] for row in csv.DictReader(f))
+    return formulas
+
+
+def timed(label, formulas, fn):
+    failures = 0
+    start = time.perf_counter()
+    for formula in formulas:
+        try:
+            fn(formula)
+        except FormulaSyntaxError:
+            failures += 1
+    elapsed = time.perf_counter() - start
+    megabytes = sum(len(formula) for formula in formulas) / 1e6
+    print(f"{label:>22}: {elapsed * 1000:8.1f} ms  {len(formulas) / elapsed:10,.0f} formulas/s  "
+          f"{megabytes / elapsed:6.2f} MB/s  ({failures} unparseable)")
+
+
+def main():
+    paths = sys.argv[1:] or sorted(glob.glob(os.path.join(EXPORTS_DIR, 'formulas_*.csv')))
+    if not paths:
+        print("No export CSVs found; pass them explicitly.")
+        return
+    formulas = load_formulas(paths)
+    print(f"{len(formulas)} formulas ({len(set(formulas))} distinct) from {len(paths)} file(s)")
+
+    timed('tokenize', formulas, lambda formula: tokenize(normalize_formula(formula)))
+    timed('parse, no cache', formulas, lambda formula: _Parser(tokenize(normalize_formula(formula))).parse())
+    clear_parse_cache()
+    timed('parse, cold cache', formulas, parse_formula)
+    timed('parse, warm cache', formulas, parse_formula)
+    info = parse_cache_info()
+    print(f"Parse cache: {info.hits} hits, {info.misses} misses, {info.currsize} entries")
+
+
+if __name__ == "__main__":
+    main()
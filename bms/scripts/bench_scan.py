@@ -0,0 +1,113 @@
+"""
+Micro-benchmark for the formula scan in main.py.
+
+Builds a 1001 x 50 value matrix shaped like the house template from the
+latest BMS formula export, then times the original per-cell loop against
+the current scanning core (and a NumPy object-array pass when NumPy is
+installed).
+
+Usage: python3 bench_scan.py [export_csv] [--repeat N]
+"""
+import argparse
+import csv
+import glob
+import itertools
+import os
+import time
+
+from a1 import column_letter, parse_cell
+from main import extract_formulas_from_values
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ROWS = 1001
+COLUMNS = 50
+TEMPLATE_SHEET = 'House template (TEMPLATE)'
+EXPORTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exports')
+
+
+def build_template_matrix(export_csv):
+    """Returns a ROWS x COLUMNS matrix with the template's formulas in place and numbers elsewhere."""
+    values = [[(r * COLUMNS + c) % 7 or '' for c in range(COLUMNS)] for r in range(ROWS)]
+    with open(export_csv, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            if row['Sheet Name'] != TEMPLATE_SHEET:
+                continue
+            r_idx, c_idx = parse_cell(row['Cell'])
+            if r_idx < ROWS and c_idx < COLUMNS:
+                values[r_idx][c_idx] = row['Formula']
+    return values
+
+
+def scan_legacy(values):
+    """The original scan: isinstance check per cell and a while loop per column name."""
+    formulas = []
+    for r_idx, row in enumerate(values):
+        for c_idx, cell_value in enumerate(row):
+            if isinstance(cell_value, str) and cell_value.startswith('='):
+                temp_c_idx = c_idx
+                col_str = ""
+                while temp_c_idx >= 0:
+                    col_str = chr(temp_c_idx % 26 + ord('A')) + col_str
+                    temp_c_idx = temp_c_idx // 26 - 1
+                formulas.append({'Sheet Name': TEMPLATE_SHEET, 'Cell': f"{col_str}{r_idx + 1}", 'Formula': cell_value})
+    return formulas
+
+
+def scan_current(values):
+    return list(extract_formulas_from_values(TEMPLATE_SHEET, values))
+
+
+def scan_numpy(values):
+    """Flattens the ragged matrix into an object array and masks '=' cells with one ufunc pass."""
+    lengths = np.fromiter(map(len, values), dtype=np.intp, count=len(values))
+    flat = np.fromiter(itertools.chain.from_iterable(values), dtype=object, count=int(lengths.sum()))
+    is_formula = np.frompyfunc(lambda v: v.__class__ is str and v[:1] == '=', 1, 1)
+    hits = np.flatnonzero(is_formula(flat).astype(bool))
+    starts = np.cumsum(lengths) - lengths
+    rows = np.searchsorted(starts, hits, side='right') - 1
+    cols = hits - starts[rows]
+    return [
+        {'Sheet Name': TEMPLATE_SHEET, 'Cell': f"{column_letter(c)}{r + 1}", 'Formula': values[r][c]}
+        for r, c in zip(rows.tolist(), cols.tolist())
+    ]
+
+
+def best_time(fn, values, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(values)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    exports = sorted(glob.glob(os.path.join(EXPORTS_DIR, 'formulas_*.csv')))
+    parser = argparse.ArgumentParser(description="Benchmark the formula scan on a template-sized matrix.")
+    parser.add_argument('export_csv', nargs='?', default=exports[-1] if exports else None)
+    parser.add_argument('--repeat', type=int, default=30)
+    args = parser.parse_args()
+    if not args.export_csv:
+        parser.error("No export CSV found; pass one explicitly.")
+
+    values = build_template_matrix(args.export_csv)
+    expected = scan_legacy(values)
+    print(f"Matrix: {ROWS} x {COLUMNS}, {len(expected)} formulas (best of {args.repeat})")
+
+    scanners = [('legacy loop', scan_legacy), ('current core', scan_current)]
+    if np is not None:
+        scanners.append(('numpy object array', scan_numpy))
+    baseline = None
+    for name, fn in scanners:
+        assert fn(values) == expected, f"{name} disagrees with the legacy scan"
+        elapsed = best_time(fn, values, args.repeat)
+        baseline = baseline or elapsed
+        print(f"{name:>20}: {elapsed * 1000:7.2f} ms  ({baseline / elapsed:.2f}x)")
+
+
+if __name__ == "__main__":
+    main()
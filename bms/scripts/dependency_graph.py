@@ -0,0 +1,367 @@
+"""
+Precedent/dependent graph over a formula export.
+
+Every formula cell becomes a node whose precedents are the ranges its
+formula references. Ranges are interned and indexed with per-sheet interval
+trees over their columns, so a reference such as $B$19:$B$1001 is one entry
+instead of 983 expanded cells, and "what reads this cell" is a tree query.
+
+Cells whose formulas call INDIRECT or OFFSET build their references at
+recalculation time. They are kept as dynamic nodes: their static references
+are still indexed, and queries report them separately instead of dropping
+them.
+
+Usage:
+    python3 dependency_graph.py <formulas.csv> dependents "Summary!C5"
+    python3 dependency_graph.py <formulas.csv> precedents "Summary!C5"
+    python3 dependency_graph.py <formulas.csv> feeds "Monthly payment"
+    python3 dependency_graph.py <formulas.csv> stats
+"""
+import bisect
+import csv
+import re
+import sys
+from collections import Counter, defaultdict
+
+from a1 import cell_name, column_index, column_letter, parse_cell
+from formula_parser import FormulaSyntaxError, Function, Reference, parse_formula, walk
+
+# Open-ended ranges (B:B, $F$5:$F, 1:1) extend to this row or column index.
+UNBOUNDED = 10 ** 9
+
+DYNAMIC_FUNCTIONS = {'INDIRECT', 'OFFSET'}
+
+TEMPLATE_SUFFIX = ' (TEMPLATE)'
+
+_ROW_ONLY = re.compile(r'^\$?(\d+)$')
+_COLUMN_ONLY = re.compile(r'^\$?([A-Z]{1,3})$')
+
+
+def sheet_from_export_name(export_name):
+    """Returns the real sheet name of an export row ('House template (TEMPLATE)' -> 'House template')."""
+    if export_name.endswith(TEMPLATE_SUFFIX):
+        return export_name[:-len(TEMPLATE_SUFFIX)]
+    return export_name
+
+
+def _bound(a1_part):
+    """Returns (row, col) of one end of a reference; None marks an open row or column."""
+    row_match = _ROW_ONLY.match(a1_part)
+    if row_match:
+        return int(row_match.group(1)) - 1, None
+    column_match = _COLUMN_ONLY.match(a1_part)
+    if column_match:
+        return None, column_index(column_match.group(1))
+    return parse_cell(a1_part)
+
+
+def _span(start, end):
+    if start is None and end is None:
+        return 0, UNBOUNDED
+    if start is None or end is None:
+        # Open-ended ranges such as $F$5:$F run from the given bound onwards.
+        return (end if start is None else start), UNBOUNDED
+    return min(start, end), max(start, end)
+
+
+def reference_bounds(reference):
+    """Returns the zero-based (first row, last row, first col, last col) covered by a Reference."""
+    start_row, start_col = _bound(reference.start)
+    end_row, end_col = _bound(reference.end) if reference.end else (start_row, start_col)
+    return _span(start_row, end_row) + _span(start_col, end_col)
+
+
+def format_range(sheet, first_row, last_row, first_col, last_col):
+    """Returns the A1 text of a range key, e.g. Summary!C5 or House template!B19:B1001."""
+    prefix = f"{sheet}!"
+    start_col = column_letter(first_col) if last_col != UNBOUNDED or first_col else ''
+    end_col = column_letter(last_col) if last_col != UNBOUNDED else ''
+    start_row = str(first_row + 1) if last_row != UNBOUNDED or first_row else ''
+    end_row = str(last_row + 1) if last_row != UNBOUNDED else ''
+    start = f"{start_col}{start_row}"
+    end = f"{end_col}{end_row}"
+    if first_row == last_row and first_col == last_col:
+        return prefix + start
+    return f"{prefix}{start}:{end}"
+
+
+def parse_cell_spec(spec):
+    """Splits 'Sheet!A1' or "'My Sheet'!A1" into (sheet, row, col)."""
+    sheet, _, cell = spec.rpartition('!')
+    if sheet.startswith("'") and sheet.endswith("'"):
+        sheet = sheet[1:-1].replace("''", "'")
+    row, col = parse_cell(cell)
+    return sheet, row, col
+
+
+class IntervalTree:
+    """
+    Static centered interval tree over closed integer intervals. Built once
+    from (start, end, value) triples; stab(point) returns the values of every
+    interval containing the point in O(log n + k).
+    """
+
+    def __init__(self, intervals):
+        self.root = self._build(list(intervals))
+
+    def _build(self, intervals):
+        if not intervals:
+            return None
+        points = sorted(p for start, end, _ in intervals for p in (start, end))
+        center = points[len(points) // 2]
+        left, right, here = [], [], []
+        for interval in intervals:
+            if interval[1] < center:
+                left.append(interval)
+            elif interval[0] > center:
+                right.append(interval)
+            else:
+                here.append(interval)
+        by_start = sorted(here, key=lambda interval: interval[0])
+        by_end = sorted(here, key=lambda interval: -interval[1])
+        return (center, by_start, by_end, self._build(left), self._build(right))
+
+    def stab(self, point):
+        found = []
+        node = self.root
+        while node is not None:
+            center, by_start, by_end, left, right = node
+            if point < center:
+                for start, _, value in by_start:
+                    if start > point:
+                        break
+                    found.append(value)
+                node = left
+            else:
+                for _, end, value in by_end:
+                    if end < point:
+                        break
+                    found.append(value)
+                node = right if point > center else None
+        return found
+
+
+class DependencyGraph:
+    """
+    Adjacency index over the formula cells of an export. Formula cells and
+    referenced ranges are interned to integer ids; cell ids map to tuples of
+    range ids (precedents) and range ids map to lists of cell ids (dependents).
+    """
+
+    def __init__(self):
+        self.cells = []           # cell id -> (sheet, row, col)
+        self.cell_ids = {}
+        self.formulas = []        # cell id -> formula text
+        self.precedents = []      # cell id -> tuple of range ids
+        self.ranges = []          # range id -> (sheet, first row, last row, first col, last col)
+        self.range_ids = {}
+        self.range_dependents = []  # range id -> list of cell ids
+        self.dynamic = {}         # cell id -> sorted tuple of dynamic function names
+        self.unparsed = []        # cell ids whose formulas could not be parsed
+        self._column_trees = None
+        self._formula_rows = None
+
+    @classmethod
+    def from_csv(cls, path):
+        graph = cls()
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            graph.add_formulas(csv.DictReader(f))
+        return graph
+
+    def add_formulas(self, formulas):
+        """Adds per-cell formula records ({'Sheet Name', 'Cell', 'Formula'}) to the graph."""
+        for record in formulas:
+            sheet = sheet_from_export_name(record['Sheet Name'])
+            row, col = parse_cell(record['Cell'])
+            self.add_cell(sheet, row, col, record['Formula'])
+
+    def add_cell(self, sheet, row, col, formula):
+        cell_id = len(self.cells)
+        self.cells.append((sheet, row, col))
+        self.cell_ids[(sheet, row, col)] = cell_id
+        self.formulas.append(formula)
+        self._column_trees = self._formula_rows = None
+        try:
+            tree = parse_formula(formula)
+        except FormulaSyntaxError:
+            self.unparsed.append(cell_id)
+            self.precedents.append(())
+            return cell_id
+
+        range_ids = []
+        dynamic = set()
+        for node in walk(tree):
+            if isinstance(node, Reference):
+                key = (node.sheet or sheet,) + reference_bounds(node)
+                range_id = self.range_ids.get(key)
+                if range_id is None:
+                    range_id = self.range_ids[key] = len(self.ranges)
+                    self.ranges.append(key)
+                    self.range_dependents.append([])
+                if range_id not in range_ids:
+                    range_ids.append(range_id)
+                    self.range_dependents[range_id].append(cell_id)
+            elif isinstance(node, Function) and node.name in DYNAMIC_FUNCTIONS:
+                dynamic.add(node.name)
+        self.precedents.append(tuple(range_ids))
+        if dynamic:
+            self.dynamic[cell_id] = tuple(sorted(dynamic))
+        return cell_id
+
+    # --- Indexes ---
+
+    def _build_indexes(self):
+        by_sheet = defaultdict(list)
+        for range_id, (sheet, _, _, first_col, last_col) in enumerate(self.ranges):
+            by_sheet[sheet].append((first_col, last_col, range_id))
+        self._column_trees = {sheet: IntervalTree(intervals) for sheet, intervals in by_sheet.items()}
+
+        formula_rows = defaultdict(list)
+        for cell_id, (sheet, row, col) in enumerate(self.cells):
+            formula_rows[(sheet, col)].append((row, cell_id))
+        for rows in formula_rows.values():
+            rows.sort()
+        self._formula_rows = formula_rows
+
+    def ranges_containing(self, sheet, row, col):
+        """Returns the ids of every referenced range that covers a cell."""
+        if self._column_trees is None:
+            self._build_indexes()
+        tree = self._column_trees.get(sheet)
+        if tree is None:
+            return []
+        return [range_id for range_id in tree.stab(col)
+                if self.ranges[range_id][1] <= row <= self.ranges[range_id][2]]
+
+    def formula_cells_in(self, range_id):
+        """Returns the ids of the formula cells inside a referenced range."""
+        if self._formula_rows is None:
+            self._build_indexes()
+        sheet, first_row, last_row, first_col, last_col = self.ranges[range_id]
+        cell_ids = []
+        columns = {col for (row_sheet, col) in self._formula_rows if row_sheet == sheet} \
+            if last_col == UNBOUNDED else range(first_col, last_col + 1)
+        for col in columns:
+            rows = self._formula_rows.get((sheet, col))
+            if not rows:
+                continue
+            start = bisect.bisect_left(rows, (first_row, -1))
+            end = bisect.bisect_right(rows, (last_row, len(self.cells)))
+            cell_ids.extend(cell_id for _, cell_id in rows[start:end])
+        return cell_ids
+
+    # --- Queries ---
+
+    def dependents(self, sheet, row, col):
+        """Returns the ids of the formula cells that read a cell directly."""
+        found = []
+        for range_id in self.ranges_containing(sheet, row, col):
+            found.extend(self.range_dependents[range_id])
+        return sorted(set(found))
+
+    def transitive_dependents(self, sheet, row, col):
+        """Returns the ids of every formula cell whose value depends on a cell."""
+        seen = set()
+        stack = self.dependents(sheet, row, col)
+        while stack:
+            cell_id = stack.pop()
+            if cell_id in seen:
+                continue
+            seen.add(cell_id)
+            stack.extend(self.dependents(*self.cells[cell_id]))
+        return sorted(seen)
+
+    def transitive_precedents(self, cell_ids):
+        """
+        Returns (range ids, formula cell ids) reached by walking precedents
+        from the given formula cells. Input cells are not included.
+        """
+        seen_cells = set(cell_ids)
+        seen_ranges = set()
+        stack = list(cell_ids)
+        while stack:
+            for range_id in self.precedents[stack.pop()]:
+                if range_id in seen_ranges:
+                    continue
+                seen_ranges.add(range_id)
+                for cell_id in self.formula_cells_in(range_id):
+                    if cell_id not in seen_cells:
+                        seen_cells.add(cell_id)
+                        stack.append(cell_id)
+        return sorted(seen_ranges), sorted(seen_cells - set(cell_ids))
+
+    def sheet_cells(self, sheet):
+        """Returns the ids of the formula cells of a sheet."""
+        return [cell_id for cell_id, cell in enumerate(self.cells) if cell[0] == sheet]
+
+    def describe_cell(self, cell_id):
+        sheet, row, col = self.cells[cell_id]
+        text = f"{sheet}!{cell_name(row, col)}"
+        if cell_id in self.dynamic:
+            text += f"  [dynamic: {', '.join(self.dynamic[cell_id])}]"
+        return text
+
+    def describe_range(self, range_id):
+        return format_range(*self.ranges[range_id])
+
+    def stats(self):
+        function_counts = Counter(name for names in self.dynamic.values() for name in names)
+        return {
+            'formula_cells': len(self.cells),
+            'distinct_ranges': len(self.ranges),
+            'edges': sum(len(range_ids) for range_ids in self.precedents),
+            'dynamic_cells': len(self.dynamic),
+            'dynamic_functions': dict(function_counts),
+            'unparsed_cells': len(self.unparsed),
+        }
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[2] not in ('dependents', 'precedents', 'feeds', 'stats'):
+        print(__doc__.split('Usage:')[1].rstrip())
+        return
+    graph = DependencyGraph.from_csv(sys.argv[1])
+    command = sys.argv[2]
+    if command == 'stats':
+        for key, value in graph.stats().items():
+            print(f"{key}: {value}")
+        return
+    if len(sys.argv) < 4:
+        print(f"Missing the {'sheet' if command == 'feeds' else 'cell'} to query.")
+        return
+
+    if command == 'dependents':
+        sheet, row, col = parse_cell_spec(sys.argv[3])
+        direct = graph.dependents(sheet, row, col)
+        every = graph.transitive_dependents(sheet, row, col)
+        print(f"{len(direct)} direct and {len(every)} transitive dependents of {sys.argv[3]}:")
+        for cell_id in every:
+            print(f"  {'*' if cell_id in direct else ' '} {graph.describe_cell(cell_id)}")
+        return
+
+    if command == 'precedents':
+        sheet, row, col = parse_cell_spec(sys.argv[3])
+        cell_id = graph.cell_ids.get((sheet, row, col))
+        if cell_id is None:
+            print(f"{sys.argv[3]} holds no formula in this export.")
+            return
+        start_ids = [cell_id]
+    else:
+        start_ids = graph.sheet_cells(sys.argv[3])
+        if not start_ids:
+            print(f"No formula cells found on sheet '{sys.argv[3]}'.")
+            return
+
+    range_ids, cell_ids = graph.transitive_precedents(start_ids)
+    dynamic = [cell_id for cell_id in start_ids + cell_ids if cell_id in graph.dynamic]
+    print(f"{len(range_ids)} ranges and {len(cell_ids)} formula cells feed {sys.argv[3]}:")
+    for range_id in range_ids:
+        print(f"  {graph.describe_range(range_id)}")
+    if dynamic:
+        print(f"{len(dynamic)} cells on this path use dynamic references and may read more:")
+        for cell_id in dynamic:
+            print(f"  {graph.describe_cell(cell_id)}")
+
+
+if __name__ == "__main__":
+    main()
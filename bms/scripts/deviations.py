@@ -0,0 +1,193 @@
+"""
+Template-deviation reports for house sheets.
+
+Every house sheet is a copy of the house template, so a full export repeats
+the template's formulas once per house. This module compares each house
+sheet to the template cell by cell in relative (R1C1) form and keeps only
+the cells that differ:
+
+    changed      the house has a different formula than the template
+    overwritten  the template has a formula, the house a typed-in value
+    missing      the template has a formula, the house cell is empty
+    extra        the house has a formula where the template has none
+
+A house formula below the template's last formula in a column that has the
+same relative form as that last formula is the template's copy-down
+extended (e.g. more monthly rows); it counts as conforming, not as extra.
+
+When the workbook has no template sheet, the canonical formulas are the
+per-cell consensus of the houses: the relative form shared by more than
+half of them. That template is exported as the (CONSENSUS TEMPLATE) sheet,
+so the export still holds the template plus the deviations.
+
+Usage: python3 deviations.py <formulas.csv> <template sheet> [house sheet regex]
+       (compares the export's other sheets, or those matching the regex,
+       to the template; the export must hold them in full)
+"""
+import csv
+import os
+import re
+import sys
+from collections import Counter, defaultdict
+
+from a1 import cell_name, parse_cell
+from r1c1 import to_r1c1
+
+# Export name of the template built from the houses' consensus.
+CONSENSUS_SHEET = '(CONSENSUS TEMPLATE)'
+
+DEVIATION_COLUMNS = ['Sheet Name', 'Cell', 'Deviation', 'Template Formula', 'House Content']
+CONFORMANCE_COLUMNS = [
+    'Sheet Name', 'Template Formulas', 'Matching', 'Changed', 'Overwritten', 'Missing',
+    'Extra', 'Extended', 'Conformance %',
+]
+
+
+def split_cells(values):
+    """
+    Splits a FORMULA-rendered value matrix into its [(row, col, formula)]
+    and a {(row, col): value} dict of the other non-empty cells.
+    """
+    cells = []
+    contents = {}
+    for r_idx, row in enumerate(values):
+        for c_idx, cell_value in enumerate(row):
+            if cell_value.__class__ is str and cell_value[:1] == '=':
+                cells.append((r_idx, c_idx, cell_value))
+            elif cell_value not in ('', None):
+                contents[(r_idx, c_idx)] = cell_value
+    return cells, contents
+
+
+class Template:
+    """The canonical formulas of a house sheet, keyed by (row, col)."""
+
+    def __init__(self, cells):
+        self.formulas = {}
+        self.tails = {}
+        for row_idx, col_idx, formula in cells:
+            form = to_r1c1(formula, row_idx, col_idx)
+            self.formulas[(row_idx, col_idx)] = (form, formula)
+            tail = self.tails.get(col_idx)
+            if tail is None or row_idx > tail[0]:
+                self.tails[col_idx] = (row_idx, form)
+
+    @classmethod
+    def consensus(cls, houses):
+        """
+        Builds the template from house sheets' [(row, col, formula)] lists:
+        each cell's relative form shared by more than half of the houses.
+        """
+        forms = defaultdict(Counter)
+        texts = {}
+        for cells in houses:
+            for row_idx, col_idx, formula in cells:
+                form = to_r1c1(formula, row_idx, col_idx)
+                forms[(row_idx, col_idx)][form] += 1
+                texts.setdefault((row_idx, col_idx, form), formula)
+        cells = []
+        for (row_idx, col_idx), counter in forms.items():
+            form, count = counter.most_common(1)[0]
+            if count * 2 > len(houses):
+                cells.append((row_idx, col_idx, texts[(row_idx, col_idx, form)]))
+        return cls(sorted(cells))
+
+    def cells(self):
+        """Yields the template's formulas as (row, col, formula), in row order."""
+        for (row_idx, col_idx), (_, formula) in sorted(self.formulas.items()):
+            yield row_idx, col_idx, formula
+
+    def compare(self, sheet_name, cells, contents=None):
+        """
+        Compares one house sheet, given as [(row, col, formula)] and
+        optionally its other cells' values (see split_cells), which tell
+        typed-in values from empty cells. Returns (deviation records,
+        conformance summary).
+        """
+        house = {(row_idx, col_idx): formula for row_idx, col_idx, formula in cells}
+        counts = Counter()
+        deviations = []
+        for (row_idx, col_idx), (form, template_formula) in self.formulas.items():
+            formula = house.pop((row_idx, col_idx), None)
+            if formula is not None:
+                # At the same cell, equal A1 text means an equal relative form.
+                if formula == template_formula or to_r1c1(formula, row_idx, col_idx) == form:
+                    counts['Matching'] += 1
+                    continue
+                kind, content = 'changed', formula
+            else:
+                content = (contents or {}).get((row_idx, col_idx), '')
+                kind = 'overwritten' if content != '' else 'missing'
+            counts[kind.capitalize()] += 1
+            deviations.append((row_idx, col_idx, kind, template_formula, content))
+        for (row_idx, col_idx), formula in house.items():
+            tail = self.tails.get(col_idx)
+            if tail and row_idx > tail[0] and to_r1c1(formula, row_idx, col_idx) == tail[1]:
+                counts['Extended'] += 1
+                continue
+            counts['Extra'] += 1
+            deviations.append((row_idx, col_idx, 'extra', '', formula))
+
+        deviations.sort()
+        records = [{
+            'Sheet Name': sheet_name, 'Cell': cell_name(row_idx, col_idx), 'Deviation': kind,
+            'Template Formula': template_formula, 'House Content': content,
+        } for row_idx, col_idx, kind, template_formula, content in deviations]
+        summary = {'Sheet Name': sheet_name, 'Template Formulas': len(self.formulas)}
+        for column in CONFORMANCE_COLUMNS[2:-1]:
+            summary[column] = counts[column]
+        summary['Conformance %'] = round(100 * counts['Matching'] / len(self.formulas), 2) if self.formulas else 100.0
+        return records, summary
+
+
+def write_reports(prefix, deviations, summaries):
+    """
+    Writes <prefix>_deviations.csv and <prefix>_conformance.csv (least
+    conforming house first) and returns their paths.
+    """
+    paths = []
+    summaries = sorted(summaries, key=lambda summary: (summary['Conformance %'], summary['Sheet Name']))
+    for suffix, columns, rows in (('_deviations.csv', DEVIATION_COLUMNS, deviations),
+                                  ('_conformance.csv', CONFORMANCE_COLUMNS, summaries)):
+        path = f"{prefix}{suffix}"
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=columns, lineterminator='\n')
+            writer.writeheader()
+            writer.writerows(rows)
+        paths.append(path)
+    return paths
+
+
+def main():
+    if len(sys.argv) < 3:
+        print(__doc__.split('Usage:')[1].strip())
+        return
+    source, template_name = sys.argv[1], sys.argv[2]
+    house_pattern = re.compile(sys.argv[3]) if len(sys.argv) > 3 else None
+
+    sheets = defaultdict(list)
+    with open(source, 'r', encoding='utf-8', newline='') as f:
+        for record in csv.DictReader(f):
+            row_idx, col_idx = parse_cell(record['Cell'])
+            sheets[record['Sheet Name']].append((row_idx, col_idx, record['Formula']))
+    template_cells = sheets.pop(template_name, None)
+    if template_cells is None:
+        print(f"Template sheet '{template_name}' not found in {source}.")
+        return
+    template = Template(template_cells)
+
+    deviations, summaries = [], []
+    for sheet_name, cells in sheets.items():
+        if house_pattern and not house_pattern.match(sheet_name):
+            continue
+        records, summary = template.compare(sheet_name, cells)
+        deviations.extend(records)
+        summaries.append(summary)
+    for path in write_reports(os.path.splitext(source)[0], deviations, summaries):
+        print(f"Report saved to: {path}")
+    print(f"{len(deviations)} deviating cells across {len(summaries)} sheets "
+          f"(template: {len(template.formulas)} formulas).")
+
+
+if __name__ == "__main__":
+    main()
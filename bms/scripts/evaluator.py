@@ -0,0 +1,1061 @@
+"""
+Offline evaluator for the BMS formula subset.
+
+Recomputes exported formulas against a values snapshot fetched with
+valueRenderOption=UNFORMATTED_VALUE (dates are serial numbers), so the
+Summary and Monthly payment sheets can be computed for every house locally
+and checked against the live sheet.
+
+Ranges evaluate to 2-D NumPy object arrays. Arithmetic on ranges runs as
+float64 array operations, and SUMIFS, MATCH and VLOOKUP work on whole
+columns: equality criteria and exact-match lookups go through hash indexes
+built once per range, and comparison criteria are evaluated as vectorized
+masks. Functions outside the supported subset evaluate to #NAME? and are
+counted in Evaluator.unsupported.
+
+Usage:
+    python3 evaluator.py <system> <formulas.csv> [--sheets Summary "Monthly payment"]
+                         [--today YYYY-MM-DD] [--snapshot snapshots/<system>/<timestamp>]
+"""
+import argparse
+import bisect
+import calendar
+import csv
+import datetime
+import json
+import os
+import re
+from collections import Counter, defaultdict
+from functools import lru_cache
+
+import numpy as np
+
+from a1 import cell_name, parse_cell
+from dependency_graph import UNBOUNDED, reference_bounds, sheet_from_export_name
+from formula_parser import (
+    Array, BinaryOp, Boolean, Empty, Error, FormulaSyntaxError, Function, Name, Number,
+    Percent, Reference, String, TableReference, UnaryOp, parse_formula, references, tokenize,
+)
+from snapshot import Snapshot, fetch_values
+
+# Sheets (like Excel) counts days from 1899-12-30.
+EPOCH = datetime.date(1899, 12, 30)
+
+NA = Error('#N/A')
+VALUE = Error('#VALUE!')
+DIV0 = Error('#DIV/0!')
+REF = Error('#REF!')
+NAME = Error('#NAME?')
+
+RELATIVE_TOLERANCE = 1e-9
+
+_DATE_FORMATS = ['%d-%b-%Y', '%d-%B-%Y', '%d-%b-%y', '%b-%Y', '%B-%Y', '%Y-%m-%d',
+                 '%m/%d/%Y', '%m/%d/%y', '%d %b %Y', '%b %d, %Y', '%B %d, %Y']
+_NUMERIC_TEXT = re.compile(r'^\s*[-+]?(\d+(\.\d*)?|\.\d+)([eE][-+]?\d+)?\s*$')
+_NUMERIC_TYPES = {int, float, type(None)}
+_CRITERION = re.compile(r'^(<=|>=|<>|<|>|=)?(.*)$', re.S)
+
+
+# --- Scalar semantics ---
+
+def is_error(value):
+    return isinstance(value, Error)
+
+
+def is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def to_number(value):
+    """Coerces a value to float like Sheets arithmetic does, or returns an Error."""
+    if value is None:
+        return 0.0
+    if isinstance(value, Error):
+        return value
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    if isinstance(value, str):
+        if _NUMERIC_TEXT.match(value):
+            return float(value)
+        serial = _parse_date(value)
+        return float(serial) if serial is not None else VALUE
+    return VALUE
+
+
+def to_text(value):
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        return str(int(value)) if value.is_integer() else '%.15g' % value
+    if isinstance(value, Error):
+        return value.code
+    return str(value)
+
+
+def to_bool(value):
+    if isinstance(value, Error):
+        return value
+    if isinstance(value, str):
+        if value.upper() in ('TRUE', 'FALSE'):
+            return value.upper() == 'TRUE'
+        return VALUE if value else False
+    return bool(value)
+
+
+def _type_rank(value):
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, str):
+        return 1
+    return 0
+
+
+def compare(op, left, right):
+    """Sheets comparison: empty matches 0/""/FALSE, text compares case-insensitively."""
+    if isinstance(left, Error):
+        return left
+    if isinstance(right, Error):
+        return right
+    if left is None:
+        left = '' if isinstance(right, str) else (False if isinstance(right, bool) else 0.0)
+    if right is None:
+        right = '' if isinstance(left, str) else (False if isinstance(left, bool) else 0.0)
+    rank_left, rank_right = _type_rank(left), _type_rank(right)
+    if rank_left != rank_right:
+        left, right = rank_left, rank_right
+    elif rank_left == 1:
+        left, right = left.lower(), right.lower()
+    if op == '=':
+        return left == right
+    if op == '<>':
+        return left != right
+    if op == '<':
+        return left < right
+    if op == '>':
+        return left > right
+    if op == '<=':
+        return left <= right
+    return left >= right
+
+
+def arithmetic(op, left, right):
+    left, right = to_number(left), to_number(right)
+    if isinstance(left, Error):
+        return left
+    if isinstance(right, Error):
+        return right
+    if op == '+':
+        return left + right
+    if op == '-':
+        return left - right
+    if op == '*':
+        return left * right
+    if op == '/':
+        return DIV0 if right == 0 else left / right
+    try:
+        return float(left ** right)
+    except (OverflowError, ZeroDivisionError, TypeError):
+        return Error('#NUM!')
+
+
+def concatenate(left, right):
+    if isinstance(left, Error):
+        return left
+    if isinstance(right, Error):
+        return right
+    return to_text(left) + to_text(right)
+
+
+# --- Dates ---
+
+def date_to_serial(value):
+    return float((value - EPOCH).days)
+
+
+def serial_to_date(serial):
+    return EPOCH + datetime.timedelta(days=int(serial))
+
+
+@lru_cache(maxsize=4096)
+def _parse_date(text):
+    text = text.strip()
+    for date_format in _DATE_FORMATS:
+        try:
+            return date_to_serial(datetime.datetime.strptime(text, date_format).date())
+        except ValueError:
+            continue
+    return None
+
+
+def _add_months(serial, months, end_of_month=False):
+    day = serial_to_date(serial)
+    month_index = day.year * 12 + day.month - 1 + int(months)
+    year, month = divmod(month_index, 12)
+    last_day = calendar.monthrange(year, month + 1)[1]
+    return date_to_serial(datetime.date(year, month + 1, last_day if end_of_month else min(day.day, last_day)))
+
+
+def _date(year, month, day):
+    year, month, day = int(year), int(month), int(day)
+    if year < 1900:
+        year += 1900
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return date_to_serial(datetime.date(year, month, 1)) + day - 1
+
+
+_TEXT_DATE_TOKENS = re.compile(r'yyyy|yy|mmmm|mmm|mm|m|dddd|ddd|dd|d', re.I)
+
+
+def format_text(value, pattern):
+    """TEXT(value, pattern) for the date and number patterns used in the workbook."""
+    if isinstance(value, Error):
+        return value
+    lowered = pattern.lower()
+    if any(token in lowered for token in ('y', 'd')) or lowered in ('m', 'mm', 'mmm', 'mmmm'):
+        number = to_number(value)
+        if isinstance(number, Error):
+            return number
+        day = serial_to_date(number)
+
+        def token(match):
+            text = match.group().lower()
+            return {
+                'yyyy': f"{day.year:04d}", 'yy': f"{day.year % 100:02d}",
+                'mmmm': day.strftime('%B'), 'mmm': day.strftime('%b'),
+                'mm': f"{day.month:02d}", 'm': str(day.month),
+                'dddd': day.strftime('%A'), 'ddd': day.strftime('%a'),
+                'dd': f"{day.day:02d}", 'd': str(day.day),
+            }[text]
+        return _TEXT_DATE_TOKENS.sub(token, pattern)
+
+    number = to_number(value)
+    if isinstance(number, Error):
+        return to_text(value)
+    percent = pattern.endswith('%')
+    if percent:
+        number *= 100
+        pattern = pattern[:-1]
+    decimals = len(pattern.split('.')[1]) if '.' in pattern else 0
+    text = f"{number:,.{decimals}f}" if ',' in pattern else f"{number:.{decimals}f}"
+    return text + ('%' if percent else '')
+
+
+# --- Arrays ---
+
+def _is_grid(value):
+    return isinstance(value, np.ndarray)
+
+
+def _elementwise(fn, *args):
+    """Applies a scalar function, broadcasting over any array arguments."""
+    if not any(_is_grid(arg) for arg in args):
+        return fn(*args)
+    return np.frompyfunc(fn, len(args), 1)(*args)
+
+
+def _numeric_array(grid):
+    """Returns a float64 copy of a grid (empty -> 0), or None if it holds anything but numbers."""
+    if not _is_grid(grid):
+        return None
+    if not set(map(type, grid.ravel())) <= _NUMERIC_TYPES:
+        return None
+    return np.where(np.equal(grid, None), 0.0, grid).astype(np.float64)
+
+
+def _flatten(value):
+    if _is_grid(value):
+        return value.ravel()
+    return np.array([value], dtype=object)
+
+
+def _first(value):
+    if _is_grid(value):
+        return value.flat[0] if value.size else None
+    return value
+
+
+def _hash_key(value):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        return ('b', value)
+    if isinstance(value, (int, float)):
+        return ('n', float(value))
+    if isinstance(value, str):
+        return ('s', value.lower())
+    return None
+
+
+class Evaluator:
+    """
+    Evaluates formulas of a workbook snapshot. values maps sheet names to
+    UNFORMATTED_VALUE matrices; formulas maps sheet names to {(row, col):
+    formula text}. Cell results, range grids and per-range lookup indexes are
+    memoized for the lifetime of the evaluator.
+
+    Before a formula cell is evaluated, the uncached formula cells its
+    references reach are evaluated in dependency order, found with an
+    iterative depth-first walk. A long chain of single-cell references
+    (L1001 = L1000 - I1001, ...) therefore never nests cell_value calls
+    deeper than the references resolved only at run time (INDIRECT).
+    """
+
+    def __init__(self, values, formulas, today=None):
+        self.values = values
+        self.formulas = formulas
+        self.today = date_to_serial(today or datetime.date.today())
+        self.cell_cache = {}
+        self.grid_cache = {}
+        self.index_cache = {}
+        self.mask_cache = {}
+        self.extents = {}
+        self.formula_rows = {}
+        self.trees = {}
+        self.tree_references = {}
+        self.in_progress = set()
+        self.unsupported = Counter()
+
+    # --- Cells and ranges ---
+
+    def _raw_value(self, sheet, row, col):
+        rows = self.values.get(sheet)
+        if rows is None or row >= len(rows) or col >= len(rows[row]):
+            return None
+        value = rows[row][col]
+        return None if value == '' else value
+
+    def sheet_extent(self, sheet):
+        """Returns (rows, columns) covering the sheet's values and formulas."""
+        if sheet in self.extents:
+            return self.extents[sheet]
+        rows = self.values.get(sheet, [])
+        height = len(rows)
+        width = max((len(row) for row in rows), default=0)
+        for row, col in self.formulas.get(sheet, {}):
+            height = max(height, row + 1)
+            width = max(width, col + 1)
+        self.extents[sheet] = (height, width)
+        return height, width
+
+    def _formula_rows(self, sheet):
+        """Returns {col: sorted rows} of a sheet's formula cells."""
+        if sheet not in self.formula_rows:
+            columns = defaultdict(list)
+            for row, col in self.formulas.get(sheet, {}):
+                columns[col].append(row)
+            for rows in columns.values():
+                rows.sort()
+            self.formula_rows[sheet] = dict(columns)
+        return self.formula_rows[sheet]
+
+    def precedents(self, sheet, row, col):
+        """Yields the formula cells a formula cell references directly."""
+        formula = self.formulas[sheet][(row, col)]
+        if formula not in self.tree_references:
+            tree = self.formula_tree(formula)
+            self.tree_references[formula] = () if tree is None else tuple(references(tree))
+        for reference in self.tree_references[formula]:
+            target = reference.sheet or sheet
+            if target not in self.formulas:
+                continue
+            first_row, last_row, first_col, last_col = reference_bounds(reference)
+            if self._range_key(target, first_row, last_row, first_col, last_col) in self.grid_cache:
+                continue
+            for column, rows in self._formula_rows(target).items():
+                if first_col <= column <= last_col:
+                    for index in range(bisect.bisect_left(rows, first_row), bisect.bisect_right(rows, last_row)):
+                        yield (target, rows[index], column)
+
+    def _evaluate_precedents(self, key):
+        """
+        Evaluates the uncached formula cells key depends on, precedents
+        first. Cells on the walk are marked in progress like cells on the
+        call stack, so a cycle still evaluates as #REF!.
+        """
+        cells = [key]
+        stack = [self.precedents(*key)]
+        try:
+            while stack:
+                for precedent in stack[-1]:
+                    if precedent not in self.cell_cache and precedent not in self.in_progress:
+                        self.in_progress.add(precedent)
+                        cells.append(precedent)
+                        stack.append(self.precedents(*precedent))
+                        break
+                else:
+                    stack.pop()
+                    cell = cells.pop()
+                    if stack:
+                        self._evaluate_cell(cell)
+        finally:
+            self.in_progress.difference_update(cells)
+
+    def _evaluate_cell(self, key):
+        """Evaluates a formula cell that is marked in progress and caches its value."""
+        sheet, row, col = key
+        try:
+            value = self.evaluate_formula(self.formulas[sheet][(row, col)], sheet, row, col)
+        finally:
+            self.in_progress.discard(key)
+        if _is_grid(value):
+            value = _first(value)
+        self.cell_cache[key] = value
+        return value
+
+    def cell_value(self, sheet, row, col):
+        key = (sheet, row, col)
+        if key in self.cell_cache:
+            return self.cell_cache[key]
+        if (row, col) not in self.formulas.get(sheet, {}):
+            return self._raw_value(sheet, row, col)
+        if key in self.in_progress:
+            return REF
+        self.in_progress.add(key)
+        self._evaluate_precedents(key)
+        return self._evaluate_cell(key)
+
+    def _range_key(self, sheet, first_row, last_row, first_col, last_col):
+        """Returns the grid cache key of a range, with open ends clipped to the sheet."""
+        height, width = self.sheet_extent(sheet)
+        if last_row == UNBOUNDED:
+            last_row = max(first_row, height - 1)
+        if last_col == UNBOUNDED:
+            last_col = max(first_col, width - 1)
+        return (sheet, first_row, last_row, first_col, last_col)
+
+    def range_grid(self, sheet, first_row, last_row, first_col, last_col):
+        """Returns a range as a 2-D object array, evaluating the formula cells inside it."""
+        if sheet not in self.values and sheet not in self.formulas:
+            return REF
+        key = self._range_key(sheet, first_row, last_row, first_col, last_col)
+        _, first_row, last_row, first_col, last_col = key
+        grid = self.grid_cache.get(key)
+        if grid is not None:
+            return grid
+        grid = np.empty((last_row - first_row + 1, last_col - first_col + 1), dtype=object)
+        sheet_formulas = self.formulas.get(sheet, {})
+        # Row-major order keeps chains like L20 = L19 - I20 shallow: each
+        # cell's predecessor is already cached when it is evaluated.
+        for row in range(first_row, last_row + 1):
+            for col in range(first_col, last_col + 1):
+                if (row, col) in sheet_formulas:
+                    grid[row - first_row, col - first_col] = self.cell_value(sheet, row, col)
+                else:
+                    grid[row - first_row, col - first_col] = self._raw_value(sheet, row, col)
+        self.grid_cache[key] = grid
+        return grid
+
+    def reference_value(self, reference, sheet):
+        target = reference.sheet or sheet
+        first_row, last_row, first_col, last_col = reference_bounds(reference)
+        if first_row == last_row and first_col == last_col:
+            if target not in self.values and target not in self.formulas:
+                return REF
+            return self.cell_value(target, first_row, first_col)
+        return self.range_grid(target, first_row, last_row, first_col, last_col)
+
+    # --- Formulas ---
+
+    def formula_tree(self, formula):
+        """
+        Returns the parsed tree of a formula, or None when it does not parse.
+        Trees are kept for the evaluator's lifetime: every formula is parsed
+        once for its precedents and read again to evaluate it.
+        """
+        if formula not in self.trees:
+            try:
+                self.trees[formula] = parse_formula(formula)
+            except FormulaSyntaxError:
+                self.trees[formula] = None
+        return self.trees[formula]
+
+    def evaluate_formula(self, formula, sheet, row, col):
+        tree = self.formula_tree(formula)
+        if tree is None:
+            return Error('#ERROR!')
+        return self.evaluate(tree, (sheet, row, col))
+
+    def evaluate(self, node, context):
+        if isinstance(node, Number):
+            return node.value
+        if isinstance(node, String):
+            return node.value
+        if isinstance(node, Boolean):
+            return node.value
+        if isinstance(node, Error):
+            return node
+        if isinstance(node, Empty):
+            return None
+        if isinstance(node, Reference):
+            return self.reference_value(node, context[0])
+        if isinstance(node, Function):
+            return self.call(node, context)
+        if isinstance(node, BinaryOp):
+            return self.binary(node, context)
+        if isinstance(node, UnaryOp):
+            operand = self.evaluate(node.operand, context)
+            if node.op == '+':
+                return operand
+            numeric = _numeric_array(operand)
+            if numeric is not None:
+                return (-numeric).astype(object)
+            return _elementwise(lambda value: arithmetic('*', value, -1.0), operand)
+        if isinstance(node, Percent):
+            return _elementwise(lambda value: arithmetic('/', value, 100.0), self.evaluate(node.operand, context))
+        if isinstance(node, Array):
+            return np.array([[_first(self.evaluate(item, context)) for item in row] for row in node.rows],
+                            dtype=object)
+        if isinstance(node, (Name, TableReference)):
+            self.unsupported[type(node).__name__] += 1
+            return NAME
+        return VALUE
+
+    def binary(self, node, context):
+        if node.op == ':':
+            self.unsupported['dynamic range'] += 1
+            return REF
+        left = self.evaluate(node.left, context)
+        right = self.evaluate(node.right, context)
+        op = node.op
+        if op == '&':
+            return _elementwise(concatenate, left, right)
+        if op in ('=', '<>', '<', '>', '<=', '>='):
+            return _elementwise(lambda a, b: compare(op, a, b), left, right)
+        if _is_grid(left) or _is_grid(right):
+            numeric_left = _numeric_array(left) if _is_grid(left) else to_number(left)
+            numeric_right = _numeric_array(right) if _is_grid(right) else to_number(right)
+            if (numeric_left is not None and numeric_right is not None and
+                    not isinstance(numeric_left, Error) and not isinstance(numeric_right, Error)):
+                return self._vector_arithmetic(op, numeric_left, numeric_right)
+        return _elementwise(lambda a, b: arithmetic(op, a, b), left, right)
+
+    @staticmethod
+    def _vector_arithmetic(op, left, right):
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            if op == '+':
+                result = left + right
+            elif op == '-':
+                result = left - right
+            elif op == '*':
+                result = left * right
+            elif op == '/':
+                result = np.divide(left, right)
+            else:
+                result = np.power(left, right)
+        result = np.asarray(result).astype(object)
+        if op == '/':
+            zero = np.broadcast_to(np.asarray(right) == 0, result.shape)
+            result[zero] = DIV0
+        return result
+
+    # --- Functions ---
+
+    def call(self, node, context):
+        lazy = LAZY_FUNCTIONS.get(node.name)
+        if lazy is not None:
+            return lazy(self, node.args, context)
+        function = FUNCTIONS.get(node.name)
+        if function is None:
+            self.unsupported[node.name] += 1
+            return NAME
+        args = [self.evaluate(arg, context) for arg in node.args]
+        return function(self, *args)
+
+    def hash_index(self, grid, column=None):
+        """
+        Maps normalized values of a grid (or one of its columns) to the flat
+        positions holding them. Indexes are cached per grid, so repeated
+        lookups into the same range only hash it once.
+        """
+        cache_key = (id(grid), column)
+        cached = self.index_cache.get(cache_key)
+        if cached is not None and cached[0] is grid:
+            return cached[1]
+        values = grid[:, column] if column is not None else _flatten(grid)
+        index = defaultdict(list)
+        for position, value in enumerate(values):
+            key = _hash_key(value)
+            if key is not None:
+                index[key].append(position)
+        index = {key: np.array(positions) for key, positions in index.items()}
+        if _is_grid(grid):
+            self.index_cache[cache_key] = (grid, index)
+        return index
+
+    def criterion_mask(self, grid, criterion):
+        """Returns a boolean mask of the cells of a grid matching a SUMIFS-style criterion."""
+        flat = _flatten(grid)
+        cache_key = (id(grid), _hash_key(criterion) or repr(criterion))
+        cached = self.mask_cache.get(cache_key)
+        if cached is not None and cached[0] is grid:
+            return cached[1]
+
+        if isinstance(criterion, str):
+            op, operand = _CRITERION.match(criterion).groups()
+            op = op or '='
+        else:
+            op, operand = '=', criterion
+        if isinstance(operand, str) and _NUMERIC_TEXT.match(operand):
+            operand = float(operand)
+
+        mask = np.zeros(flat.shape, dtype=bool)
+        if op in ('=', '<>') and isinstance(operand, str) and ('*' in operand or '?' in operand):
+            pattern = re.compile(
+                '^' + re.escape(operand.lower()).replace(r'\*', '.*').replace(r'\?', '.') + '$', re.S
+            )
+            mask = np.fromiter((isinstance(value, str) and bool(pattern.match(value.lower()))
+                                or (is_number(value) and bool(pattern.match(to_text(float(value)).lower())))
+                                for value in flat), dtype=bool, count=flat.size)
+        elif op in ('=', '<>'):
+            if operand == '':
+                mask = np.fromiter((value is None or value == '' for value in flat), dtype=bool, count=flat.size)
+            else:
+                positions = self.hash_index(grid).get(_hash_key(operand))
+                if positions is not None:
+                    mask[positions] = True
+                if isinstance(operand, float):
+                    text_positions = self.hash_index(grid).get(('s', to_text(operand).lower()))
+                    if text_positions is not None:
+                        mask[text_positions] = True
+        elif is_number(operand):
+            numeric = np.fromiter((float(value) if is_number(value) else np.nan for value in flat),
+                                  dtype=np.float64, count=flat.size)
+            with np.errstate(invalid='ignore'):
+                mask = {'<': numeric < operand, '>': numeric > operand,
+                        '<=': numeric <= operand, '>=': numeric >= operand}[op]
+        else:
+            mask = np.fromiter((isinstance(value, str) and bool(compare(op, value, operand)) for value in flat),
+                               dtype=bool, count=flat.size)
+        if op == '<>':
+            mask = ~mask
+        if _is_grid(grid):
+            self.mask_cache[cache_key] = (grid, mask)
+        return mask
+
+
+# --- Lazy functions (receive unevaluated argument nodes) ---
+
+def _if(evaluator, args, context):
+    condition = evaluator.evaluate(args[0], context)
+    if _is_grid(condition):
+        when_true = evaluator.evaluate(args[1], context) if len(args) > 1 else True
+        when_false = evaluator.evaluate(args[2], context) if len(args) > 2 else False
+        return _elementwise(lambda c, t, f: c if is_error(to_bool(c)) else (t if to_bool(c) else f),
+                            condition, when_true, when_false)
+    condition = to_bool(condition)
+    if is_error(condition):
+        return condition
+    if condition:
+        return evaluator.evaluate(args[1], context) if len(args) > 1 else True
+    return evaluator.evaluate(args[2], context) if len(args) > 2 else False
+
+
+def _ifs(evaluator, args, context):
+    for position in range(0, len(args) - 1, 2):
+        condition = to_bool(_first(evaluator.evaluate(args[position], context)))
+        if is_error(condition):
+            return condition
+        if condition:
+            return evaluator.evaluate(args[position + 1], context)
+    return NA
+
+
+def _iferror(evaluator, args, context):
+    value = evaluator.evaluate(args[0], context)
+    fallback = (lambda: evaluator.evaluate(args[1], context)) if len(args) > 1 else (lambda: '')
+    if _is_grid(value):
+        replacement = fallback()
+        return _elementwise(lambda v, r: r if is_error(v) else v, value, replacement)
+    return fallback() if is_error(value) else value
+
+
+def _position(evaluator, args, context, axis):
+    if not args:
+        return float(context[axis] + 1)
+    if isinstance(args[0], Reference):
+        first_row, _, first_col, _ = reference_bounds(args[0])
+        return float((first_row, first_col)[axis - 1] + 1)
+    return VALUE
+
+
+def _indirect(evaluator, args, context):
+    text = _first(evaluator.evaluate(args[0], context))
+    if is_error(text):
+        return text
+    try:
+        tokens = tokenize(to_text(text).strip())
+    except FormulaSyntaxError:
+        return REF
+    if len(tokens) != 1 or tokens[0].kind != 'REFERENCE':
+        return REF
+    tree = parse_formula(tokens[0].text)
+    return evaluator.reference_value(tree, context[0])
+
+
+LAZY_FUNCTIONS = {
+    'IF': _if,
+    'IFS': _ifs,
+    'IFERROR': _iferror,
+    'COLUMN': lambda evaluator, args, context: _position(evaluator, args, context, 2),
+    'ROW': lambda evaluator, args, context: _position(evaluator, args, context, 1),
+    'INDIRECT': _indirect,
+}
+
+
+# --- Eager functions ---
+
+def _scalar_function(fn):
+    """Wraps a scalar function so errors propagate and array arguments broadcast."""
+    def wrapped(evaluator, *args):
+        def apply(*values):
+            for value in values:
+                if is_error(value):
+                    return value
+            try:
+                return fn(*values)
+            except (ValueError, OverflowError, TypeError):
+                return VALUE
+        return _elementwise(apply, *args)
+    return wrapped
+
+
+def _numbers(fn):
+    def wrapped(*values):
+        numbers = [to_number(value) for value in values]
+        for number in numbers:
+            if is_error(number):
+                return number
+        return fn(*numbers)
+    return wrapped
+
+
+def _datevalue(value):
+    if is_number(value):
+        return float(int(value))
+    serial = _parse_date(to_text(value))
+    return VALUE if serial is None else serial
+
+
+def _trim(value):
+    return re.sub(' +', ' ', to_text(value).strip(' '))
+
+
+def _and(evaluator, *args):
+    result = True
+    for arg in args:
+        for value in _flatten(arg):
+            if value is None or isinstance(value, str):
+                continue
+            value = to_bool(value)
+            if is_error(value):
+                return value
+            result = result and value
+    return result
+
+
+def _or(evaluator, *args):
+    result = False
+    for arg in args:
+        for value in _flatten(arg):
+            if value is None or isinstance(value, str):
+                continue
+            value = to_bool(value)
+            if is_error(value):
+                return value
+            result = result or value
+    return result
+
+
+def _sum(evaluator, *args):
+    total = 0.0
+    for arg in args:
+        if _is_grid(arg):
+            for value in arg.ravel():
+                if is_error(value):
+                    return value
+                if is_number(value):
+                    total += value
+        else:
+            number = to_number(arg)
+            if is_error(number):
+                return number
+            total += number
+    return total
+
+
+def _counta(evaluator, *args):
+    return float(sum(1 for arg in args for value in _flatten(arg) if value is not None and value != ''))
+
+
+def _index(evaluator, grid, row=None, col=None):
+    if is_error(grid):
+        return grid
+    if not _is_grid(grid):
+        return grid
+    row = 0 if row is None else to_number(_first(row))
+    col = 0 if col is None else to_number(_first(col))
+    if is_error(row) or is_error(col):
+        return row if is_error(row) else col
+    row, col = int(row), int(col)
+    height, width = grid.shape
+    if height == 1 and col == 0 and row > 0 and width > 1:
+        row, col = 1, row
+    if row < 0 or col < 0 or row > height or col > width:
+        return REF
+    if row and col:
+        return grid[row - 1, col - 1]
+    if row:
+        return grid[row - 1:row, :] if width > 1 else grid[row - 1, 0]
+    if col:
+        return grid[:, col - 1:col] if height > 1 else grid[0, col - 1]
+    return grid
+
+
+def _match(evaluator, key, lookup, match_type=1.0):
+    key = _first(key)
+    if is_error(key):
+        return key
+    values = _flatten(lookup)
+    match_type = to_number(_first(match_type))
+    if match_type == 0:
+        if isinstance(key, str) and ('*' in key or '?' in key):
+            mask = evaluator.criterion_mask(lookup, '=' + key)
+            hits = np.flatnonzero(mask)
+            return float(hits[0] + 1) if hits.size else NA
+        positions = evaluator.hash_index(lookup).get(_hash_key(key))
+        return float(positions[0] + 1) if positions is not None else NA
+    found = None
+    for position, value in enumerate(values):
+        if value is None or is_error(value) or _type_rank(value) != _type_rank(key):
+            continue
+        if (compare('<=', value, key) if match_type > 0 else compare('>=', value, key)) is True:
+            found = position
+        elif found is not None:
+            break
+    return NA if found is None else float(found + 1)
+
+
+def _vlookup(evaluator, key, grid, col_index, is_sorted=True):
+    key = _first(key)
+    if is_error(key):
+        return key
+    if not _is_grid(grid):
+        return NA
+    col_index = int(to_number(_first(col_index)))
+    if col_index < 1 or col_index > grid.shape[1]:
+        return REF
+    if not to_bool(_first(is_sorted)):
+        positions = evaluator.hash_index(grid, 0).get(_hash_key(key))
+        return grid[positions[0], col_index - 1] if positions is not None else NA
+    position = _match(evaluator, key, grid[:, 0], 1.0)
+    return position if is_error(position) else grid[int(position) - 1, col_index - 1]
+
+
+def _lookup(evaluator, key, lookup, result=None):
+    """LOOKUP with approximate matching, including the LOOKUP(2, 1/(cond), range) idiom."""
+    key = _first(key)
+    values = _flatten(lookup)
+    found = None
+    for position, value in enumerate(values):
+        if value is None or is_error(value) or _type_rank(value) != _type_rank(key):
+            continue
+        if compare('<=', value, key) is True:
+            found = position
+    if found is None:
+        return NA
+    return _flatten(result if result is not None else lookup)[found]
+
+
+def _sumifs(evaluator, sum_range, *criteria):
+    if len(criteria) % 2:
+        return NA
+    for value in (sum_range,) + criteria[::2]:
+        if is_error(value):
+            return value
+    sums = _flatten(sum_range)
+    mask = np.ones(sums.shape, dtype=bool)
+    for criteria_range, criterion in zip(criteria[::2], criteria[1::2]):
+        if _flatten(criteria_range).shape != sums.shape:
+            return VALUE
+        mask &= evaluator.criterion_mask(criteria_range, _first(criterion))
+    numeric = _numeric_array(sum_range)
+    if numeric is not None:
+        return float(numeric.ravel()[mask].sum())
+    return float(sum(value for value in sums[mask] if is_number(value)))
+
+
+def _sumif(evaluator, criteria_range, criterion, sum_range=None):
+    return _sumifs(evaluator, criteria_range if sum_range is None else sum_range, criteria_range, criterion)
+
+
+def _countifs(evaluator, *criteria):
+    if not criteria or len(criteria) % 2:
+        return NA
+    mask = None
+    for criteria_range, criterion in zip(criteria[::2], criteria[1::2]):
+        if is_error(criteria_range):
+            return criteria_range
+        current = evaluator.criterion_mask(criteria_range, _first(criterion))
+        mask = current if mask is None else mask & current
+    return float(mask.sum())
+
+
+def _filter(evaluator, grid, *conditions):
+    if not _is_grid(grid):
+        return grid
+    keep = np.ones(grid.shape[0], dtype=bool)
+    for condition in conditions:
+        if not _is_grid(condition) or condition.shape[0] != grid.shape[0]:
+            return VALUE
+        keep &= np.fromiter((to_bool(value) is True for value in condition[:, 0]), dtype=bool,
+                            count=condition.shape[0])
+    if not keep.any():
+        return NA
+    return grid[keep]
+
+
+FUNCTIONS = {
+    'SUMIFS': _sumifs,
+    'SUMIF': _sumif,
+    'COUNTIFS': _countifs,
+    'COUNTIF': _countifs,
+    'VLOOKUP': _vlookup,
+    'INDEX': _index,
+    'MATCH': _match,
+    'LOOKUP': _lookup,
+    'FILTER': _filter,
+    'AND': _and,
+    'OR': _or,
+    'SUM': _sum,
+    'COUNTA': _counta,
+    'TODAY': lambda evaluator: evaluator.today,
+    'DATE': _scalar_function(_numbers(_date)),
+    'EDATE': _scalar_function(_numbers(lambda start, months: _add_months(start, months))),
+    'EOMONTH': _scalar_function(_numbers(lambda start, months: _add_months(start, months, True))),
+    'DATEVALUE': _scalar_function(_datevalue),
+    'YEAR': _scalar_function(_numbers(lambda serial: float(serial_to_date(serial).year))),
+    'MONTH': _scalar_function(_numbers(lambda serial: float(serial_to_date(serial).month))),
+    'DAY': _scalar_function(_numbers(lambda serial: float(serial_to_date(serial).day))),
+    'TEXT': _scalar_function(lambda value, pattern: format_text(value, to_text(pattern))),
+    'TRIM': _scalar_function(_trim),
+    'LEN': _scalar_function(lambda value: float(len(to_text(value)))),
+    'ISNUMBER': lambda evaluator, value: _elementwise(is_number, value),
+}
+
+
+# --- Workbooks and comparison ---
+
+def load_formulas(records, template_sheet=None, house_sheets=()):
+    """
+    Returns {sheet: {(row, col): formula}} from export records. House sheets
+    without formulas of their own reuse the template's formulas, matching a
+    template-only export.
+    """
+    formulas = defaultdict(dict)
+    for record in records:
+        row, col = parse_cell(record['Cell'])
+        formulas[sheet_from_export_name(record['Sheet Name'])][(row, col)] = record['Formula']
+    if template_sheet in formulas:
+        for sheet in house_sheets:
+            if sheet not in formulas:
+                formulas[sheet] = formulas[template_sheet]
+    return dict(formulas)
+
+
+def values_match(live, computed):
+    if live == '':
+        live = None
+    if is_error(computed):
+        return isinstance(live, str) and live.startswith('#')
+    if is_number(live) or is_number(computed):
+        live_number, computed_number = to_number(live), to_number(computed)
+        if is_error(live_number) or is_error(computed_number):
+            return False
+        return abs(live_number - computed_number) <= RELATIVE_TOLERANCE * max(1.0, abs(live_number))
+    if computed is None or computed == '':
+        return live is None
+    return to_text(live) == to_text(computed)
+
+
+def compare_sheets(evaluator, sheets):
+    """Yields a comparison row for every formula cell of the given sheets."""
+    for sheet in sheets:
+        for row, col in sorted(evaluator.formulas.get(sheet, {})):
+            computed = evaluator.cell_value(sheet, row, col)
+            live = evaluator._raw_value(sheet, row, col)
+            yield {
+                'Sheet': sheet,
+                'Cell': cell_name(row, col),
+                'Live Value': to_text(live),
+                'Computed Value': to_text(computed),
+                'Status': 'match' if values_match(live, computed) else
+                          ('error' if is_error(computed) else 'mismatch'),
+            }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute exported formulas offline and compare with the live values.")
+    parser.add_argument('system', help="System name from config.json, e.g. bms")
+    parser.add_argument('formulas_csv', help="Formula export written by main.py")
+    parser.add_argument('--sheets', nargs='+', default=['Summary', 'Monthly payment'],
+                        help="Sheets to evaluate (default: Summary and Monthly payment)")
+    parser.add_argument('--today', type=datetime.date.fromisoformat,
+                        help="Date used for TODAY(), as YYYY-MM-DD (default: today)")
+    parser.add_argument('--snapshot', help="Read values from this snapshot directory (see snapshot.py) instead of the API")
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as f:
+        all_configs = json.load(f)
+    if args.system not in all_configs:
+        print(f"Error: Target system '{args.system}' not found in config.json.")
+        return
+    config = all_configs[args.system]['config']
+    spreadsheet_id = all_configs[args.system]['spreadsheet_id']
+
+    output_dir = os.path.join('formula_exports', args.system)
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    if args.snapshot:
+        values = Snapshot.open(args.snapshot).values()
+    else:
+        from api_metrics import ApiMetrics, write_metrics
+        from auth import get_authenticated_service
+        metrics = ApiMetrics()
+        values = fetch_values(get_authenticated_service("sheets", "v4", metrics=metrics), spreadsheet_id)
+        write_metrics(metrics, output_dir, timestamp, prefix='evaluation_')
+        if values is None:
+            print("Not all sheets were fetched; a missing sheet would evaluate as #REF!. Exiting.")
+            return
+
+    house_sheets = []
+    if config.get('houseSheetNamePattern'):
+        pattern = re.compile(config['houseSheetNamePattern'])
+        house_sheets = [sheet for sheet in values if pattern.match(sheet)]
+    with open(args.formulas_csv, 'r', encoding='utf-8', newline='') as f:
+        formulas = load_formulas(csv.DictReader(f), config.get('templateSheetName'), house_sheets)
+
+    evaluator = Evaluator(values, formulas, args.today)
+    filename = os.path.join(output_dir, f"evaluation_{timestamp}.csv")
+    statuses = Counter()
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=['Sheet', 'Cell', 'Live Value', 'Computed Value', 'Status'],
+                                lineterminator='\n')
+        writer.writeheader()
+        for row in compare_sheets(evaluator, args.sheets):
+            writer.writerow(row)
+            statuses[row['Status']] += 1
+
+    print(f"Evaluated {sum(statuses.values())} formulas: " +
+          ", ".join(f"{count} {status}" for status, count in statuses.most_common()))
+    if evaluator.unsupported:
+        print("Unsupported: " + ", ".join(f"{name} ({count})" for name, count in evaluator.unsupported.most_common()))
+    print(f"Comparison saved to: {filename}")
+
+
+if __name__ == "__main__":
+    main()
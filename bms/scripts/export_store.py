@@ -0,0 +1,379 @@
+"""
+Content-addressed, deduplicated history of formula exports.
+
+Every sheet's formula set ([cell, formula] pairs in scan order) is stored
+once under the SHA-256 of its content, so a sheet that did not change
+between runs, or that is identical to another sheet, costs nothing extra.
+A run is a small manifest naming the hash of each exported sheet:
+
+    objects/<hash[:2]>/<hash>.json.gz   one sheet's formula set
+    runs/<run_id>.json                  run metadata and sheet -> hash
+
+index.sqlite indexes (run, sheet, cell, formula hash) through the tables
+runs, run_sheets (run, sheet, sheet hash), sheet_cells (sheet hash, cell,
+formula hash) and formulas (formula hash, text); the run_cells view joins
+them. Diffs between runs and the history of a cell are index lookups, and
+only sheets whose hash differs are compared cell by cell. The index is
+derived from the manifests and objects and can be rebuilt with `reindex`.
+
+Usage:
+    python3 export_store.py import <system> <formulas.csv> [...]
+    python3 export_store.py runs [system]
+    python3 export_store.py diff <run_a> <run_b> [output.csv]
+    python3 export_store.py history <sheet> <cell> [system]
+    python3 export_store.py export <run_id> <output.csv>
+    python3 export_store.py reindex
+"""
+import csv
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import sys
+
+from formula_table import FormulaTable
+from sheet_cache import content_hash
+
+STORE_ROOT = 'export_store'
+INDEX_NAME = 'index.sqlite'
+DIFF_COLUMNS = ['Sheet Name', 'Cell', 'Change', 'Old Formula', 'New Formula']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    system TEXT NOT NULL,
+    created TEXT NOT NULL,
+    source TEXT
+);
+CREATE TABLE IF NOT EXISTS run_sheets (
+    run_id TEXT NOT NULL,
+    sheet TEXT NOT NULL,
+    sheet_hash TEXT NOT NULL,
+    PRIMARY KEY (run_id, sheet)
+);
+CREATE INDEX IF NOT EXISTS run_sheets_by_sheet ON run_sheets (sheet, run_id);
+CREATE TABLE IF NOT EXISTS sheet_cells (
+    sheet_hash TEXT NOT NULL,
+    cell TEXT NOT NULL,
+    formula_hash TEXT NOT NULL,
+    PRIMARY KEY (sheet_hash, cell)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS formulas (
+    formula_hash TEXT PRIMARY KEY,
+    formula TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE VIEW IF NOT EXISTS run_cells AS
+    SELECT run_sheets.run_id, run_sheets.sheet, sheet_cells.cell, sheet_cells.formula_hash
+    FROM run_sheets JOIN sheet_cells USING (sheet_hash);
+"""
+
+
+def formula_hash(formula):
+    """Returns the short content hash that identifies a formula text in the index."""
+    return hashlib.sha256(formula.encode('utf-8')).hexdigest()[:16]
+
+
+class ExportStore:
+    """A content-addressed export store rooted at a directory."""
+
+    def __init__(self, root=STORE_ROOT):
+        self.root = root
+        os.makedirs(os.path.join(root, 'objects'), exist_ok=True)
+        os.makedirs(os.path.join(root, 'runs'), exist_ok=True)
+        self.db = sqlite3.connect(os.path.join(root, INDEX_NAME))
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # --- Objects and manifests ---
+
+    def _object_path(self, sheet_hash):
+        return os.path.join(self.root, 'objects', sheet_hash[:2], f"{sheet_hash}.json.gz")
+
+    def put_sheet(self, cells):
+        """Stores a sheet's [cell, formula] pairs unless already present and returns their hash."""
+        sheet_hash = content_hash(cells)
+        path = self._object_path(sheet_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with gzip.open(f"{path}.part", 'wt', encoding='utf-8') as f:
+                json.dump(cells, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(f"{path}.part", path)
+        return sheet_hash
+
+    def get_sheet(self, sheet_hash):
+        with gzip.open(self._object_path(sheet_hash), 'rt', encoding='utf-8') as f:
+            return json.load(f)
+
+    def manifest(self, run_id):
+        path = os.path.join(self.root, 'runs', f"{run_id}.json")
+        if not os.path.exists(path):
+            raise KeyError(f"Unknown run: {run_id}")
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def _new_run_id(self, system, created):
+        run_id = f"{system}_{created}"
+        suffix = 1
+        while os.path.exists(os.path.join(self.root, 'runs', f"{run_id}.json")):
+            suffix += 1
+            run_id = f"{system}_{created}_{suffix}"
+        return run_id
+
+    def add_run(self, system, formulas, created=None, source=None):
+        """
+        Stores the formula records of one export run and returns its run id,
+        or None when there were no formulas. Records are grouped by their
+        'Sheet Name'; sheets keep the order in which they first appear. A run
+        identical to one already stored for the same system and time is not
+        added again.
+        """
+        sheets = {}
+        for formula in formulas:
+            sheets.setdefault(formula['Sheet Name'], []).append([formula['Cell'], formula['Formula']])
+        if not sheets:
+            return None
+        created = created or datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        hashes = {sheet: self.put_sheet(cells) for sheet, cells in sheets.items()}
+        # The same export imported twice (e.g. copies in several directories) is one run.
+        for (run_id,) in self.db.execute(
+                "SELECT run_id FROM runs WHERE system = ? AND created = ?", (system, created)).fetchall():
+            if self._sheet_hashes(run_id) == hashes:
+                return run_id
+        manifest = {
+            'run_id': self._new_run_id(system, created),
+            'system': system,
+            'created': created,
+            'source': source,
+            'sheets': [{'sheet': sheet, 'hash': hashes[sheet], 'formulas': len(cells)}
+                       for sheet, cells in sheets.items()],
+        }
+        path = os.path.join(self.root, 'runs', f"{manifest['run_id']}.json")
+        with open(f"{path}.part", 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=2)
+        os.replace(f"{path}.part", path)
+        self._index_run(manifest, {hashes[sheet]: cells for sheet, cells in sheets.items()})
+        self.db.commit()
+        return manifest['run_id']
+
+    # --- Index ---
+
+    def _index_run(self, manifest, objects=None):
+        """Indexes a run; objects maps sheet hashes to cells already in memory."""
+        self.db.execute(
+            "INSERT OR REPLACE INTO runs (run_id, system, created, source) VALUES (?, ?, ?, ?)",
+            (manifest['run_id'], manifest['system'], manifest['created'], manifest.get('source'))
+        )
+        self.db.execute("DELETE FROM run_sheets WHERE run_id = ?", (manifest['run_id'],))
+        for entry in manifest['sheets']:
+            self.db.execute(
+                "INSERT INTO run_sheets (run_id, sheet, sheet_hash) VALUES (?, ?, ?)",
+                (manifest['run_id'], entry['sheet'], entry['hash'])
+            )
+            indexed = self.db.execute(
+                "SELECT 1 FROM sheet_cells WHERE sheet_hash = ? LIMIT 1", (entry['hash'],)
+            ).fetchone()
+            if indexed:
+                continue
+            cells = (objects or {}).get(entry['hash']) or self.get_sheet(entry['hash'])
+            hashes = [formula_hash(formula) for _, formula in cells]
+            self.db.executemany(
+                "INSERT OR IGNORE INTO formulas (formula_hash, formula) VALUES (?, ?)",
+                ((h, formula) for h, (_, formula) in zip(hashes, cells))
+            )
+            self.db.executemany(
+                "INSERT OR REPLACE INTO sheet_cells (sheet_hash, cell, formula_hash) VALUES (?, ?, ?)",
+                ((entry['hash'], cell, h) for h, (cell, _) in zip(hashes, cells))
+            )
+
+    def reindex(self):
+        """Rebuilds index.sqlite from the run manifests and returns the number of runs."""
+        self.db.executescript(
+            "DELETE FROM runs; DELETE FROM run_sheets; DELETE FROM sheet_cells; DELETE FROM formulas;"
+        )
+        names = sorted(os.listdir(os.path.join(self.root, 'runs')))
+        for name in names:
+            if name.endswith('.json'):
+                self._index_run(self.manifest(name[:-len('.json')]))
+        self.db.commit()
+        return len(names)
+
+    # --- Queries ---
+
+    def runs(self, system=None):
+        """Returns (run_id, system, created, sheets, formulas) for every run, oldest first."""
+        return self.db.execute(
+            "SELECT runs.run_id, system, created, COUNT(DISTINCT run_sheets.sheet), COUNT(sheet_cells.cell) "
+            "FROM runs LEFT JOIN run_sheets USING (run_id) "
+            "LEFT JOIN sheet_cells USING (sheet_hash) "
+            "WHERE ? IS NULL OR system = ? GROUP BY runs.run_id ORDER BY created, runs.run_id",
+            (system, system)
+        ).fetchall()
+
+    def _sheet_hashes(self, run_id):
+        rows = self.db.execute("SELECT sheet, sheet_hash FROM run_sheets WHERE run_id = ?", (run_id,)).fetchall()
+        if not rows and not self.db.execute("SELECT 1 FROM runs WHERE run_id = ?", (run_id,)).fetchone():
+            raise KeyError(f"Unknown run: {run_id}")
+        return dict(rows)
+
+    def _cells(self, sheet_hash):
+        if sheet_hash is None:
+            return {}
+        return dict(self.db.execute(
+            "SELECT cell, formula_hash FROM sheet_cells WHERE sheet_hash = ?", (sheet_hash,)
+        ))
+
+    def _formula_texts(self, hashes):
+        texts = {}
+        hashes = list(hashes)
+        for start in range(0, len(hashes), 500):
+            chunk = hashes[start:start + 500]
+            texts.update(self.db.execute(
+                f"SELECT formula_hash, formula FROM formulas WHERE formula_hash IN ({','.join('?' * len(chunk))})",
+                chunk
+            ))
+        return texts
+
+    def diff(self, run_a, run_b):
+        """
+        Returns the cells that differ between two runs as DIFF_COLUMNS records
+        ('added', 'removed' or 'changed'). Sheets with the same content hash
+        in both runs are skipped without reading their cells.
+        """
+        sheets_a, sheets_b = self._sheet_hashes(run_a), self._sheet_hashes(run_b)
+        changes = []
+        for sheet in list(sheets_a) + [name for name in sheets_b if name not in sheets_a]:
+            if sheets_a.get(sheet) == sheets_b.get(sheet):
+                continue
+            cells_a, cells_b = self._cells(sheets_a.get(sheet)), self._cells(sheets_b.get(sheet))
+            for cell in list(cells_a) + [cell for cell in cells_b if cell not in cells_a]:
+                old, new = cells_a.get(cell), cells_b.get(cell)
+                if old != new:
+                    change = 'added' if old is None else 'removed' if new is None else 'changed'
+                    changes.append((sheet, cell, change, old, new))
+        texts = self._formula_texts({h for change in changes for h in change[3:] if h})
+        return [{
+            'Sheet Name': sheet, 'Cell': cell, 'Change': change,
+            'Old Formula': texts.get(old, ''), 'New Formula': texts.get(new, ''),
+        } for sheet, cell, change, old, new in changes]
+
+    def cell_history(self, sheet, cell, system=None):
+        """
+        Returns (run_id, created, formula or None) for every run that exported
+        the sheet, oldest first.
+        """
+        return self.db.execute(
+            "SELECT runs.run_id, runs.created, formulas.formula FROM run_sheets "
+            "JOIN runs USING (run_id) "
+            "LEFT JOIN sheet_cells ON sheet_cells.sheet_hash = run_sheets.sheet_hash AND sheet_cells.cell = ? "
+            "LEFT JOIN formulas USING (formula_hash) "
+            "WHERE run_sheets.sheet = ? AND (? IS NULL OR runs.system = ?) "
+            "ORDER BY runs.created, runs.run_id",
+            (cell, sheet, system, system)
+        ).fetchall()
+
+    def iter_run_formulas(self, run_id):
+        """Yields the formula records of a run in export order."""
+        for entry in self.manifest(run_id)['sheets']:
+            for cell, formula in self.get_sheet(entry['hash']):
+                yield {'Sheet Name': entry['sheet'], 'Cell': cell, 'Formula': formula}
+
+
+class RunRecorder:
+    """
+    Passes formula records through (see stream) while collecting them, and
+    adds them to the store as one run on commit. Nothing is stored for an
+    empty or abandoned stream.
+    """
+
+    def __init__(self, system, source=None, root=STORE_ROOT):
+        self.system = system
+        self.source = source
+        self.root = root
+        self.formulas = FormulaTable()
+
+    def stream(self, formulas):
+        for formula in formulas:
+            self.formulas.add_record(formula)
+            yield formula
+
+    def commit(self, created=None):
+        with ExportStore(self.root) as store:
+            run_id = store.add_run(self.system, self.formulas, created, self.source)
+        self.formulas = FormulaTable()
+        return run_id
+
+
+def _created_from_filename(path):
+    match = re.search(r'(\d{4}-\d{2}-\d{2}_\d{2}-\d{2}-\d{2})', os.path.basename(path))
+    return match.group(1) if match else None
+
+
+def import_exports(store, system, paths):
+    """Adds existing formulas_*.csv exports to the store, one run each."""
+    for path in paths:
+        with open(path, 'r', encoding='utf-8', newline='') as f:
+            run_id = store.add_run(system, csv.DictReader(f), _created_from_filename(path), os.path.basename(path))
+        print(f"{path} -> {run_id}")
+
+
+def main():
+    commands = {'import': 3, 'runs': 1, 'diff': 3, 'history': 3, 'export': 3, 'reindex': 1}
+    if len(sys.argv) < 2 or len(sys.argv) - 1 < commands.get(sys.argv[1], 99):
+        print(__doc__.split('Usage:')[1].rstrip())
+        return
+    command, args = sys.argv[1], sys.argv[2:]
+    with ExportStore() as store:
+        try:
+            if command == 'import':
+                import_exports(store, args[0], args[1:])
+            elif command == 'runs':
+                for run_id, system, created, sheets, formulas in store.runs(args[0] if args else None):
+                    print(f"{run_id}  {system}  {created}  {sheets} sheets  {formulas} formulas")
+            elif command == 'diff':
+                changes = store.diff(args[0], args[1])
+                counts = {kind: sum(change['Change'] == kind for change in changes)
+                          for kind in ('added', 'removed', 'changed')}
+                print(f"{args[0]} -> {args[1]}: {counts['changed']} changed, {counts['added']} added, "
+                      f"{counts['removed']} removed")
+                if len(args) > 2:
+                    with open(args[2], 'w', encoding='utf-8', newline='') as f:
+                        writer = csv.DictWriter(f, fieldnames=DIFF_COLUMNS, lineterminator='\n')
+                        writer.writeheader()
+                        writer.writerows(changes)
+                    print(f"Diff saved to: {args[2]}")
+                else:
+                    for change in changes:
+                        print(f"{change['Change']:>8} {change['Sheet Name']}!{change['Cell']}: "
+                              f"{change['Old Formula']} -> {change['New Formula']}")
+            elif command == 'history':
+                previous = object()
+                system = args[2] if len(args) > 2 else None
+                for run_id, created, formula in store.cell_history(args[0], args[1].upper(), system):
+                    if formula != previous:
+                        print(f"{created}  {run_id}: {formula if formula is not None else '(no formula)'}")
+                        previous = formula
+            elif command == 'export':
+                with open(args[1], 'w', encoding='utf-8', newline='') as f:
+                    writer = csv.DictWriter(f, fieldnames=['Sheet Name', 'Cell', 'Formula'], lineterminator='\n')
+                    writer.writeheader()
+                    writer.writerows(store.iter_run_formulas(args[0]))
+                print(f"Run {args[0]} saved to: {args[1]}")
+            else:
+                print(f"Reindexed {store.reindex()} runs.")
+        except KeyError as err:
+            print(f"Error: {err.args[0]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""
+Offline stand-in for the parts of the Sheets and Drive APIs the scripts use.
+
+FakeWorkbook holds every sheet's FORMULA and UNFORMATTED_VALUE matrices and
+serves spreadsheets().get, spreadsheets().values().get/batchGet/batchUpdate
+and Drive files().get through request objects with the same execute() surface as
+googleapiclient, counting every call. Workbooks come from a recording of a
+real spreadsheet or are generated from a formula export (the BMS template
+plus any number of house sheets).
+
+`replay` runs a script with auth.use_fake_backend installed, so every
+get_authenticated_service call in it returns the fake and nothing reaches
+the live APIs; the scripts themselves have no switch for it. A workbook
+loaded from a file reloads it whenever the file changes, so `bump` stands
+in for an edit to the spreadsheet (e.g. for main.py --watch).
+
+Usage:
+    python3 fake_sheets.py record <system> <recording.json>
+    python3 fake_sheets.py synthetic <houses> <recording.json> [export_csv]
+    python3 fake_sheets.py bump <recording.json>
+    python3 fake_sheets.py replay <recording.json> <script.py> [args ...]
+"""
+import csv
+import datetime
+import glob
+import json
+import os
+import re
+import sys
+from collections import Counter
+
+import httplib2
+from googleapiclient.errors import HttpError
+
+from a1 import column_index, parse_cell
+
+RENDER_OPTIONS = ('FORMULA', 'UNFORMATTED_VALUE')
+EXPORTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'exports')
+
+# Template-sized sheets: the BMS house template spans A1:AX1001.
+TEMPLATE_ROWS = 1001
+TEMPLATE_COLUMNS = 50
+SUMMARY_SHEETS = ['Summary', 'Monthly payment']
+
+_RANGE = re.compile(r"^(?:'((?:[^']|'')+)'|([^!]+?))(?:!(\$?[A-Za-z]*\$?\d*)(?::(\$?[A-Za-z]*\$?\d*))?)?$")
+
+
+def _http_error(status, message):
+    return HttpError(httplib2.Response({'status': status}), json.dumps({'error': {'message': message}}).encode())
+
+
+def _bound(part, default_row, default_col):
+    part = part.replace('$', '')
+    letters = part.rstrip('0123456789')
+    digits = part[len(letters):]
+    row = int(digits) - 1 if digits else default_row
+    col = column_index(letters) if letters else default_col
+    return row, col
+
+
+def parse_range(a1_range):
+    """
+    Splits an A1 range such as 'Summary', "'House 1'!A1:C10" or 'Summary!B:B'
+    into (sheet, first_row, last_row, first_col, last_col). Open ends are None.
+    """
+    match = _RANGE.match(a1_range)
+    if not match:
+        raise ValueError(f"Unable to parse range: {a1_range}")
+    quoted, bare, start, end = match.groups()
+    sheet = quoted.replace("''", "'") if quoted else bare
+    if start is None:
+        return sheet, 0, None, 0, None
+    first_row, first_col = _bound(start, 0, 0)
+    last_row, last_col = _bound(end, None, None) if end else (first_row, first_col)
+    return sheet, first_row, last_row, first_col, last_col
+
+
+def _trim(rows):
+    """Drops trailing empty cells and rows, as the API does."""
+    trimmed = []
+    for row in rows:
+        end = len(row)
+        while end and (row[end - 1] is None or row[end - 1] == ''):
+            end -= 1
+        trimmed.append(row[:end] if end != len(row) else row)
+    while trimmed and not trimmed[-1]:
+        trimmed.pop()
+    return trimmed
+
+
+class FakeRequest:
+    """Mimics googleapiclient's HttpRequest: the response is built on execute()."""
+
+    def __init__(self, workbook, method, respond):
+        self.workbook = workbook
+        self.method = method
+        self.respond = respond
+
+    def execute(self, http=None, num_retries=0):
+        self.workbook.calls[self.method] += 1
+        return self.respond()
+
+
+class FakeWorkbook:
+    """
+    An in-memory spreadsheet. sheets maps each sheet name to a dict with a
+    matrix per render option; version is reported through the Drive fake.
+    """
+
+    def __init__(self, sheets, spreadsheet_id=None, version='1'):
+        self.sheets = sheets
+        self.spreadsheet_id = spreadsheet_id
+        self.version = version
+        self.calls = Counter()
+        self.path = None
+        self.modified = None
+
+    @classmethod
+    def load(cls, path):
+        workbook = cls({})
+        workbook.path = path
+        workbook.reload()
+        return workbook
+
+    def reload(self):
+        """Re-reads the recording this workbook was loaded from if the file changed."""
+        modified = os.path.getmtime(self.path)
+        if modified == self.modified:
+            return
+        with open(self.path, 'r', encoding='utf-8') as f:
+            recording = json.load(f)
+        self.sheets = recording['sheets']
+        self.spreadsheet_id = recording.get('spreadsheet_id')
+        self.version = str(recording.get('version', '1'))
+        self.modified = modified
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'spreadsheet_id': self.spreadsheet_id, 'version': self.version, 'sheets': self.sheets},
+                      f, ensure_ascii=False)
+
+    # --- googleapiclient surface ---
+
+    def spreadsheets(self):
+        return self
+
+    def values(self):
+        return self
+
+    def files(self):
+        return self
+
+    def _check_id(self, spreadsheet_id):
+        if self.spreadsheet_id is not None and spreadsheet_id != self.spreadsheet_id:
+            raise _http_error(404, f"Requested entity was not found: {spreadsheet_id}")
+
+    def get(self, spreadsheetId=None, range=None, valueRenderOption='FORMATTED_VALUE', fields=None,
+            fileId=None, **kwargs):
+        if fileId is not None:
+            return FakeRequest(self, 'drive.files.get', lambda: self._revision(fileId))
+        if range is None:
+            return FakeRequest(self, 'spreadsheets.get', lambda: self._metadata(spreadsheetId))
+        return FakeRequest(self, 'values.get', lambda: self._value_range(spreadsheetId, range, valueRenderOption))
+
+    def batchGet(self, spreadsheetId=None, ranges=(), valueRenderOption='FORMATTED_VALUE', **kwargs):
+        return FakeRequest(self, 'values.batchGet', lambda: {
+            'spreadsheetId': spreadsheetId,
+            'valueRanges': [self._value_range(spreadsheetId, a1_range, valueRenderOption) for a1_range in ranges],
+        })
+
+    def batchUpdate(self, spreadsheetId=None, body=None, **kwargs):
+        return FakeRequest(self, 'values.batchUpdate', lambda: self._update_values(spreadsheetId, body))
+
+    # --- Responses ---
+
+    def _revision(self, file_id):
+        if self.path:
+            self.reload()
+        self._check_id(file_id)
+        modified = datetime.datetime.fromtimestamp(self.modified or 0, datetime.timezone.utc)
+        return {'version': self.version, 'modifiedTime': modified.strftime('%Y-%m-%dT%H:%M:%S.%fZ')}
+
+    def _metadata(self, spreadsheet_id):
+        self._check_id(spreadsheet_id)
+        sheets = []
+        for index, (name, sheet) in enumerate(self.sheets.items()):
+            rows = sheet['FORMULA']
+            sheets.append({'properties': {
+                'sheetId': index,
+                'title': name,
+                'index': index,
+                'gridProperties': {
+                    'rowCount': max(len(rows), 1),
+                    'columnCount': max((len(row) for row in rows), default=1) or 1,
+                },
+            }})
+        return {'spreadsheetId': spreadsheet_id, 'sheets': sheets}
+
+    def _update_values(self, spreadsheet_id, body):
+        """
+        Writes values.batchUpdate data into both renders. USER_ENTERED input
+        keeps formulas (their value reads as 0, like generated sheets), parses
+        numbers and strips a leading apostrophe; RAW input is stored as given.
+        """
+        self._check_id(spreadsheet_id)
+        user_entered = body.get('valueInputOption') == 'USER_ENTERED'
+        updated = {}
+        for value_range in body.get('data', []):
+            try:
+                sheet_name, first_row, _, first_col, _ = parse_range(value_range['range'])
+            except ValueError:
+                raise _http_error(400, f"Unable to parse range: {value_range['range']}")
+            if sheet_name not in self.sheets:
+                raise _http_error(400, f"Unable to parse range: {value_range['range']}")
+            if sheet_name not in updated:
+                # Generated house sheets share the template's matrices; copy before writing.
+                self.sheets[sheet_name] = {option: [list(row) for row in rows]
+                                           for option, rows in self.sheets[sheet_name].items()}
+                updated[sheet_name] = 0
+            sheet = self.sheets[sheet_name]
+            for r_offset, row in enumerate(value_range.get('values', [])):
+                for c_offset, entered in enumerate(row):
+                    formula = value = entered
+                    if user_entered and isinstance(entered, str):
+                        if entered.startswith("'"):
+                            formula = value = entered[1:]
+                        elif entered.startswith('='):
+                            value = 0
+                        else:
+                            try:
+                                formula = value = float(entered)
+                            except ValueError:
+                                pass
+                    for option, cell_value in (('FORMULA', formula), ('UNFORMATTED_VALUE', value)):
+                        rows = sheet[option]
+                        r_idx, c_idx = first_row + r_offset, first_col + c_offset
+                        while len(rows) <= r_idx:
+                            rows.append([])
+                        if len(rows[r_idx]) <= c_idx:
+                            rows[r_idx].extend([''] * (c_idx + 1 - len(rows[r_idx])))
+                        rows[r_idx][c_idx] = cell_value
+                    updated[sheet_name] += 1
+        return {
+            'spreadsheetId': spreadsheet_id,
+            'totalUpdatedCells': sum(updated.values()),
+            'totalUpdatedSheets': len(updated),
+        }
+
+    def _value_range(self, spreadsheet_id, a1_range, render_option):
+        self._check_id(spreadsheet_id)
+        try:
+            sheet_name, first_row, last_row, first_col, last_col = parse_range(a1_range)
+        except ValueError:
+            raise _http_error(400, f"Unable to parse range: {a1_range}")
+        sheet = self.sheets.get(sheet_name)
+        if sheet is None:
+            raise _http_error(400, f"Unable to parse range: {a1_range}")
+        rows = sheet['FORMULA' if render_option == 'FORMULA' else 'UNFORMATTED_VALUE']
+        if first_row or first_col or last_row is not None or last_col is not None:
+            end_row = None if last_row is None else last_row + 1
+            end_col = None if last_col is None else last_col + 1
+            rows = _trim([row[first_col:end_col] for row in rows[first_row:end_row]])
+        response = {'range': a1_range, 'majorDimension': 'ROWS'}
+        if rows:
+            response['values'] = rows
+        return response
+
+
+# --- Workbook sources ---
+
+def record_workbook(service, spreadsheet_id, sheet_names=None):
+    """
+    Captures both renders of every sheet of a live spreadsheet into a
+    FakeWorkbook. Returns None when any sheet could not be fetched.
+    """
+    from main import DEFAULT_BATCH_SIZE, batch_get_sheet_values, get_all_sheet_names
+    if sheet_names is None:
+        sheet_names = get_all_sheet_names(service, spreadsheet_id) or []
+    renders = {
+        option: batch_get_sheet_values(service, spreadsheet_id, sheet_names, DEFAULT_BATCH_SIZE,
+                                       value_render_option=option)
+        for option in RENDER_OPTIONS
+    }
+    missing = [name for name in sheet_names
+               if any(name not in renders[option] for option in RENDER_OPTIONS)]
+    if missing:
+        print(f"Could not fetch {len(missing)} sheets: {', '.join(missing)}")
+        return None
+    sheets = {name: {option: renders[option][name] for option in RENDER_OPTIONS} for name in sheet_names}
+    return FakeWorkbook(sheets, spreadsheet_id)
+
+
+def latest_export(exports_dir=EXPORTS_DIR):
+    exports = sorted(glob.glob(os.path.join(exports_dir, 'formulas_*.csv')))
+    return exports[-1] if exports else None
+
+
+def house_sheet_name(number):
+    """Returns a house sheet name matching the BMS houseSheetNamePattern."""
+    return f"{1000 + number:04d} E {number % 100:02d} ST {number % 10}"
+
+
+def _sheet_from_export(formulas, rows, columns):
+    """Builds (formula, value) matrices with the formulas in place and numbers elsewhere."""
+    formula_rows = [[(r * columns + c) % 7 or '' for c in range(columns)] for r in range(rows)]
+    value_rows = [list(row) for row in formula_rows]
+    for (r_idx, c_idx), formula in formulas.items():
+        if r_idx < rows and c_idx < columns:
+            formula_rows[r_idx][c_idx] = formula
+            value_rows[r_idx][c_idx] = 0
+    return {'FORMULA': _trim(formula_rows), 'UNFORMATTED_VALUE': _trim(value_rows)}
+
+
+def synthetic_workbook(export_csv, houses, template_name='House template', spreadsheet_id=None):
+    """
+    Generates a BMS-shaped workbook from a formula export: the template, the
+    summary sheets and `houses` house sheets that are copies of the template.
+    House sheets share the template's matrices, so even large workbooks take
+    little memory.
+    """
+    by_sheet = {}
+    with open(export_csv, 'r', encoding='utf-8', newline='') as f:
+        for record in csv.DictReader(f):
+            sheet = record['Sheet Name'].replace(' (TEMPLATE)', '')
+            by_sheet.setdefault(sheet, {})[parse_cell(record['Cell'])] = record['Formula']
+
+    template = _sheet_from_export(by_sheet.get(template_name, {}), TEMPLATE_ROWS, TEMPLATE_COLUMNS)
+    sheets = {template_name: template}
+    for name in SUMMARY_SHEETS:
+        cells = by_sheet.get(name, {})
+        rows = max((r for r, _ in cells), default=0) + 1
+        columns = max((c for _, c in cells), default=0) + 1
+        sheets[name] = _sheet_from_export(cells, rows, columns)
+    for number in range(houses):
+        sheets[house_sheet_name(number)] = template
+    return FakeWorkbook(sheets, spreadsheet_id)
+
+
+def bump(path):
+    """Increments a recording's version, as an edit to the live spreadsheet would."""
+    with open(path, 'r', encoding='utf-8') as f:
+        recording = json.load(f)
+    recording['version'] = str(int(recording.get('version', '1')) + 1)
+    with open(f"{path}.part", 'w', encoding='utf-8') as f:
+        json.dump(recording, f, ensure_ascii=False)
+    os.replace(f"{path}.part", path)
+    return recording['version']
+
+
+def replay(path, script, args):
+    """Runs a script as __main__ with every API client served from the recording at path."""
+    import runpy
+    from auth import use_fake_backend
+    use_fake_backend(FakeWorkbook.load(path))
+    print(f"Replaying {path}; the live APIs are not called.")
+    sys.argv = [script] + list(args)
+    runpy.run_path(script, run_name='__main__')
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == 'bump':
+        print(f"{sys.argv[2]} is now at version {bump(sys.argv[2])}")
+        return
+    if len(sys.argv) >= 4 and sys.argv[1] == 'replay':
+        replay(sys.argv[2], sys.argv[3], sys.argv[4:])
+        return
+    if len(sys.argv) < 4 or sys.argv[1] not in ('record', 'synthetic'):
+        print(__doc__.split('Usage:')[1].rstrip())
+        return
+    command, destination = sys.argv[1], sys.argv[3]
+    if command == 'record':
+        from api_metrics import ApiMetrics, print_totals
+        from auth import get_authenticated_service
+        with open('config.json', 'r') as f:
+            all_configs = json.load(f)
+        if sys.argv[2] not in all_configs:
+            print(f"Error: Target system '{sys.argv[2]}' not found in config.json.")
+            return
+        metrics = ApiMetrics()
+        workbook = record_workbook(get_authenticated_service("sheets", "v4", metrics=metrics),
+                                   all_configs[sys.argv[2]]['spreadsheet_id'])
+        print_totals(metrics)
+        if workbook is None:
+            print("Recording not written to avoid an incomplete workbook.")
+            return
+    else:
+        export_csv = sys.argv[4] if len(sys.argv) > 4 else latest_export()
+        if not export_csv:
+            print("No export CSV found; pass one explicitly.")
+            return
+        workbook = synthetic_workbook(export_csv, int(sys.argv[2]))
+    workbook.save(destination)
+    print(f"Recorded {len(workbook.sheets)} sheets to: {destination}")
+
+
+if __name__ == "__main__":
+    main()
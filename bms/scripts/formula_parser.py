@@ -0,0 +1,330 @@
+"""
+Tokenizer and parser for Google Sheets formulas.
+
+parse_formula turns the text of an exported formula into a small tree of
+namedtuples (Function, Reference, BinaryOp, ...). Trees are immutable, so
+parse results are memoized and shared: the same formula in many cells is
+only parsed once, and a repeat is found without normalizing its text.
+
+    >>> parse_formula('=SUM($B$19:$B$1001)')
+    Function(name='SUM', args=(Reference(sheet=None, start='$B$19', end='$B$1001'),))
+"""
+import re
+from collections import OrderedDict, namedtuple
+
+# Entries in the parse cache; a formula whose text is not already normalized
+# takes two, one per text.
+PARSE_CACHE_SIZE = 16384
+
+
+class FormulaSyntaxError(ValueError):
+    """Raised when a formula cannot be tokenized or parsed."""
+
+
+# --- Tree nodes ---
+
+Number = namedtuple('Number', ['value'])
+String = namedtuple('String', ['value'])
+Boolean = namedtuple('Boolean', ['value'])
+Error = namedtuple('Error', ['code'])
+Empty = namedtuple('Empty', [])
+# A cell or range reference. start/end keep their A1 text including '$'
+# markers; end is None for a single cell. Column-only ('B:B', '$F$5:$F') and
+# row-only ('1:1') ranges keep the same shape.
+Reference = namedtuple('Reference', ['sheet', 'start', 'end'])
+Name = namedtuple('Name', ['name'])
+# A structured table reference such as Summary[Net Payments].
+TableReference = namedtuple('TableReference', ['table', 'column'])
+Function = namedtuple('Function', ['name', 'args'])
+UnaryOp = namedtuple('UnaryOp', ['op', 'operand'])
+BinaryOp = namedtuple('BinaryOp', ['op', 'left', 'right'])
+Percent = namedtuple('Percent', ['operand'])
+Array = namedtuple('Array', ['rows'])
+
+Token = namedtuple('Token', ['kind', 'text', 'position'])
+
+# --- Tokenizer ---
+
+_SHEET_PREFIX = r"(?:(?:'(?:[^']|'')+'|[A-Za-z_][A-Za-z0-9_.]*)!)"
+_CELL = r'\$?[A-Za-z]{1,3}\$?\d+'
+_COLUMN = r'\$?[A-Za-z]{1,3}'
+_ROW = r'\$?\d+'
+_AREA = (rf'(?:{_CELL}(?::(?:{_CELL}|{_COLUMN}(?![A-Za-z])|{_ROW}))?'
+         rf'|{_COLUMN}:{_COLUMN}|{_ROW}:{_ROW})')
+
+_TOKEN_SPEC = [
+    ('WHITESPACE', r'\s+'),
+    ('STRING', r'"(?:[^"]|"")*"'),
+    ('ERROR', r'#(?:NULL!|DIV/0!|VALUE!|REF!|NAME\?|NUM!|N/A|ERROR!)'),
+    ('REFERENCE', rf'{_SHEET_PREFIX}?{_AREA}(?![A-Za-z0-9_.(!])'),
+    ('NUMBER', r'(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?'),
+    ('BOOLEAN', r'(?i:TRUE|FALSE)(?![A-Za-z0-9_.(])'),
+    ('TABLE', r'[A-Za-z_][A-Za-z0-9_.]*\[(?:[^\[\]]|\[[^\]]*\])*\]'),
+    ('FUNCTION', r'[A-Za-z_][A-Za-z0-9_.]*(?=\s*\()'),
+    ('NAME', r'[A-Za-z_][A-Za-z0-9_.]*'),
+    ('OPERATOR', r'<>|<=|>=|[-+*/^&=<>%:]'),
+    ('PUNCTUATION', r'[(),;{}\\]'),
+]
+_TOKEN_PATTERN = re.compile('|'.join(f'(?P<{kind}>{pattern})' for kind, pattern in _TOKEN_SPEC))
+_QUOTED_OR_SPACE = re.compile(r'"(?:[^"]|"")*"|\'(?:[^\']|\'\')*\'|\[(?:[^\[\]]|\[[^\]]*\])*\]|\s+')
+
+
+def tokenize(formula):
+    """Returns the tokens of a formula (without its leading '='), skipping whitespace."""
+    tokens = []
+    position = 0
+    for match in _TOKEN_PATTERN.finditer(formula):
+        if match.start() != position:
+            break
+        kind = match.lastgroup
+        if kind != 'WHITESPACE':
+            tokens.append(Token(kind, match.group(), position))
+        position = match.end()
+    if position != len(formula):
+        raise FormulaSyntaxError(f"Unexpected character {formula[position]!r} at {position}")
+    return tokens
+
+
+def normalize_formula(formula):
+    """
+    Strips the leading '=' and all whitespace outside string literals, quoted
+    sheet names and table column names.
+    """
+    formula = formula.strip()
+    if formula.startswith('='):
+        formula = formula[1:]
+    return _QUOTED_OR_SPACE.sub(lambda m: '' if m.group().isspace() else m.group(), formula)
+
+
+# --- Parser ---
+
+_COMPARISON_OPERATORS = {'=', '<>', '<', '>', '<=', '>='}
+
+
+class _Parser:
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.index = 0
+
+    def peek(self, text=None):
+        if self.index >= len(self.tokens):
+            return None
+        token = self.tokens[self.index]
+        if text is not None and token.text != text:
+            return None
+        return token
+
+    def take(self, text=None):
+        token = self.peek(text)
+        if token is None:
+            found = self.peek()
+            where = f"{found.text!r} at {found.position}" if found else "end of formula"
+            raise FormulaSyntaxError(f"Expected {text or 'an expression'}, found {where}")
+        self.index += 1
+        return token
+
+    def parse(self):
+        node = self.expression()
+        if self.peek() is not None:
+            token = self.peek()
+            raise FormulaSyntaxError(f"Unexpected {token.text!r} at {token.position}")
+        return node
+
+    def binary(self, operand, operators):
+        node = operand()
+        while self.peek() is not None and self.peek().kind == 'OPERATOR' and self.peek().text in operators:
+            op = self.take().text
+            node = BinaryOp(op, node, operand())
+        return node
+
+    def expression(self):
+        return self.binary(self.concatenation, _COMPARISON_OPERATORS)
+
+    def concatenation(self):
+        return self.binary(self.additive, {'&'})
+
+    def additive(self):
+        return self.binary(self.multiplicative, {'+', '-'})
+
+    def multiplicative(self):
+        return self.binary(self.power, {'*', '/'})
+
+    def power(self):
+        return self.binary(self.unary, {'^'})
+
+    def unary(self):
+        token = self.peek()
+        if token is not None and token.kind == 'OPERATOR' and token.text in ('+', '-'):
+            self.take()
+            return UnaryOp(token.text, self.unary())
+        node = self.range()
+        while self.peek('%'):
+            self.take()
+            node = Percent(node)
+        return node
+
+    def range(self):
+        # Dynamic ranges such as A1:INDEX(...) use ':' as an operator.
+        return self.binary(self.primary, {':'})
+
+    def primary(self):
+        token = self.take()
+        kind, text = token.kind, token.text
+        if kind == 'NUMBER':
+            return Number(float(text))
+        if kind == 'STRING':
+            return String(text[1:-1].replace('""', '"'))
+        if kind == 'BOOLEAN':
+            return Boolean(text.upper() == 'TRUE')
+        if kind == 'ERROR':
+            return Error(text)
+        if kind == 'REFERENCE':
+            return _reference(text)
+        if kind == 'NAME':
+            return Name(text)
+        if kind == 'TABLE':
+            table, _, column = text.partition('[')
+            return TableReference(table, column[:-1])
+        if kind == 'FUNCTION':
+            return Function(text.upper(), self.arguments())
+        if text == '(':
+            node = self.expression()
+            self.take(')')
+            return node
+        if text == '{':
+            return self.array()
+        raise FormulaSyntaxError(f"Unexpected {text!r} at {token.position}")
+
+    def arguments(self):
+        self.take('(')
+        args = []
+        if self.peek(')'):
+            self.take()
+            return ()
+        while True:
+            if self.peek(',') or self.peek(';') or self.peek(')'):
+                args.append(Empty())
+            else:
+                args.append(self.expression())
+            if self.peek(')'):
+                self.take()
+                return tuple(args)
+            if not (self.peek(',') or self.peek(';')):
+                self.take(')')
+            self.take()
+
+    def array(self):
+        rows = []
+        row = [self.expression()]
+        while True:
+            token = self.take()
+            if token.text in (',', '\\'):
+                row.append(self.expression())
+            elif token.text == ';':
+                rows.append(tuple(row))
+                row = [self.expression()]
+            elif token.text == '}':
+                rows.append(tuple(row))
+                return Array(tuple(rows))
+            else:
+                raise FormulaSyntaxError(f"Unexpected {token.text!r} in array at {token.position}")
+
+
+def _reference(text):
+    sheet = None
+    if '!' in text:
+        sheet, _, text = text.rpartition('!')
+        if sheet.startswith("'"):
+            sheet = sheet[1:-1].replace("''", "'")
+    start, _, end = text.partition(':')
+    return Reference(sheet, start.upper(), end.upper() or None)
+
+
+CacheInfo = namedtuple('CacheInfo', ['hits', 'misses', 'maxsize', 'currsize'])
+
+# One LRU cache holding every tree under both its exact and its normalized
+# text: repeats are found without normalizing, and texts that differ only
+# in whitespace still share a tree.
+_parse_cache = OrderedDict()
+_parse_stats = [0, 0]
+
+
+def _remember(key, tree):
+    _parse_cache[key] = tree
+    if len(_parse_cache) > PARSE_CACHE_SIZE:
+        _parse_cache.popitem(last=False)
+
+
+def parse_formula(formula):
+    """
+    Parses a formula into a tree of nodes. Results are cached on the exact
+    text first and the normalized text on a miss, so formulas that differ
+    only in whitespace share one tree. Raises FormulaSyntaxError for
+    malformed formulas.
+    """
+    tree = _parse_cache.get(formula)
+    if tree is not None:
+        _parse_cache.move_to_end(formula)
+        _parse_stats[0] += 1
+        return tree
+    normalized = normalize_formula(formula)
+    tree = _parse_cache.get(normalized)
+    if tree is None:
+        tree = _Parser(tokenize(normalized)).parse()
+        _parse_stats[1] += 1
+        _remember(normalized, tree)
+    else:
+        _parse_stats[0] += 1
+    _remember(formula, tree)
+    return tree
+
+
+def parse_cache_info():
+    """Returns the hit/miss statistics of the parse cache."""
+    return CacheInfo(_parse_stats[0], _parse_stats[1], PARSE_CACHE_SIZE, len(_parse_cache))
+
+
+def clear_parse_cache():
+    _parse_cache.clear()
+    _parse_stats[:] = [0, 0]
+
+
+# --- Tree helpers ---
+
+def walk(node):
+    """Yields every node of a tree, parents before children."""
+    stack = [node]
+    while stack:
+        node = stack.pop()
+        yield node
+        if isinstance(node, Function):
+            stack.extend(reversed(node.args))
+        elif isinstance(node, BinaryOp):
+            stack.extend((node.right, node.left))
+        elif isinstance(node, (UnaryOp, Percent)):
+            stack.append(node.operand)
+        elif isinstance(node, Array):
+            stack.extend(reversed([item for row in node.rows for item in row]))
+
+
+def references(node):
+    """Returns every Reference in a tree, in formula order."""
+    return [child for child in walk(node) if isinstance(child, Reference)]
+
+
+def function_names(node):
+    """Returns the name of every function call in a tree, in formula order."""
+    return [child.name for child in walk(node) if isinstance(child, Function)]
+
+
+def depth(node):
+    """Returns the function nesting depth of a tree (0 when it calls no function)."""
+    if isinstance(node, Function):
+        return 1 + max((depth(arg) for arg in node.args), default=0)
+    if isinstance(node, BinaryOp):
+        return max(depth(node.left), depth(node.right))
+    if isinstance(node, (UnaryOp, Percent)):
+        return depth(node.operand)
+    if isinstance(node, Array):
+        return max((depth(item) for row in node.rows for item in row), default=0)
+    return 0
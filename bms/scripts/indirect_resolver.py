@@ -0,0 +1,299 @@
+"""
+Static INDIRECT resolver and rewrite planner.
+
+INDIRECT is volatile and hides its precedents, so every INDIRECT call makes
+its cell recalculate on any edit. Most calls in the BMS export build a fixed
+address, e.g. INDIRECT("'"&$A5&"'!$B$19:$B$1001") where $A5 holds a house
+sheet name typed into the summary. This pass constant-folds the address
+argument of every INDIRECT call and proposes the direct reference instead.
+
+An argument folds when everything it reads is constant: literals, '&'
+concatenations and other non-volatile operators and functions over them,
+and cells that hold a typed-in value in the value snapshot (not a
+formula). Cells read from sheets whose formulas are not in the export are
+only treated as constant when the sheet is listed with --constant-sheets.
+Calls that cannot be folded are counted by reason.
+
+Writes into formula_exports/<system>:
+    indirect_plan_<ts>.csv        sheet, cell, original and proposed formula
+                                  for every cell with a resolved call
+    indirect_unresolved_<ts>.csv  unresolved calls per reason, with an example
+
+Usage: python3 indirect_resolver.py <system> <formulas.csv> [--snapshot DIR]
+                                    [--constant-sheets SHEET ...] [--today YYYY-MM-DD]
+"""
+import argparse
+import csv
+import datetime
+import json
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from a1 import CELL_PATTERN, parse_cell
+from dependency_graph import reference_bounds, sheet_from_export_name
+from evaluator import Evaluator, is_error, load_formulas, to_bool, to_text
+from formula_parser import (
+    FormulaSyntaxError, Function, Name, Reference, TableReference, parse_formula, tokenize, walk,
+)
+from recalc_profiler import VOLATILE_FUNCTIONS
+from snapshot import Snapshot, latest_snapshot
+
+PLAN_COLUMNS = ['Sheet Name', 'Cell', 'Original Formula', 'Proposed Formula',
+                'Resolved Calls', 'Unresolved Calls', 'Still Volatile']
+UNRESOLVED_COLUMNS = ['Reason', 'Calls', 'Cells', 'Example']
+
+_BARE_SHEET_NAME = re.compile(r'^[A-Za-z_][A-Za-z0-9_]*$')
+
+
+class Unresolved(Exception):
+    """Raised with the reason an INDIRECT call cannot be folded."""
+
+
+def format_reference(reference):
+    """Returns the A1 text of a Reference, quoting the sheet name only when needed."""
+    text = reference.start if reference.end is None else f"{reference.start}:{reference.end}"
+    if reference.sheet is None:
+        return text
+    sheet = reference.sheet
+    if not _BARE_SHEET_NAME.match(sheet) or CELL_PATTERN.match(sheet):
+        sheet = "'" + sheet.replace("'", "''") + "'"
+    return f"{sheet}!{text}"
+
+
+def indirect_calls(formula):
+    """
+    Returns (start, end) spans of the INDIRECT calls in a formula's text,
+    end exclusive, outermost calls first.
+    """
+    try:
+        tokens = tokenize(formula[1:])
+    except FormulaSyntaxError:
+        return []
+    spans = []
+    for index, token in enumerate(tokens):
+        if token.kind != 'FUNCTION' or token.text.upper() != 'INDIRECT':
+            continue
+        depth = 0
+        for closing in tokens[index + 1:]:
+            if closing.text == '(':
+                depth += 1
+            elif closing.text == ')':
+                depth -= 1
+                if depth == 0:
+                    spans.append((token.position + 1, closing.position + 2))
+                    break
+    return spans
+
+
+class IndirectResolver:
+    """
+    Folds INDIRECT arguments against a workbook's formulas ({sheet: {(row,
+    col): formula}}) and, optionally, its snapshot values ({sheet: matrix}).
+    """
+
+    def __init__(self, formulas, values=None, constant_sheets=(), today=None):
+        self.formulas = formulas
+        self.values = values
+        self.sheet_names = set(values) if values is not None else set(formulas)
+        self.constant_sheets = set(constant_sheets)
+        self.evaluator = Evaluator(values or {}, {}, today)
+        self._constant_ranges = {}
+
+    def _check_constant(self, reference, sheet):
+        target = reference.sheet or sheet
+        key = (target,) + reference_bounds(reference)
+        reason = self._constant_ranges.get(key, False)
+        if reason is False:
+            reason = self._constant_ranges[key] = self._range_reason(*key)
+        if reason:
+            raise Unresolved(reason)
+
+    def _range_reason(self, target, first_row, last_row, first_col, last_col):
+        if target not in self.formulas and target not in self.constant_sheets:
+            return "reads a sheet whose formulas are not in the export"
+        for row, col in self.formulas.get(target, ()):
+            if first_row <= row <= last_row and first_col <= col <= last_col:
+                return "reads a formula cell"
+        if self.values is None:
+            return "reads cell values but no snapshot was given"
+        if target not in self.values:
+            return "reads a sheet missing from the snapshot"
+        return None
+
+    def resolve_call(self, call, sheet, row, col):
+        """
+        Returns the direct reference text for one INDIRECT call node, or
+        raises Unresolved.
+        """
+        if not call.args:
+            raise Unresolved("has no address argument")
+        if len(call.args) > 1:
+            style = self._fold(call.args[1], sheet, row, col)
+            if style is not None and to_bool(style) is not True:
+                raise Unresolved("uses an R1C1-style address")
+        text = to_text(self._fold(call.args[0], sheet, row, col)).strip()
+        try:
+            tokens = tokenize(text)
+        except FormulaSyntaxError:
+            tokens = []
+        if len(tokens) != 1 or tokens[0].kind != 'REFERENCE':
+            raise Unresolved("does not fold to an A1 reference")
+        reference = parse_formula(tokens[0].text)
+        target = reference.sheet or sheet
+        if target not in self.sheet_names:
+            raise Unresolved("folds to a sheet that does not exist")
+        return format_reference(reference)
+
+    def _fold(self, node, sheet, row, col):
+        for child in walk(node):
+            if isinstance(child, Function) and child.name in VOLATILE_FUNCTIONS:
+                raise Unresolved(f"address calls {child.name}")
+            if isinstance(child, (Name, TableReference)):
+                raise Unresolved("address reads a named range or table")
+            if isinstance(child, Reference):
+                self._check_constant(child, sheet)
+        unsupported = sum(self.evaluator.unsupported.values())
+        value = self.evaluator.evaluate(node, (sheet, row, col))
+        if sum(self.evaluator.unsupported.values()) != unsupported:
+            raise Unresolved("address uses a function the evaluator does not support")
+        if isinstance(value, np.ndarray):
+            raise Unresolved("address is an array")
+        if is_error(value):
+            raise Unresolved("address evaluates to an error")
+        return value
+
+    def plan_cell(self, sheet, row, col, formula, reasons):
+        """
+        Returns (proposed formula, resolved calls, unresolved calls) for one
+        formula cell, adding the reason of every unresolved call to reasons.
+        """
+        replacements = []
+        unresolved = 0
+        for start, end in indirect_calls(formula):
+            if any(start >= outer[0] and end <= outer[1] for outer in replacements):
+                continue
+            try:
+                call = parse_formula('=' + formula[start:end])
+                replacements.append((start, end, self.resolve_call(call, sheet, row, col)))
+            except (Unresolved, FormulaSyntaxError) as err:
+                reason = str(err) if isinstance(err, Unresolved) else "does not parse"
+                reasons.append(reason)
+                unresolved += 1
+        proposed = formula
+        for start, end, text in sorted(replacements, reverse=True):
+            proposed = proposed[:start] + text + proposed[end:]
+        return proposed, len(replacements), unresolved
+
+
+def still_volatile(formula):
+    """Whether a formula still calls a volatile function after its rewrite."""
+    try:
+        tree = parse_formula(formula)
+    except FormulaSyntaxError:
+        return True
+    return any(isinstance(node, Function) and node.name in VOLATILE_FUNCTIONS for node in walk(tree))
+
+
+def build_plan(records, resolver):
+    """
+    Returns (plan rows, {reason: [calls, cells, example]}) for formula
+    records from an export.
+    """
+    plan = []
+    unresolved = {}
+    for record in records:
+        formula = record['Formula']
+        if 'INDIRECT' not in formula.upper():
+            continue
+        sheet = sheet_from_export_name(record['Sheet Name'])
+        row, col = parse_cell(record['Cell'])
+        reasons = []
+        proposed, resolved, failed = resolver.plan_cell(sheet, row, col, formula, reasons)
+        for reason, calls in Counter(reasons).items():
+            entry = unresolved.setdefault(reason, [0, 0, f"{record['Sheet Name']}!{record['Cell']}"])
+            entry[0] += calls
+            entry[1] += 1
+        if resolved:
+            plan.append({
+                'Sheet Name': record['Sheet Name'],
+                'Cell': record['Cell'],
+                'Original Formula': formula,
+                'Proposed Formula': proposed,
+                'Resolved Calls': resolved,
+                'Unresolved Calls': failed,
+                'Still Volatile': still_volatile(proposed),
+            })
+    return plan, unresolved
+
+
+def write_plan(output_dir, plan, unresolved):
+    """Writes the rewrite plan and the unresolved summary, returning both paths."""
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    plan_path = os.path.join(output_dir, f"indirect_plan_{timestamp}.csv")
+    with open(plan_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=PLAN_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(plan)
+    unresolved_path = os.path.join(output_dir, f"indirect_unresolved_{timestamp}.csv")
+    with open(unresolved_path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=UNRESOLVED_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        for reason, (calls, cells, example) in sorted(unresolved.items(), key=lambda item: -item[1][0]):
+            writer.writerow({'Reason': reason, 'Calls': calls, 'Cells': cells, 'Example': example})
+    return plan_path, unresolved_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fold constant INDIRECT addresses into direct references.")
+    parser.add_argument('system', help="System name from config.json, e.g. bms")
+    parser.add_argument('formulas_csv', help="Formula export written by main.py")
+    parser.add_argument('--snapshot', help="Value snapshot directory (default: the system's newest snapshot)")
+    parser.add_argument('--constant-sheets', nargs='+', default=[],
+                        help="Sheets outside the export whose cells hold only typed-in values")
+    parser.add_argument('--today', type=datetime.date.fromisoformat,
+                        help="Date used for TODAY(), as YYYY-MM-DD (default: today)")
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as f:
+        all_configs = json.load(f)
+    if args.system not in all_configs:
+        print(f"Error: Target system '{args.system}' not found in config.json.")
+        return
+    config = all_configs[args.system]['config']
+
+    snapshot_path = args.snapshot or latest_snapshot(args.system)
+    values = Snapshot.open(snapshot_path).values() if snapshot_path else None
+    if values is None:
+        print("No snapshot found; only addresses built from literals will be folded.")
+
+    with open(args.formulas_csv, 'r', encoding='utf-8', newline='') as f:
+        records = list(csv.DictReader(f))
+    house_sheets = []
+    if config.get('houseSheetNamePattern') and values is not None:
+        pattern = re.compile(config['houseSheetNamePattern'])
+        house_sheets = [sheet for sheet in values if pattern.match(sheet)]
+    formulas = load_formulas(records, config.get('templateSheetName'), house_sheets)
+
+    resolver = IndirectResolver(formulas, values, args.constant_sheets, args.today)
+    plan, unresolved = build_plan(records, resolver)
+
+    output_dir = os.path.join('formula_exports', args.system)
+    os.makedirs(output_dir, exist_ok=True)
+    plan_path, unresolved_path = write_plan(output_dir, plan, unresolved)
+
+    resolved_calls = sum(row['Resolved Calls'] for row in plan)
+    unresolved_calls = sum(calls for calls, _, _ in unresolved.values())
+    rewritten = sum(1 for row in plan if not row['Still Volatile'])
+    print(f"Resolved {resolved_calls} of {resolved_calls + unresolved_calls} INDIRECT calls; "
+          f"{len(plan)} cells rewritten, {rewritten} no longer volatile.")
+    for reason, (calls, cells, _) in sorted(unresolved.items(), key=lambda item: -item[1][0]):
+        print(f"  {calls:>6} unresolved ({cells} cells): {reason}")
+    print(f"Rewrite plan saved to: {plan_path}")
+    print(f"Unresolved calls saved to: {unresolved_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,4 @@
+from api_metrics import ApiMetrics, print_totals
 from auth import get_authenticated_service
 from googleapiclient.errors import HttpError
 import sys
@@ -20,7 +21,8 @@ def main():
         
     spreadsheet_id = config[system_name]['spreadsheet_id']
 
-    service = get_authenticated_service("sheets", "v4")
+    metrics = ApiMetrics()
+    service = get_authenticated_service("sheets", "v4", metrics=metrics)
     
     try:
         sheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
@@ -36,6 +38,7 @@ def main():
 
     except HttpError as err:
         print(err)
+    print_totals(metrics)
 
 if __name__ == "__main__":
     main() 
\ No newline at end of file
@@ -1,63 +1,492 @@
 import datetime
 import os
-import pandas as pd
+import csv
 from googleapiclient.errors import HttpError
 import re
 import json
-import sys
+import argparse
+from collections import namedtuple
 
-from auth import get_authenticated_service
+from a1 import column_letter, parse_cell, quote_sheet_name
+from api_metrics import ApiMetrics, instrument, write_metrics
+from auth import REVISION_SCOPES, get_authenticated_service, thread_http
+from deviations import CONSENSUS_SHEET, Template, split_cells, write_reports as write_deviation_reports
+from export_store import RunRecorder
+from formula_table import FormulaTable
+from paging import DEFAULT_PAGE_CELLS, get_sheet_grids, iter_prefetched, page_rows, row_windows
+from r1c1 import GROUPED_COLUMNS, group_formulas
+from recalc_profiler import RecalcProfiler, profile_stream
+from sheet_cache import SheetCache, content_hash, get_spreadsheet_revision
+from watcher import (
+    RevisionWatcher, STATE_NAME,
+    DEFAULT_POLL_INTERVAL, DEFAULT_MAX_POLL_INTERVAL, DEFAULT_QUIET_PERIOD,
+)
+from parallel import (
+    TokenBucket, execute_with_retry, run_in_order,
+    DEFAULT_MAX_WORKERS, DEFAULT_REQUESTS_PER_MINUTE,
+)
 
 # This script no longer uses a global Gemini API key, so the import and config are removed.
 
+# Number of sheet ranges requested per values.batchGet call in batched mode.
+DEFAULT_BATCH_SIZE = 50
+
+# A sheet to extract: its real name, the name written to the export, and the
+# extraction phase it belongs to ('template', 'other' or 'house').
+SheetTarget = namedtuple('SheetTarget', ['sheet_name', 'export_name', 'phase'])
+
+CSV_COLUMNS = ['Sheet Name', 'Cell', 'Formula']
+
+
+class ExtractionError(Exception):
+    """
+    Raised from a formula stream when a sheet fails after its retries, so the
+    export being written from it is discarded instead of left with a hole.
+    """
+
+PHASE_TITLES = {
+    'template': "Template Sheet",
+    'other': "Other Specified Sheets",
+    'house': "House Sheets (Template Not Found)",
+}
+
 def get_all_sheet_names(service, spreadsheet_id):
     """Gets all sheet names from the spreadsheet."""
     try:
-        spreadsheet_metadata = service.spreadsheets().get(spreadsheetId=spreadsheet_id).execute()
+        spreadsheet_metadata = service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets.properties.title'
+        ).execute()
         sheets = spreadsheet_metadata.get('sheets', [])
         return [sheet['properties']['title'] for sheet in sheets]
     except HttpError as err:
         print(f"An error occurred while fetching sheet properties: {err}")
         return None
 
-def extract_formulas_from_sheet(service, spreadsheet_id, sheet_name):
-    """Extracts all formulas from a given sheet."""
+def find_formula_columns(values):
+    """
+    Yields (row index, column indexes) for every row of a value matrix that
+    holds formulas. Each row is scanned in a single comprehension, and rows
+    without formulas produce nothing.
+    """
+    for r_idx, row in enumerate(values):
+        columns = [c_idx for c_idx, cell_value in enumerate(row)
+                   if cell_value.__class__ is str and cell_value[:1] == '=']
+        if columns:
+            yield r_idx, columns
+
+def extract_formulas_from_values(sheet_name, values, row_offset=0):
+    """
+    Yields a formula record for every '=' cell in a sheet's value matrix.
+    row_offset is the sheet row index of the matrix's first row, for windows
+    that do not start at row 1.
+    """
+    for r_idx, columns in find_formula_columns(values):
+        row = values[r_idx]
+        row_number = str(row_offset + r_idx + 1)
+        for c_idx in columns:
+            yield {
+                'Sheet Name': sheet_name,
+                'Cell': column_letter(c_idx) + row_number,
+                'Formula': row[c_idx]
+            }
+
+def fetch_sheet_values(service, spreadsheet_id, sheet_name, http=None, limiter=None):
+    """
+    Fetches a sheet's values with formulas rendered, retrying throttled and
+    transient failures. Raises HttpError once retries are exhausted.
+    """
+    request = service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range=sheet_name,
+        valueRenderOption='FORMULA'
+    )
+    result = execute_with_retry(request, http=http, limiter=limiter)
+    return result.get('values', [])
+
+def extract_formulas_from_sheet(service, spreadsheet_id, sheet_name, export_name=None,
+                                http=None, limiter=None):
+    """
+    Yields all formulas from a given sheet, labelled with export_name (the
+    sheet name by default). Only this sheet's response is held in memory.
+    """
     print(f"Processing sheet: {sheet_name}...")
     try:
-        result = service.spreadsheets().values().get(
-            spreadsheetId=spreadsheet_id,
-            range=sheet_name,
-            valueRenderOption='FORMULA'
-        ).execute()
-        
-        values = result.get('values', [])
-        formulas = []
+        values = fetch_sheet_values(service, spreadsheet_id, sheet_name, http, limiter)
+    except HttpError as err:
+        print(f"An error occurred while extracting formulas from {sheet_name}: {err}")
+        return
+    if not values:
+        print(f"No data found in sheet: {sheet_name}")
+        return
+
+    count = 0
+    for formula in extract_formulas_from_values(export_name or sheet_name, values):
+        count += 1
+        yield formula
+    print(f"Found {count} formulas in {sheet_name}.")
+
+def iter_batch_sheet_values(service, spreadsheet_id, sheet_names, batch_size=DEFAULT_BATCH_SIZE,
+                            value_render_option='FORMULA'):
+    """
+    Fetches the values of many sheets (formulas by default) with chunked
+    values.batchGet calls and yields (sheet name, value matrix) pairs one chunk
+    at a time. Ranges are sent as 'Sheet' so names that look like cells (e.g.
+    SG1) address the whole sheet. Every call is retried like a single-sheet
+    fetch; the sheets of a chunk that still fails are reported and left out,
+    so callers compare what they got against what they asked for.
+    """
+    for start in range(0, len(sheet_names), batch_size):
+        chunk = sheet_names[start:start + batch_size]
+        print(f"Fetching {len(chunk)} sheets in one batch: {', '.join(chunk)}")
+        try:
+            result = execute_with_retry(service.spreadsheets().values().batchGet(
+                spreadsheetId=spreadsheet_id,
+                ranges=[quote_sheet_name(name) for name in chunk],
+                valueRenderOption=value_render_option
+            ))
+        except HttpError as err:
+            print(f"An error occurred while fetching batch starting at {chunk[0]}: {err}")
+            continue
+        # valueRanges come back in the same order as the requested ranges.
+        for sheet_name, value_range in zip(chunk, result.get('valueRanges', [])):
+            yield sheet_name, value_range.get('values', [])
+
+def batch_get_sheet_values(service, spreadsheet_id, sheet_names, batch_size=DEFAULT_BATCH_SIZE,
+                           value_render_option='FORMULA'):
+    """Returns a dict mapping each fetched sheet name to its value matrix."""
+    return dict(iter_batch_sheet_values(
+        service, spreadsheet_id, sheet_names, batch_size, value_render_option
+    ))
+
+def extract_formulas_batched(service, spreadsheet_id, targets, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Yields formulas for a list of SheetTargets using batched fetches, holding
+    one batch of responses in memory at a time. A batch that fails after its
+    retries raises ExtractionError, so the export being written is discarded.
+    """
+    export_names = {target.sheet_name: target.export_name for target in targets}
+    pending = iter(targets)
+    sheet_values = iter_batch_sheet_values(
+        service, spreadsheet_id, [target.sheet_name for target in targets], batch_size
+    )
+    for sheet_name, values in sheet_values:
+        # Sheets arrive in target order, so a skipped target is a failed batch.
+        expected = next(pending).sheet_name
+        if sheet_name != expected:
+            raise ExtractionError(f"Failed to extract sheets from {expected} on.")
         if not values:
             print(f"No data found in sheet: {sheet_name}")
-            return []
-
-        for r_idx, row in enumerate(values):
-            for c_idx, cell_value in enumerate(row):
-                if isinstance(cell_value, str) and cell_value.startswith('='):
-                    temp_c_idx = c_idx
-                    col_str = ""
-                    while temp_c_idx >= 0:
-                        col_str = chr(temp_c_idx % 26 + ord('A')) + col_str
-                        temp_c_idx = temp_c_idx // 26 - 1
-                    a1_notation = f"{col_str}{r_idx + 1}"
-                    formulas.append({
-                        'Sheet Name': sheet_name,
-                        'Cell': a1_notation,
-                        'Formula': cell_value
-                    })
-        print(f"Found {len(formulas)} formulas in {sheet_name}.")
+            continue
+        count = 0
+        for formula in extract_formulas_from_values(export_names[sheet_name], values):
+            count += 1
+            yield formula
+        print(f"Found {count} formulas in {sheet_name}.")
+    missing = [target.sheet_name for target in pending]
+    if missing:
+        raise ExtractionError(f"Failed to extract {len(missing)} sheets: {', '.join(missing)}")
+
+def extract_formulas_sequential(service, spreadsheet_id, targets):
+    """Yields formulas for a list of SheetTargets with one request per sheet."""
+    current_phase = None
+    for target in targets:
+        if target.phase != current_phase:
+            current_phase = target.phase
+            print(f"\n--- Processing {PHASE_TITLES[current_phase]} ---")
+        yield from extract_formulas_from_sheet(
+            service, spreadsheet_id, target.sheet_name, target.export_name
+        )
+
+def extract_formulas_concurrent(service, spreadsheet_id, targets, http_factory,
+                                max_workers=DEFAULT_MAX_WORKERS, limiter=None):
+    """
+    Extracts formulas for a list of SheetTargets on a bounded worker pool.
+    Results keep the order of `targets`. Returns (FormulaTable, failed sheet
+    names); a sheet only fails once its retries are exhausted.
+    """
+    def worker(target, http):
+        print(f"Processing sheet: {target.sheet_name}...")
+        values = fetch_sheet_values(service, spreadsheet_id, target.sheet_name, http, limiter)
+        formulas = FormulaTable.from_records(extract_formulas_from_values(target.export_name, values))
+        print(f"Found {len(formulas)} formulas in {target.sheet_name}.")
         return formulas
-    except HttpError as err:
-        print(f"An error occurred while extracting formulas from {sheet_name}: {err}")
+
+    results = run_in_order(targets, worker, http_factory, max_workers)
+    all_formulas = FormulaTable()
+    failed = []
+    for target, result in zip(targets, results):
+        if isinstance(result, Exception):
+            print(f"An error occurred while extracting formulas from {target.sheet_name}: {result}")
+            failed.append(target.sheet_name)
+        else:
+            all_formulas.extend(result)
+    return all_formulas, failed
+
+def extract_formulas_paged(service, spreadsheet_id, targets, http_factory,
+                           page_cells=DEFAULT_PAGE_CELLS, limiter=None):
+    """
+    Streams formulas for a list of SheetTargets, fetching each sheet in row
+    windows sized from its grid properties. Every window is scanned as soon
+    as it arrives while the next one is fetched on a background thread, so
+    at most two windows are held in memory however large a sheet grows.
+    Returns None when a target's grid size is unknown; a window that fails
+    after its retries raises ExtractionError from the stream.
+    """
+    grids = get_sheet_grids(service, spreadsheet_id)
+    if grids is None:
+        return None
+    missing = [target.sheet_name for target in targets if target.sheet_name not in grids]
+    if missing:
+        print(f"No grid size for {len(missing)} sheets: {', '.join(missing)}")
+        return None
+    jobs = []
+    for target in targets:
+        row_count, column_count = grids[target.sheet_name]
+        windows = row_windows(target.sheet_name, row_count, column_count, page_cells)
+        jobs.extend((target, index, len(windows), first, a1_range)
+                    for index, (first, a1_range) in enumerate(windows))
+
+    def fetch(job):
+        # The prefetch thread needs its own transport; httplib2 is not thread-safe.
+        return fetch_sheet_values(service, spreadsheet_id, job[4], http_factory(), limiter)
+
+    def stream():
+        count = 0
+        for (target, index, window_count, first, a1_range), values in iter_prefetched(jobs, fetch):
+            if index == 0:
+                count = 0
+                row_count, column_count = grids[target.sheet_name]
+                print(f"Processing sheet: {target.sheet_name} "
+                      f"({row_count} rows, {page_rows(column_count, page_cells)} per window)...")
+            if isinstance(values, HttpError):
+                raise ExtractionError(f"An error occurred while extracting formulas from {a1_range}: {values}")
+            for formula in extract_formulas_from_values(target.export_name, values, first):
+                count += 1
+                yield formula
+            if index == window_count - 1:
+                print(f"Found {count} formulas in {target.sheet_name}.")
+
+    return stream()
+
+def extract_formulas_incremental(service, drive_service, spreadsheet_id, config, cache,
+                                 batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Extracts formulas using the local per-sheet cache. When the spreadsheet's
+    Drive revision matches the cached one, the cached formulas are returned
+    without touching the Sheets API. Drive only versions the spreadsheet as a
+    whole, so otherwise every target sheet is fetched in batches and hashed
+    as its batch arrives; only sheets whose content hash changed are
+    rescanned, the others are served from the cache.
+    """
+    revision = get_spreadsheet_revision(drive_service, spreadsheet_id)
+    sheet_cells = {}
+    if cache.is_current(revision):
+        print(f"Spreadsheet unchanged since the last run (version {revision['version']}), using cached formulas.")
+        targets = [SheetTarget(*target) for target in cache.targets]
+        for target in targets:
+            sheet_cells[target.sheet_name] = cache.get_formulas(target.sheet_name)
+    else:
+        sheet_names = get_all_sheet_names(service, spreadsheet_id)
+        if not sheet_names:
+            print("Could not retrieve sheet names.")
+            return None
+        targets = resolve_target_sheets(config, sheet_names)
+        print(f"\n--- Checking {len(targets)} Sheets for Changes ---")
+        sheet_values = iter_batch_sheet_values(
+            service, spreadsheet_id, [target.sheet_name for target in targets], batch_size
+        )
+        changed = 0
+        for sheet_name, values in sheet_values:
+            sheet_hash = content_hash(values)
+            cells = cache.get_formulas(sheet_name, sheet_hash)
+            if cells is None:
+                cells = [[f['Cell'], f['Formula']] for f in extract_formulas_from_values(sheet_name, values)]
+                cache.put_formulas(sheet_name, sheet_hash, cells)
+                changed += 1
+                print(f"Changed: {sheet_name} ({len(cells)} formulas).")
+            else:
+                print(f"Unchanged: {sheet_name} ({len(cells)} formulas).")
+            sheet_cells[sheet_name] = cells
+        # A sheet that failed to download would be served stale from the
+        # cache, so the run stops and the cached revision is left as it was.
+        missing = [target.sheet_name for target in targets if target.sheet_name not in sheet_cells]
+        if missing:
+            print(f"Could not fetch {len(missing)} sheets: {', '.join(missing)}")
+            return None
+        print(f"{changed} of {len(targets)} sheets changed.")
+
+    all_formulas = FormulaTable()
+    for target in targets:
+        for cell, formula in sheet_cells[target.sheet_name]:
+            all_formulas.append(target.export_name, *parse_cell(cell), formula)
+
+    cache.save(revision, targets)
+    return all_formulas
+
+def extract_formulas_with_deviations(service, spreadsheet_id, config, sheet_names,
+                                     batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Extracts the template and the other named sheets in full and compares
+    every house sheet to the template in relative form instead of exporting
+    it. Returns (formulas of the exported sheets, deviation records,
+    conformance summaries), or None when a batch failed after its retries.
+    Without a template sheet in the workbook, the houses' per-cell consensus
+    is the template, so every house is fetched before any is compared; the
+    consensus is exported as the CONSENSUS_SHEET sheet in its place.
+    """
+    targets = [target for target in resolve_target_sheets(config, sheet_names) if target.phase != 'house']
+    houses = [target.sheet_name for target in match_house_sheets(config, sheet_names)]
+    export_names = {target.sheet_name: target.export_name for target in targets}
+    template_name = next((target.sheet_name for target in targets if target.phase == 'template'), None)
+
+    print(f"\n--- Processing {len(targets)} Template and Other Sheets ---")
+    formulas = FormulaTable()
+    template = None
+    fetched = set()
+    for sheet_name, values in iter_batch_sheet_values(service, spreadsheet_id, list(export_names), batch_size):
+        fetched.add(sheet_name)
+        formulas.extend(extract_formulas_from_values(export_names[sheet_name], values))
+        if sheet_name == template_name:
+            template = Template(split_cells(values)[0])
+
+    print(f"\n--- Comparing {len(houses)} House Sheets to the Template ---")
+    house_cells = (
+        (sheet_name, split_cells(values))
+        for sheet_name, values in iter_batch_sheet_values(service, spreadsheet_id, houses, batch_size)
+    )
+    if template is None:
+        print("Template sheet not found; using the formulas most houses share as the template.")
+        house_cells = list(house_cells)
+        template = Template.consensus([cells for _, (cells, _) in house_cells])
+        for row_idx, col_idx, formula in template.cells():
+            formulas.append(CONSENSUS_SHEET, row_idx, col_idx, formula)
+    deviations, summaries = [], []
+    for sheet_name, (cells, contents) in house_cells:
+        fetched.add(sheet_name)
+        records, summary = template.compare(sheet_name, cells, contents)
+        deviations.extend(records)
+        summaries.append(summary)
+        print(f"{sheet_name}: {summary['Conformance %']}% conforming, {len(records)} deviating cells.")
+    failed = [name for name in list(export_names) + houses if name not in fetched]
+    if failed:
+        print(f"Failed to extract {len(failed)} sheets: {', '.join(failed)}")
+        return None
+    return formulas, deviations, summaries
+
+def resolve_target_sheets(config, sheet_names):
+    """
+    Returns the ordered SheetTargets to extract for a system: the template first,
+    then the explicitly named sheets, then the house sheets when no template is
+    available.
+    """
+    targets = []
+    template_name = config.get('templateSheetName')
+    other_sheets = config.get('otherSheetsToProcess', [])
+    template_handled = False
+
+    # 1) The template sheet first
+    if template_name and template_name in sheet_names:
+        targets.append(SheetTarget(template_name, f"{template_name} (TEMPLATE)", 'template'))
+        template_handled = True
+
+    # 2) The explicitly named sheets
+    for sheet_name in other_sheets:
+        if sheet_name == template_name:
+            continue
+        if sheet_name in sheet_names:
+            targets.append(SheetTarget(sheet_name, sheet_name, 'other'))
+        else:
+            print(f"Warning: Specified sheet '{sheet_name}' not found.")
+
+    # 3) House sheets if template was NOT handled
+    if not template_handled:
+        targets.extend(match_house_sheets(config, sheet_names))
+
+    return targets
+
+def match_house_sheets(config, sheet_names):
+    """Returns a 'house' SheetTarget for every sheet matching houseSheetNamePattern."""
+    if not config.get('houseSheetNamePattern'):
         return []
+    house_sheet_pattern = re.compile(config['houseSheetNamePattern'])
+    template_name = config.get('templateSheetName')
+    other_sheets = config.get('otherSheetsToProcess', [])
+    return [
+        SheetTarget(sheet_name, sheet_name, 'house') for sheet_name in sheet_names
+        if house_sheet_pattern.match(sheet_name) and
+        sheet_name != template_name and
+        sheet_name not in other_sheets
+    ]
+
+def extract_formulas(service, spreadsheet_id, targets, batch_size=None, workers=None,
+                     requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, page_cells=None):
+    """
+    Returns an iterable of formulas for a list of SheetTargets in the selected
+    fetch mode. Returns None when concurrent mode could not fetch every sheet.
+    """
+    if page_cells:
+        print(f"\n--- Processing {len(targets)} Sheets in Row Windows of {page_cells:,} Cells ---")
+        return extract_formulas_paged(
+            service, spreadsheet_id, targets, thread_http, page_cells, TokenBucket(requests_per_minute)
+        )
+    if batch_size:
+        print(f"\n--- Processing {len(targets)} Sheets in Batches of {batch_size} ---")
+        return extract_formulas_batched(service, spreadsheet_id, targets, batch_size)
+    if workers:
+        print(f"\n--- Processing {len(targets)} Sheets with {workers} Workers ---")
+        limiter = TokenBucket(requests_per_minute)
+        all_formulas, failed = extract_formulas_concurrent(
+            service, spreadsheet_id, targets, thread_http, workers, limiter
+        )
+        if failed:
+            print(f"Failed to extract {len(failed)} sheets: {', '.join(failed)}")
+            return None
+        return all_formulas
+    return extract_formulas_sequential(service, spreadsheet_id, targets)
 
-def main(target_system):
-    """Main function to run the formula extraction process for a specific system."""
+def write_formulas_csv(filename, formulas, fieldnames=CSV_COLUMNS):
+    """
+    Streams formula records into a CSV file and returns how many were written.
+    Rows go through a .part file that is only renamed into place once complete,
+    and removed when there was nothing to write.
+    """
+    temp_filename = f"{filename}.part"
+    count = 0
+    try:
+        with open(temp_filename, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=fieldnames, lineterminator='\n')
+            writer.writeheader()
+            for formula in formulas:
+                writer.writerow(formula)
+                count += 1
+    except BaseException:
+        os.remove(temp_filename)
+        raise
+    if count:
+        os.replace(temp_filename, filename)
+    else:
+        os.remove(temp_filename)
+    return count
+
+def main(target_system, batch_size=None, workers=None,
+         requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, incremental=False, grouped=False,
+         profile=False, trace=False, page_cells=None, store=False, deviations=False):
+    """
+    Main function to run the formula extraction process for a specific system.
+    With a batch_size, sheets are fetched through values.batchGet in chunks of
+    that many ranges instead of one request per sheet. With workers, sheets are
+    fetched concurrently, limited to requests_per_minute. With page_cells,
+    every sheet is streamed in row windows of about that many cells. With
+    incremental, unchanged sheets are served from the local formula cache.
+    With grouped, the export holds one R1C1 record per block of copied
+    formulas. With profile, a ranked recalculation-cost hotspot report is
+    written as well. With store, the run is added to the export store. With
+    deviations, house sheets are not exported in full: only their cells that
+    differ from the template are reported, with a conformance summary.
+    Every API call is measured into a metrics file; with trace, a Chrome
+    trace of the calls is written too.
+    """
     
     # Load configuration
     with open('config.json', 'r') as f:
@@ -74,69 +503,324 @@ def main(target_system):
     print(f"--- Running extractor for system: {target_system} ---")
     print(f"Spreadsheet ID: {spreadsheet_id}")
     
-    service = get_authenticated_service("sheets", "v4")
-    sheet_names = get_all_sheet_names(service, spreadsheet_id)
-    if not sheet_names:
-        print("Could not retrieve sheet names. Exiting.")
-        return
-
-    all_formulas = []
-    template_handled = False
-    
-    if config.get('houseSheetNamePattern'):
-        house_sheet_pattern = re.compile(config['houseSheetNamePattern'])
+    metrics = ApiMetrics()
+    service = get_authenticated_service("sheets", "v4", metrics=metrics)
+    if incremental:
+        drive_service = get_authenticated_service("drive", "v3", REVISION_SCOPES, metrics)
+        cache = SheetCache(target_system, spreadsheet_id, config)
+        all_formulas = extract_formulas_incremental(
+            service, drive_service, spreadsheet_id, config, cache, batch_size or DEFAULT_BATCH_SIZE
+        )
+        metrics.set_phases(cache.targets)
+        if all_formulas is None:
+            print("Export not written to avoid an incomplete file. Exiting.")
+            return
     else:
-        house_sheet_pattern = None
-
-    # 1) Process the template sheet first
-    if config.get('templateSheetName') and config['templateSheetName'] in sheet_names:
-        print("\n--- Processing Template Sheet ---")
-        formulas = extract_formulas_from_sheet(service, spreadsheet_id, config['templateSheetName'])
-        for f in formulas:
-            f['Sheet Name'] = f"{f['Sheet Name']} (TEMPLATE)"
-        all_formulas.extend(formulas)
-        template_handled = True
-
-    # 2) Process the explicitly named sheets
-    print("\n--- Processing Other Specified Sheets ---")
-    for sheet_name in config.get('otherSheetsToProcess', []):
-        if sheet_name == config.get('templateSheetName'):
-            continue
-        if sheet_name in sheet_names:
-            formulas = extract_formulas_from_sheet(service, spreadsheet_id, sheet_name)
-            all_formulas.extend(formulas)
+        sheet_names = get_all_sheet_names(service, spreadsheet_id)
+        if not sheet_names:
+            print("Could not retrieve sheet names. Exiting.")
+            return
+        targets = resolve_target_sheets(config, sheet_names)
+        if deviations:
+            metrics.set_phases(targets + match_house_sheets(config, sheet_names))
+            result = extract_formulas_with_deviations(
+                service, spreadsheet_id, config, sheet_names, batch_size or DEFAULT_BATCH_SIZE
+            )
+            all_formulas = None
+            if result is not None:
+                all_formulas, deviation_records, summaries = result
+                write_deviations(target_system, deviation_records, summaries)
         else:
-            print(f"Warning: Specified sheet '{sheet_name}' not found.")
+            metrics.set_phases(targets)
+            all_formulas = extract_formulas(
+                service, spreadsheet_id, targets, batch_size, workers, requests_per_minute, page_cells
+            )
+        if all_formulas is None:
+            print("Export not written to avoid an incomplete file. Exiting.")
+            return
 
-    # 3) Process house sheets if template was NOT handled
-    if not template_handled and house_sheet_pattern:
-        print("\n--- Processing House Sheets (Template Not Found) ---")
-        for sheet_name in sheet_names:
-            if house_sheet_pattern.match(sheet_name) and \
-               sheet_name != config.get('templateSheetName') and \
-               sheet_name not in config.get('otherSheetsToProcess', []):
-                formulas = extract_formulas_from_sheet(service, spreadsheet_id, sheet_name)
-                all_formulas.extend(formulas)
-
-    if not all_formulas:
-        print("No formulas were extracted. Exiting.")
-        return
+    try:
+        return write_exports(target_system, all_formulas, grouped, profile, metrics, trace, store)
+    except ExtractionError as err:
+        print(err)
+        print("Export not written to avoid an incomplete file. Exiting.")
+        return None
 
-    df = pd.DataFrame(all_formulas)
-    
+def write_deviations(target_system, deviation_records, summaries):
+    """Writes the house deviation and conformance reports into formula_exports/<target_system>."""
     output_dir = os.path.join('formula_exports', target_system)
     os.makedirs(output_dir, exist_ok=True)
-    
     timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-    filename = os.path.join(output_dir, f"formulas_{timestamp}.csv")
+    conforming = sum(1 for summary in summaries if summary['Conformance %'] == 100.0 and
+                     not summary['Extra'])
+    print(f"\n{conforming} of {len(summaries)} house sheets match the template; "
+          f"{len(deviation_records)} deviating cells in total.")
+    for path in write_deviation_reports(os.path.join(output_dir, f"houses_{timestamp}"),
+                                        deviation_records, summaries):
+        print(f"Report saved to: {path}")
+
+def write_exports(target_system, all_formulas, grouped=False, profile=False, metrics=None, trace=False,
+                  store=False):
+    """
+    Writes a system's formula export (and, with profile, its hotspot report)
+    into formula_exports/<target_system>. With metrics, the API call metrics
+    of the run are written next to it, plus a Chrome trace with trace. With
+    store, the run is also added to the deduplicated export store.
+    Returns the export's filename, or None when nothing was written.
+    """
+    output_dir = os.path.join('formula_exports', target_system)
+    os.makedirs(output_dir, exist_ok=True)
     
-    df.to_csv(filename, index=False, encoding='utf-8')
-    print(f"\nSuccessfully extracted {len(df)} formulas for {target_system}.")
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    recorder = None
+    if store:
+        recorder = RunRecorder(target_system, f"formulas_{timestamp}{'_grouped' if grouped else ''}.csv")
+        all_formulas = recorder.stream(all_formulas)
+    profiler = RecalcProfiler() if profile else None
+    if profiler:
+        all_formulas = profile_stream(all_formulas, profiler)
+    if grouped:
+        filename = os.path.join(output_dir, f"formulas_{timestamp}_grouped.csv")
+        formula_count = 0
+
+        def counted(formulas):
+            nonlocal formula_count
+            for formula in formulas:
+                formula_count += 1
+                yield formula
+
+        count = write_formulas_csv(filename, group_formulas(counted(all_formulas)), GROUPED_COLUMNS)
+    else:
+        filename = os.path.join(output_dir, f"formulas_{timestamp}.csv")
+        count = formula_count = write_formulas_csv(filename, all_formulas)
+    if metrics:
+        write_metrics(metrics, output_dir, timestamp, trace)
+    if not count:
+        print(f"No formulas were extracted for {target_system}.")
+        return None
+    print(f"\nSuccessfully extracted {formula_count} formulas for {target_system}.")
+    if grouped:
+        print(f"Grouped into {count} records by relative (R1C1) formula.")
     print(f"Data saved to: {filename}")
+    if recorder:
+        print(f"Run stored as: {recorder.commit(timestamp)}")
+    if profiler:
+        print("\n--- Recalculation Hotspots ---")
+        for row in profiler.sheet_report():
+            print(f"{row['Rank']}. {row['Sheet']}: {row['Share %']}% of estimated cost "
+                  f"({row['Formula Cells']} formulas, {row['Volatile Cells']} volatile)")
+        for path in profiler.write_reports(os.path.join(output_dir, f"hotspots_{timestamp}")):
+            print(f"Report saved to: {path}")
+    return filename
+
+def fan_out_targets(system_targets):
+    """
+    Merges the SheetTargets of several systems reading one spreadsheet.
+    Returns the unique targets to fetch, in first-seen order, keyed by sheet
+    name. Each sheet is fetched once even when several systems export it.
+    """
+    unique = {}
+    for targets in system_targets.values():
+        for target in targets:
+            unique.setdefault(target.sheet_name, target)
+    return list(unique.values())
+
+def main_all(target_systems, batch_size=None, workers=None,
+             requests_per_minute=DEFAULT_REQUESTS_PER_MINUTE, grouped=False, profile=False, trace=False,
+             page_cells=None, store=False):
+    """
+    Runs the extractor for several systems at once. Systems are grouped by
+    spreadsheet, every unique (spreadsheet, sheet) pair is fetched once over
+    one shared service, and the formulas are written to each system's own
+    formula_exports directory under that system's export names. The API
+    metrics of a spreadsheet are written once, into
+    formula_exports/<system>+<system> for the systems sharing it.
+    """
+    with open('config.json', 'r') as f:
+        all_configs = json.load(f)
+
+    unknown = [system for system in target_systems if system not in all_configs]
+    if unknown:
+        print(f"Error: Target systems {unknown} not found in config.json.")
+        print(f"Available systems: {list(all_configs.keys())}")
+        return
+
+    systems_by_spreadsheet = {}
+    for system in target_systems:
+        systems_by_spreadsheet.setdefault(all_configs[system]['spreadsheet_id'], []).append(system)
+
+    shared_service = get_authenticated_service("sheets", "v4")
+    for spreadsheet_id, systems in systems_by_spreadsheet.items():
+        metrics = ApiMetrics()
+        service = instrument(shared_service, metrics)
+        print(f"--- Running extractor for systems: {', '.join(systems)} ---")
+        print(f"Spreadsheet ID: {spreadsheet_id}")
+        sheet_names = get_all_sheet_names(service, spreadsheet_id)
+        if not sheet_names:
+            print("Could not retrieve sheet names. Skipping.")
+            continue
+
+        system_targets = {
+            system: resolve_target_sheets(all_configs[system]['config'], sheet_names) for system in systems
+        }
+        unique_targets = fan_out_targets(system_targets)
+        metrics.set_phases(unique_targets)
+        total = sum(len(targets) for targets in system_targets.values())
+        print(f"Fetching {len(unique_targets)} unique sheets for {total} system sheets.")
+        all_formulas = extract_formulas(
+            service, spreadsheet_id, unique_targets, batch_size, workers, requests_per_minute, page_cells
+        )
+        if all_formulas is None:
+            print(f"Exports for {', '.join(systems)} not written to avoid incomplete files.")
+            continue
+
+        # Held once in compact form and sliced per sheet for every system.
+        if not isinstance(all_formulas, FormulaTable):
+            try:
+                all_formulas = FormulaTable.from_records(all_formulas)
+            except ExtractionError as err:
+                print(err)
+                print(f"Exports for {', '.join(systems)} not written to avoid incomplete files.")
+                continue
+        fetched_names = {target.sheet_name: target.export_name for target in unique_targets}
+
+        for system in systems:
+            print(f"\n--- Writing export for system: {system} ---")
+            write_exports(system, (
+                formula
+                for target in system_targets[system]
+                for formula in all_formulas.sheet_records(fetched_names[target.sheet_name], target.export_name)
+            ), grouped, profile, store=store)
+
+        # The calls were shared by every system, so they are reported once
+        # under the names of all of them.
+        output_dir = os.path.join('formula_exports', '+'.join(systems))
+        os.makedirs(output_dir, exist_ok=True)
+        write_metrics(metrics, output_dir, datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"), trace)
+
+def watch(target_system, interval=DEFAULT_POLL_INTERVAL, max_interval=DEFAULT_MAX_POLL_INTERVAL,
+          quiet_period=DEFAULT_QUIET_PERIOD, **options):
+    """
+    Keeps exporting a system whenever its spreadsheet changes. The Drive
+    revision is polled with the warm, cached client; bursts of edits are
+    coalesced into one export once the revision has been quiet for
+    quiet_period seconds. Runs until interrupted.
+    """
+    with open('config.json', 'r') as f:
+        all_configs = json.load(f)
+    if target_system not in all_configs:
+        print(f"Error: Target system '{target_system}' not found in config.json.")
+        print(f"Available systems: {list(all_configs.keys())}")
+        return
+    spreadsheet_id = all_configs[target_system]['spreadsheet_id']
+
+    def poll():
+        # get_authenticated_service hands back the cached client and refreshes
+        # the credentials ahead of expiry, so every cycle starts warm.
+        return get_spreadsheet_revision(get_authenticated_service("drive", "v3", REVISION_SCOPES), spreadsheet_id)
+
+    watcher = RevisionWatcher(
+        poll, lambda: main(target_system, **options),
+        os.path.join('formula_exports', target_system, STATE_NAME),
+        interval, max_interval, quiet_period,
+    )
+    print(f"--- Watching {target_system} for changes (every {interval:g}-{watcher.max_interval:g}s, "
+          f"quiet period {quiet_period:g}s; Ctrl+C to stop) ---")
+    try:
+        watcher.run()
+    except KeyboardInterrupt:
+        print(f"\nStopped watching after {watcher.runs} exports.")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Export every formula of a configured spreadsheet system to CSV.",
+        epilog="Example: python3 main.py bms --batch",
+    )
+    parser.add_argument('systems', nargs='*', metavar='system',
+                        help="System name(s) from config.json, e.g. bms")
+    parser.add_argument('--all', action='store_true',
+                        help="Export every system in config.json, fetching shared spreadsheets once")
+    parser.add_argument('--batch', action='store_true',
+                        help="Fetch sheets with chunked values.batchGet requests")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"Ranges per batchGet request (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument('--workers', type=int, nargs='?', const=DEFAULT_MAX_WORKERS,
+                        help=f"Fetch sheets concurrently on this many threads (default: {DEFAULT_MAX_WORKERS})")
+    parser.add_argument('--paged', action='store_true',
+                        help="Stream each sheet in row windows, prefetching the next window while scanning")
+    parser.add_argument('--page-cells', type=int, default=DEFAULT_PAGE_CELLS,
+                        help=f"Cells per row window in paged mode (default: {DEFAULT_PAGE_CELLS})")
+    parser.add_argument('--rate-limit', type=int, default=DEFAULT_REQUESTS_PER_MINUTE,
+                        help=f"Maximum API requests per minute in concurrent and paged modes (default: {DEFAULT_REQUESTS_PER_MINUTE})")
+    parser.add_argument('--incremental', action='store_true',
+                        help="Reuse cached formulas for sheets that have not changed since the last run")
+    parser.add_argument('--grouped', action='store_true',
+                        help="Write one R1C1 record per block of copied formulas (expand with r1c1.py)")
+    parser.add_argument('--profile', action='store_true',
+                        help="Also write a ranked recalculation-cost hotspot report (CSV and JSON)")
+    parser.add_argument('--trace', action='store_true',
+                        help="Also write a Chrome trace of the API calls (open in chrome://tracing or Perfetto)")
+    parser.add_argument('--deviations', action='store_true',
+                        help="Report only the house sheet cells that differ from the template, per house")
+    parser.add_argument('--store', action='store_true',
+                        help="Also add the run to the deduplicated export store (query it with export_store.py)")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep running and export whenever the spreadsheet's Drive revision changes")
+    parser.add_argument('--interval', type=float, default=DEFAULT_POLL_INTERVAL,
+                        help=f"Seconds between revision checks in watch mode (default: {DEFAULT_POLL_INTERVAL:.0f})")
+    parser.add_argument('--max-interval', type=float, default=DEFAULT_MAX_POLL_INTERVAL,
+                        help=f"Longest idle or error backoff between checks (default: {DEFAULT_MAX_POLL_INTERVAL:.0f})")
+    parser.add_argument('--quiet-period', type=float, default=DEFAULT_QUIET_PERIOD,
+                        help=f"Seconds without edits before a change is exported (default: {DEFAULT_QUIET_PERIOD:.0f})")
+    args = parser.parse_args(argv)
+    if args.all == bool(args.systems):
+        parser.error("name one or more systems, or use --all")
+    if args.batch_size < 1:
+        parser.error("--batch-size must be at least 1")
+    if args.workers is not None and args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.rate_limit < 1:
+        parser.error("--rate-limit must be at least 1")
+    if args.batch and args.workers:
+        parser.error("--batch and --workers cannot be combined")
+    if args.page_cells < 1:
+        parser.error("--page-cells must be at least 1")
+    if args.deviations and (args.workers or args.paged or args.incremental):
+        parser.error("--deviations fetches sheets in batches and cannot be combined with "
+                     "--workers, --paged or --incremental")
+    if args.deviations and (args.all or len(args.systems) > 1):
+        parser.error("--deviations runs a single system at a time")
+    if args.paged and (args.batch or args.workers or args.incremental):
+        parser.error("--paged cannot be combined with --batch, --workers or --incremental")
+    if args.incremental and args.workers:
+        parser.error("--incremental fetches changed sheets in batches and cannot be combined with --workers")
+    if args.interval <= 0 or args.max_interval <= 0 or args.quiet_period < 0:
+        parser.error("--interval and --max-interval must be positive and --quiet-period not negative")
+    if args.watch and (args.all or len(args.systems) > 1):
+        parser.error("--watch follows a single system")
+    if args.incremental and (args.all or len(args.systems) > 1):
+        parser.error("--incremental keeps one cache per system and runs a single system at a time")
+    return args
 
 if __name__ == "__main__":
-    if len(sys.argv) < 2:
-        print("Usage: python3 main.py <system_name>")
-        print("Example: python3 main.py bms")
+    args = parse_args()
+    options = dict(
+        batch_size=args.batch_size if args.batch else None,
+        workers=args.workers,
+        requests_per_minute=args.rate_limit,
+        grouped=args.grouped,
+        profile=args.profile,
+        trace=args.trace,
+        page_cells=args.page_cells if args.paged else None,
+        store=args.store,
+    )
+    if args.watch:
+        watch(args.systems[0], args.interval, args.max_interval, args.quiet_period,
+              incremental=args.incremental, deviations=args.deviations, **options)
+    elif args.all or len(args.systems) > 1:
+        if args.all:
+            with open('config.json', 'r') as f:
+                args.systems = list(json.load(f))
+        main_all(args.systems, **options)
     else:
-        main(sys.argv[1]) 
\ No newline at end of file
+        main(args.systems[0], incremental=args.incremental, deviations=args.deviations, **options)
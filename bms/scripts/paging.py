@@ -0,0 +1,73 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+from a1 import column_letter, quote_sheet_name
+
+# Cells requested per values.get in paged mode. A window spans the sheet's
+# full column width, so its height is DEFAULT_PAGE_CELLS / columnCount rows.
+DEFAULT_PAGE_CELLS = 100_000
+MIN_PAGE_ROWS = 50
+
+
+def get_sheet_grids(service, spreadsheet_id):
+    """
+    Returns {sheet name: (rowCount, columnCount)} from the sheets' grid
+    properties, or None when the metadata cannot be fetched.
+    """
+    try:
+        spreadsheet_metadata = service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id,
+            fields='sheets.properties(title,gridProperties(rowCount,columnCount))'
+        ).execute()
+    except HttpError as err:
+        print(f"An error occurred while fetching sheet grid sizes: {err}")
+        return None
+    grids = {}
+    for sheet in spreadsheet_metadata.get('sheets', []):
+        grid = sheet['properties'].get('gridProperties', {})
+        grids[sheet['properties']['title']] = (grid.get('rowCount', 1), grid.get('columnCount', 1))
+    return grids
+
+
+def page_rows(column_count, page_cells=DEFAULT_PAGE_CELLS):
+    """Returns how many rows of a sheet this wide fit in one window."""
+    return max(MIN_PAGE_ROWS, page_cells // max(column_count, 1))
+
+
+def row_windows(sheet_name, row_count, column_count, page_cells=DEFAULT_PAGE_CELLS):
+    """
+    Splits a sheet into row windows and returns them as (first row index,
+    A1 range) pairs, e.g. (1000, "'House 1'!A1001:AX2000"). Every window
+    spans all columns of the grid.
+    """
+    height = page_rows(column_count, page_cells)
+    last_column = column_letter(max(column_count, 1) - 1)
+    sheet = quote_sheet_name(sheet_name)
+    return [
+        (first, f"{sheet}!A{first + 1}:{last_column}{min(first + height, row_count)}")
+        for first in range(0, max(row_count, 1), height)
+    ]
+
+
+def iter_prefetched(jobs, fetch):
+    """
+    Yields (job, result or exception) for every job in order, running
+    fetch(job) for the next job on a background thread while the caller
+    processes the current one. At most two results are held at a time.
+    """
+    def attempt(job):
+        try:
+            return fetch(job)
+        except HttpError as err:
+            return err
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for job in jobs:
+            future = executor.submit(attempt, job)
+            if pending is not None:
+                yield pending[0], pending[1].result()
+            pending = job, future
+        if pending is not None:
+            yield pending[0], pending[1].result()
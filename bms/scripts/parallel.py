@@ -0,0 +1,99 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from googleapiclient.errors import HttpError
+
+# Sheets API read quota per user per project is 60 requests per minute.
+DEFAULT_REQUESTS_PER_MINUTE = 60
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BASE_DELAY = 1.0
+DEFAULT_MAX_DELAY = 64.0
+
+# Status codes worth retrying: quota exhaustion and transient server errors.
+RETRYABLE_STATUS_CODES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Holds up to `capacity` tokens and refills at
+    `rate_per_minute`, so bursts are allowed up to the capacity while the
+    long-run rate never exceeds the quota.
+    """
+
+    def __init__(self, rate_per_minute=DEFAULT_REQUESTS_PER_MINUTE, capacity=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity if capacity is not None else max(1, rate_per_minute // 6)
+        self.tokens = float(self.capacity)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """Blocks until a token is available and takes it."""
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def is_retryable(err):
+    """Returns True for HttpErrors caused by throttling or server-side failures."""
+    return isinstance(err, HttpError) and err.resp.status in RETRYABLE_STATUS_CODES
+
+
+def backoff_delay(attempt, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+    """Exponential backoff with full jitter for the given retry attempt (0-based)."""
+    return random.uniform(0, min(max_delay, base_delay * (2 ** attempt)))
+
+
+def execute_with_retry(request, http=None, limiter=None,
+                       max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY):
+    """
+    Executes a googleapiclient request, waiting on the limiter before every
+    attempt and retrying retryable errors with jittered exponential backoff.
+    Non-retryable errors, and retryable ones once retries run out, are raised.
+    """
+    attempt = 0
+    while True:
+        if limiter:
+            limiter.acquire()
+        try:
+            if http is not None:
+                return request.execute(http=http)
+            return request.execute()
+        except HttpError as err:
+            if not is_retryable(err) or attempt >= max_retries:
+                raise
+            delay = backoff_delay(attempt, base_delay)
+            print(f"Retryable error ({err.resp.status}), retrying in {delay:.1f}s...")
+            time.sleep(delay)
+            attempt += 1
+
+
+def run_in_order(items, worker, http_factory=None, max_workers=DEFAULT_MAX_WORKERS):
+    """
+    Runs worker(item, http) for every item on a bounded thread pool and returns
+    the results in the order of `items`, whichever finishes first. Each thread
+    gets its own transport from http_factory, since httplib2 is not
+    thread-safe. A worker that raises yields its exception as the result.
+    """
+    local = threading.local()
+
+    def run(item):
+        if http_factory is not None and not hasattr(local, 'http'):
+            local.http = http_factory()
+        try:
+            return worker(item, getattr(local, 'http', None))
+        except Exception as err:
+            return err
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, items))
@@ -0,0 +1,350 @@
+"""
+Bulk payment ingestion for house sheets.
+
+Loads a CSV of payments into the house sheets the way the Payment Management
+dialog (payment_dialog/code.gs) enters them one at a time: the amount goes
+into the payment column (C) of the row whose date column (B) holds the
+payment's month, and a timestamped note is appended to the notes column (N).
+Column B is the template's =TRIM(R..) schedule and is never written; a
+payment for a month the schedule does not reach is reported as an error,
+as the dialog does.
+
+The whole load takes one metadata call, chunked values.batchGet calls for
+columns B:N of every target sheet, and chunked values.batchUpdate calls for
+the writes. All cells of one row are written in the same batchUpdate.
+
+Every payment has an idempotency key, from the CSV's Key column or derived
+from its house, month, amount and notes. The key is stored in the note as
+[pay:<key>], in the same write as the payment, so a rerun of the same CSV
+skips the payments that were already posted. With --overwrite, a month
+whose row already holds posted keys gets the new amounts added to its
+payment; other entered payments are replaced, as in the dialog.
+
+Input CSV columns: House, Date (YYYY-MM-DD, MM/DD/YYYY or Mon-YYYY), Amount
+(a plain decimal such as 1250.50; '$' and ',' are ignored), Notes (optional),
+Key (optional; no spaces or ']'). A file with any other amount or key is
+rejected as a whole.
+
+Writes formula_exports/<system>/payments_<ts>.csv with each payment's status
+and target cell, and payments_metrics_<ts>.json with the run's API calls. If a write fails, the report is still written, with the
+rows that were not written marked failed; rerunning the CSV posts them.
+
+Usage: python3 payments.py <system> <payments.csv> [--dry-run] [--overwrite] [--chunk-size N]
+"""
+import argparse
+import csv
+import datetime
+import hashlib
+import json
+import os
+import re
+from collections import Counter, defaultdict
+
+from googleapiclient.errors import HttpError
+
+from a1 import quote_sheet_name
+from api_metrics import ApiMetrics, write_metrics
+from auth import get_authenticated_service
+from main import DEFAULT_BATCH_SIZE, match_house_sheets
+from paging import get_sheet_grids
+from parallel import DEFAULT_REQUESTS_PER_MINUTE, TokenBucket, execute_with_retry
+
+# Columns the payment dialog writes, and the first row of the payment schedule.
+DATE_COLUMN = 'B'
+PAYMENT_COLUMN = 'C'
+NOTES_COLUMN = 'N'
+FIRST_PAYMENT_ROW = 19
+
+# Rows written per values.batchUpdate call.
+DEFAULT_CHUNK_ROWS = 200
+
+REPORT_COLUMNS = ['House', 'Date', 'Amount', 'Key', 'Status', 'Cell', 'Message']
+
+_KEY_MARKER = re.compile(r'\[pay:([^\]\s]+)\]')
+# Keys must read back from their marker.
+_KEY = re.compile(r'^[^\]\s]+$')
+# Amounts go into a '=' formula, so only plain decimals are accepted.
+_AMOUNT = re.compile(r'^-?\d+(\.\d+)?$')
+# Offsets of the date, payment and notes columns within a B:N row.
+_DATE, _PAYMENT, _NOTES = 0, 1, 12
+_SHEETS_EPOCH = datetime.date(1899, 12, 30)
+
+
+def month_label(value):
+    """
+    Returns the schedule label of a date ('Jun-2025', as TEXT(..., "mmm-yyyy")
+    renders it), or None when the value is not a date.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        value = _SHEETS_EPOCH + datetime.timedelta(days=int(value))
+    elif isinstance(value, str):
+        text = value.strip()
+        for pattern in ('%Y-%m-%d', '%m/%d/%Y', '%b-%Y', '%B-%Y', '%b %Y', '%B %Y'):
+            try:
+                value = datetime.datetime.strptime(text, pattern).date()
+                break
+            except ValueError:
+                continue
+        else:
+            return None
+    else:
+        return None
+    return value.strftime('%b-%Y')
+
+
+def payment_key(payment, occurrence):
+    """Derives a payment's idempotency key; identical CSV lines differ by occurrence."""
+    text = '|'.join([payment['House'], payment['Month'], payment['Amount'], payment['Notes'], str(occurrence)])
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()[:12]
+
+
+def read_payments(path):
+    """Reads and validates the payments CSV. Returns (payments, rejected report rows)."""
+    payments, rejected = [], []
+    occurrences = Counter()
+    with open(path, 'r', encoding='utf-8', newline='') as f:
+        for record in csv.DictReader(f):
+            payment = {
+                'House': (record.get('House') or '').strip(),
+                'Date': (record.get('Date') or '').strip(),
+                'Amount': (record.get('Amount') or '').strip().replace(',', '').lstrip('$'),
+                'Notes': (record.get('Notes') or '').strip(),
+            }
+            payment['Month'] = month_label(payment['Date'])
+            problem = None
+            if not payment['House']:
+                problem = "missing house"
+            elif payment['Month'] is None:
+                problem = f"unrecognized date '{payment['Date']}'"
+            elif not _AMOUNT.match(payment['Amount']):
+                problem = f"invalid amount '{payment['Amount']}'"
+            elif record.get('Key') and not _KEY.match(record['Key'].strip()):
+                problem = f"invalid key '{record['Key'].strip()}'"
+            if problem:
+                rejected.append(report_row(payment, '', 'invalid', message=problem))
+                continue
+            identity = (payment['House'], payment['Month'], payment['Amount'], payment['Notes'])
+            occurrences[identity] += 1
+            payment['Key'] = (record.get('Key') or '').strip() or payment_key(payment, occurrences[identity])
+            payments.append(payment)
+    return payments, rejected
+
+
+def report_row(payment, cell, status, message=''):
+    return {
+        'House': payment['House'], 'Date': payment['Date'], 'Amount': payment['Amount'],
+        'Key': payment.get('Key', ''), 'Status': status, 'Cell': cell, 'Message': message,
+    }
+
+
+def fetch_ledgers(service, spreadsheet_id, grids, sheet_names, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Fetches columns B:N from the first payment row down of every sheet, in
+    chunked values.batchGet calls. Returns {sheet name: rows}.
+    """
+    ledgers = {}
+    for start in range(0, len(sheet_names), batch_size):
+        chunk = sheet_names[start:start + batch_size]
+        ranges = [f"{quote_sheet_name(name)}!{DATE_COLUMN}{FIRST_PAYMENT_ROW}:{NOTES_COLUMN}{max(grids[name][0], FIRST_PAYMENT_ROW)}"
+                  for name in chunk]
+        request = service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id, ranges=ranges, valueRenderOption='UNFORMATTED_VALUE'
+        )
+        result = execute_with_retry(request)
+        for sheet_name, value_range in zip(chunk, result.get('valueRanges', [])):
+            ledgers[sheet_name] = value_range.get('values', [])
+    return ledgers
+
+
+class Ledger:
+    """The payment rows of one house sheet, and the writes planned for it."""
+
+    def __init__(self, sheet_name, rows):
+        self.sheet_name = sheet_name
+        self.rows = [list(row) + [''] * (_NOTES + 1 - len(row)) for row in rows]
+        self.month_rows = {}
+        self.posted_keys = set()
+        self.posted_rows = set()
+        for offset, row in enumerate(self.rows):
+            label = month_label(row[_DATE])
+            if label and label not in self.month_rows:
+                self.month_rows[label] = offset
+            keys = _KEY_MARKER.findall(str(row[_NOTES]))
+            if keys:
+                self.posted_keys.update(keys)
+                self.posted_rows.add(offset)
+
+    def cell(self, column, offset):
+        return f"{column}{FIRST_PAYMENT_ROW + offset}"
+
+    def plan(self, month, payments, overwrite, today):
+        """
+        Plans the writes for one month's payments. Returns (offset, {column:
+        entered value}, status, message); offset is None when nothing is written.
+        """
+        offset = self.month_rows.get(month)
+        if offset is None:
+            return None, {}, 'error', f"no row for {month} in column {DATE_COLUMN}"
+        writes = {}
+        row = self.rows[offset]
+        existing_payment, existing_notes = row[_PAYMENT], str(row[_NOTES]).strip()
+        amounts = [payment['Amount'] for payment in payments]
+        status = 'posted'
+        if existing_payment not in ('', None):
+            if not overwrite:
+                return None, {}, 'exists', f"payment already entered in {self.cell(PAYMENT_COLUMN, offset)}: {existing_payment}"
+            if offset in self.posted_rows:
+                # Earlier runs posted here; their amounts must stay in the sum.
+                if not isinstance(existing_payment, (int, float)) or isinstance(existing_payment, bool):
+                    return None, {}, 'error', (f"{self.cell(PAYMENT_COLUMN, offset)} holds "
+                                               f"{existing_payment!r}, not an amount to add to")
+                amounts.insert(0, repr(existing_payment))
+                status = 'added'
+            else:
+                status = 'overwritten'
+
+        # Like the dialog, the payment is entered as a formula; several payments
+        # for one month are summed in it.
+        writes[PAYMENT_COLUMN] = '=' + '+'.join(amounts)
+        stamp = today.strftime('%d/%m/%Y')
+        notes = [f"({stamp}) " + (f"{payment['Notes']} " if payment['Notes'] else '') + f"[pay:{payment['Key']}]"
+                 for payment in payments]
+        writes[NOTES_COLUMN] = "'" + '\n'.join(([existing_notes] if existing_notes else []) + notes)
+        return offset, writes, status, ''
+
+
+def plan_payments(payments, ledgers, overwrite, today):
+    """
+    Plans every payment against the fetched ledgers. Returns (row writes as
+    (sheet, offset, {column: value}) tuples, report rows).
+    """
+    writes, report = [], []
+    by_month = defaultdict(list)
+    for payment in payments:
+        ledger = ledgers[payment['House']]
+        if payment['Key'] in ledger.posted_keys:
+            report.append(report_row(payment, '', 'already posted'))
+            continue
+        ledger.posted_keys.add(payment['Key'])
+        by_month[(payment['House'], payment['Month'])].append(payment)
+    for (house, month), month_payments in by_month.items():
+        ledger = ledgers[house]
+        offset, row_writes, status, message = ledger.plan(month, month_payments, overwrite, today)
+        cell = f"{house}!{ledger.cell(PAYMENT_COLUMN, offset)}" if offset is not None else ''
+        if offset is not None:
+            writes.append((house, offset, row_writes))
+        for payment in month_payments:
+            report.append(report_row(payment, cell, status, message))
+    return writes, report
+
+
+def write_rows(service, spreadsheet_id, writes, chunk_rows=DEFAULT_CHUNK_ROWS, limiter=None):
+    """
+    Writes planned rows with chunked values.batchUpdate calls, keeping all
+    cells of a row in the same call. Stops at the first call that still fails
+    after its retries. Returns (number of updated cells, writes left unwritten).
+    """
+    updated = 0
+    for start in range(0, len(writes), chunk_rows):
+        data = [
+            {'range': f"{quote_sheet_name(sheet_name)}!{column}{FIRST_PAYMENT_ROW + offset}", 'values': [[value]]}
+            for sheet_name, offset, row_writes in writes[start:start + chunk_rows]
+            for column, value in sorted(row_writes.items())
+        ]
+        try:
+            result = execute_with_retry(service.spreadsheets().values().batchUpdate(
+                spreadsheetId=spreadsheet_id,
+                body={'valueInputOption': 'USER_ENTERED', 'data': data}
+            ), limiter=limiter)
+        except HttpError as err:
+            print(f"An error occurred while writing rows {start + 1}-{min(start + chunk_rows, len(writes))}: {err}")
+            return updated, writes[start:]
+        updated += result.get('totalUpdatedCells', 0)
+        print(f"Wrote {min(start + chunk_rows, len(writes))} of {len(writes)} rows.")
+    return updated, []
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Enter a CSV of payments into the house sheets.")
+    parser.add_argument('system', help="System name from config.json, e.g. bms")
+    parser.add_argument('payments_csv', help="CSV with House, Date, Amount and optional Notes and Key columns")
+    parser.add_argument('--dry-run', action='store_true', help="Plan and report without writing to the sheets")
+    parser.add_argument('--overwrite', action='store_true',
+                        help="Replace payments already entered for a month, as the dialog's overwrite does")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_ROWS,
+                        help=f"Rows written per values.batchUpdate call (default: {DEFAULT_CHUNK_ROWS})")
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as f:
+        all_configs = json.load(f)
+    if args.system not in all_configs:
+        print(f"Error: Target system '{args.system}' not found in config.json.")
+        return
+    config = all_configs[args.system]['config']
+    spreadsheet_id = all_configs[args.system]['spreadsheet_id']
+
+    payments, report = read_payments(args.payments_csv)
+    bad_rows = [row for row in report if row['Message'].startswith(('invalid amount', 'invalid key'))]
+    if bad_rows:
+        for row in bad_rows:
+            print(f"{row['House']} {row['Date']}: {row['Message']}")
+        print(f"{len(bad_rows)} payments have an invalid amount or key; nothing was written. Exiting.")
+        return
+    metrics = ApiMetrics()
+    service = get_authenticated_service("sheets", "v4", metrics=metrics)
+    grids = get_sheet_grids(service, spreadsheet_id)
+    if grids is None:
+        print("Could not retrieve sheet names. Exiting.")
+        return
+    house_targets = match_house_sheets(config, list(grids))
+    metrics.set_phases(house_targets)
+    house_sheets = {target.sheet_name for target in house_targets}
+    targets = []
+    for payment in payments:
+        if payment['House'] in house_sheets:
+            targets.append(payment)
+        else:
+            reason = "not a house sheet" if payment['House'] in grids else "sheet not found"
+            report.append(report_row(payment, '', 'invalid', message=reason))
+
+    try:
+        names = sorted({payment['House'] for payment in targets})
+        ledgers = {name: Ledger(name, rows)
+                   for name, rows in fetch_ledgers(service, spreadsheet_id, grids, names).items()}
+    except HttpError as err:
+        print(f"An error occurred while reading the house sheets; nothing was written: {err}")
+        return
+    writes, planned = plan_payments(targets, ledgers, args.overwrite, datetime.date.today())
+    if args.dry_run:
+        for row in planned:
+            if row['Status'] in ('posted', 'overwritten', 'added'):
+                row['Status'] = f"dry run ({row['Status']})"
+    report.extend(planned)
+    if writes and not args.dry_run:
+        limiter = TokenBucket(DEFAULT_REQUESTS_PER_MINUTE)
+        _, unwritten = write_rows(service, spreadsheet_id, writes, args.chunk_size, limiter)
+        failed_cells = {f"{sheet_name}!{PAYMENT_COLUMN}{FIRST_PAYMENT_ROW + offset}"
+                        for sheet_name, offset, _ in unwritten}
+        for row in planned:
+            if row['Cell'] in failed_cells:
+                row['Status'], row['Message'] = 'failed', "not written; rerun the CSV to post it"
+
+    output_dir = os.path.join('formula_exports', args.system)
+    os.makedirs(output_dir, exist_ok=True)
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    filename = os.path.join(output_dir, f"payments_{timestamp}.csv")
+    with open(filename, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=REPORT_COLUMNS, lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(report)
+
+    statuses = Counter(row['Status'] for row in report)
+    verb = "Planned" if args.dry_run else "Processed"
+    print(f"{verb} {len(report)} payments into {len(writes)} rows: " +
+          ", ".join(f"{count} {status}" for status, count in statuses.most_common()))
+    print(f"Report saved to: {filename}")
+    write_metrics(metrics, output_dir, timestamp, prefix='payments_')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,226 @@
+"""
+Relative (R1C1-style) formula normalization and grouped formula exports.
+
+A formula copied down a column has a different A1 text in every cell but the
+same relative form: =B19*C19 in row 19 and =B20*C20 in row 20 are both
+=RC[-6]*RC[-5] as seen from column H. Grouping consecutive cells of a column
+that share the relative form turns the thousands of copied-down template
+formulas into one record per run, e.g. H19:H1001, and runs side by side
+with the same rows and form are merged further, e.g. H3:N3.
+
+Usage:
+    python3 r1c1.py group <formulas.csv> [grouped.csv]
+    python3 r1c1.py expand <grouped.csv> [formulas.csv]
+"""
+import csv
+import re
+import sys
+
+from a1 import column_index, column_letter, parse_cell
+
+GROUPED_COLUMNS = ['Sheet Name', 'Range', 'Notation', 'Formula']
+FORMULA_COLUMNS = ['Sheet Name', 'Cell', 'Formula']
+
+# String literals and quoted sheet names are copied through untouched.
+_QUOTED = re.compile(r'"(?:[^"]|"")*"|\'(?:[^\']|\'\')*\'')
+
+_NOT_BEFORE = r'(?<![A-Za-z0-9_.])'
+_NOT_AFTER = r'(?![A-Za-z0-9_.(!])'
+
+# A1 cell references (B19, $B$19, H$2) and column-only range ends ($B:$B,
+# $F$5:$F), matched in one pass so converted text is never matched again.
+_A1_REFERENCE = re.compile(
+    _NOT_BEFORE + r'(?:(\$?)([A-Z]{1,3})(\$?)(\d+)' + _NOT_AFTER +
+    r'|(?:(?<=:)|(?=\$?[A-Z]{1,3}:))(\$?)([A-Z]{1,3})' + _NOT_AFTER + r'(?!\$?\d))'
+)
+
+# The R1C1 forms written by to_r1c1: R19C2, R[-1]C, RC[3], and C2 / C[-1]
+# for column-only range ends.
+_R1C1_REFERENCE = re.compile(
+    _NOT_BEFORE + r'(?:R(\[-?\d+\]|\d+)?C(\[-?\d+\]|\d+)?' + _NOT_AFTER +
+    r'|(?:(?<=:)|(?=C(?:\[-?\d+\]|\d+):))C(\[-?\d+\]|\d+)' + _NOT_AFTER + r')'
+)
+
+
+def _map_unquoted(formula, convert):
+    """Applies convert to the parts of a formula outside quotes."""
+    parts = []
+    position = 0
+    for match in _QUOTED.finditer(formula):
+        parts.append(convert(formula[position:match.start()]))
+        parts.append(match.group(0))
+        position = match.end()
+    parts.append(convert(formula[position:]))
+    return ''.join(parts)
+
+
+def _relative(absolute_marker, index, origin, axis):
+    if absolute_marker:
+        return f"{axis}{index + 1}"
+    offset = index - origin
+    return f"{axis}[{offset}]" if offset else axis
+
+
+def _absolute(token, origin):
+    """Returns (is_absolute, zero-based index) for an R1C1 row or column part."""
+    if not token:
+        return False, origin
+    if token.startswith('['):
+        return False, origin + int(token[1:-1])
+    return True, int(token) - 1
+
+
+def to_r1c1(formula, row_idx, col_idx):
+    """Rewrites the A1 references of a formula in cell (row_idx, col_idx) to relative R1C1 form."""
+    def reference(match):
+        col_abs, col_str, row_abs, row_str, column_abs, column_str = match.groups()
+        if col_str is None:
+            text = _relative(column_abs, column_index(column_str), col_idx, 'C')
+            return text if text != 'C' else 'C[0]'
+        return (_relative(row_abs, int(row_str) - 1, row_idx, 'R') +
+                _relative(col_abs, column_index(col_str), col_idx, 'C'))
+    return _map_unquoted(formula, lambda text: _A1_REFERENCE.sub(reference, text))
+
+
+def from_r1c1(formula, row_idx, col_idx):
+    """Rewrites a relative R1C1 formula back to A1 form as seen from cell (row_idx, col_idx)."""
+    def reference(match):
+        row_token, col_token, column_token = match.groups()
+        if column_token is not None:
+            col_abs, col = _absolute(column_token, col_idx)
+            return f"{'$' if col_abs else ''}{column_letter(col)}"
+        row_abs, row = _absolute(row_token, row_idx)
+        col_abs, col = _absolute(col_token, col_idx)
+        return f"{'$' if col_abs else ''}{column_letter(col)}{'$' if row_abs else ''}{row + 1}"
+    return _map_unquoted(formula, lambda text: _R1C1_REFERENCE.sub(reference, text))
+
+
+def canonical_formula(formula, row_idx, col_idx):
+    """
+    Returns the R1C1 form of a formula, or None when it does not convert back
+    to exactly the same A1 text (so it cannot be shared safely).
+    """
+    canonical = to_r1c1(formula, row_idx, col_idx)
+    if from_r1c1(canonical, row_idx, col_idx) != formula:
+        return None
+    return canonical
+
+
+def _group_sheet(sheet_name, cells):
+    """
+    Groups one sheet's [(row, col, formula)] into runs down each column, then
+    merges side-by-side runs with the same rows and formula into blocks.
+    """
+    runs = []
+    open_runs = {}
+    for row_idx, col_idx, formula in sorted(cells, key=lambda cell: (cell[1], cell[0])):
+        canonical = canonical_formula(formula, row_idx, col_idx)
+        run = open_runs.get(col_idx)
+        if canonical is not None and run and run['canonical'] == canonical and run['end'] == row_idx - 1:
+            run['end'] = row_idx
+            continue
+        run = {'start': row_idx, 'end': row_idx, 'col': col_idx,
+               'canonical': canonical, 'formula': formula}
+        runs.append(run)
+        open_runs[col_idx] = run if canonical is not None else None
+
+    blocks = []
+    for run in sorted(runs, key=lambda run: (run['start'], run['col'])):
+        block = blocks[-1] if blocks else None
+        if (run['canonical'] is not None and block and block['canonical'] == run['canonical'] and
+                block['start'] == run['start'] and block['end'] == run['end'] and
+                block['last_col'] == run['col'] - 1):
+            block['last_col'] = run['col']
+            continue
+        blocks.append(dict(run, last_col=run['col']))
+
+    for block in blocks:
+        start = f"{column_letter(block['col'])}{block['start'] + 1}"
+        if block['canonical'] is None:
+            yield {'Sheet Name': sheet_name, 'Range': start, 'Notation': 'A1', 'Formula': block['formula']}
+            continue
+        cell_range = start
+        if block['end'] != block['start'] or block['last_col'] != block['col']:
+            cell_range = f"{start}:{column_letter(block['last_col'])}{block['end'] + 1}"
+        yield {'Sheet Name': sheet_name, 'Range': cell_range, 'Notation': 'R1C1', 'Formula': block['canonical']}
+
+
+def group_formulas(formulas):
+    """
+    Yields grouped records from per-cell formula records. Records of a sheet
+    must be contiguous, as they are in an export, and only one sheet is held
+    in memory at a time.
+    """
+    sheet_name = None
+    cells = []
+    for formula in formulas:
+        if formula['Sheet Name'] != sheet_name:
+            if cells:
+                yield from _group_sheet(sheet_name, cells)
+            sheet_name = formula['Sheet Name']
+            cells = []
+        row_idx, col_idx = parse_cell(formula['Cell'])
+        cells.append((row_idx, col_idx, formula['Formula']))
+    if cells:
+        yield from _group_sheet(sheet_name, cells)
+
+
+def expand_formulas(grouped):
+    """Yields the per-cell formula records of grouped records, in export (row-major) order."""
+    sheet_name = None
+    cells = []
+
+    def flush():
+        for row_idx, col_idx, formula in sorted(cells):
+            yield {'Sheet Name': sheet_name, 'Cell': f"{column_letter(col_idx)}{row_idx + 1}", 'Formula': formula}
+
+    for record in grouped:
+        if record['Sheet Name'] != sheet_name:
+            yield from flush()
+            sheet_name = record['Sheet Name']
+            cells = []
+        start, _, end = record['Range'].partition(':')
+        start_row, start_col = parse_cell(start)
+        end_row, end_col = parse_cell(end) if end else (start_row, start_col)
+        for row_idx in range(start_row, end_row + 1):
+            for col_idx in range(start_col, end_col + 1):
+                if record['Notation'] == 'A1':
+                    formula = record['Formula']
+                else:
+                    formula = from_r1c1(record['Formula'], row_idx, col_idx)
+                cells.append((row_idx, col_idx, formula))
+    yield from flush()
+
+
+def _convert_csv(source, destination, fieldnames, convert):
+    with open(source, 'r', encoding='utf-8', newline='') as f_in, \
+         open(destination, 'w', encoding='utf-8', newline='') as f_out:
+        writer = csv.DictWriter(f_out, fieldnames=fieldnames, lineterminator='\n')
+        writer.writeheader()
+        count = 0
+        for record in convert(csv.DictReader(f_in)):
+            writer.writerow(record)
+            count += 1
+    return count
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('group', 'expand'):
+        print("Usage: python3 r1c1.py group <formulas.csv> [grouped.csv]")
+        print("       python3 r1c1.py expand <grouped.csv> [formulas.csv]")
+        return
+
+    command, source = sys.argv[1], sys.argv[2]
+    if command == 'group':
+        destination = sys.argv[3] if len(sys.argv) > 3 else source.replace('.csv', '_grouped.csv')
+        count = _convert_csv(source, destination, GROUPED_COLUMNS, group_formulas)
+    else:
+        destination = sys.argv[3] if len(sys.argv) > 3 else source.replace('_grouped.csv', '.csv')
+        if destination == source:
+            destination = source.replace('.csv', '_expanded.csv')
+        count = _convert_csv(source, destination, FORMULA_COLUMNS, expand_formulas)
+    print(f"Wrote {count} records to {destination}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,237 @@
+"""
+Static recalculation-cost profiler for formula exports.
+
+Each formula gets a cost estimate from its shape alone:
+
+    work = function calls + nesting depth
+           + RANGE_CELL_WEIGHT * referenced cells * max(1, lookups + aggregates)
+    cost = work * VOLATILE_WEIGHT   if the formula calls a volatile function
+         = work                     otherwise
+
+Lookups and conditional aggregates scan the ranges they are given, so their
+referenced cells are multiplied by the number of such calls. Volatile
+functions (TODAY, INDIRECT, ...) recalculate on every edit instead of only
+when a precedent changes, which the weight accounts for. Open-ended ranges
+such as B:B are sized to the default 1000 x 26 grid.
+
+Costs are summed per sheet and per canonical (R1C1) formula, so a formula
+copied down 983 rows is one ranked hotspot instead of 983 rows.
+
+Usage: python3 recalc_profiler.py <formulas.csv> [output_prefix]
+"""
+import csv
+import json
+import os
+import sys
+from collections import Counter
+
+from a1 import cell_name, parse_cell
+from dependency_graph import UNBOUNDED, reference_bounds, sheet_from_export_name
+from formula_parser import FormulaSyntaxError, Function, Reference, depth, parse_formula, walk
+from r1c1 import to_r1c1
+
+VOLATILE_FUNCTIONS = {'TODAY', 'NOW', 'RAND', 'RANDBETWEEN', 'RANDARRAY', 'INDIRECT', 'OFFSET'}
+LOOKUP_FUNCTIONS = {'VLOOKUP', 'HLOOKUP', 'XLOOKUP', 'LOOKUP', 'MATCH', 'XMATCH'}
+AGGREGATE_FUNCTIONS = {
+    'SUMIFS', 'SUMIF', 'COUNTIFS', 'COUNTIF', 'AVERAGEIFS', 'AVERAGEIF', 'MAXIFS', 'MINIFS',
+    'SUMPRODUCT', 'FILTER', 'QUERY', 'UNIQUE', 'SORT',
+}
+
+VOLATILE_WEIGHT = 10
+RANGE_CELL_WEIGHT = 0.01
+DEFAULT_GRID_ROWS = 1000
+DEFAULT_GRID_COLUMNS = 26
+
+SHEET_COLUMNS = [
+    'Rank', 'Sheet', 'Formula Cells', 'Volatile Cells', 'Lookups', 'Aggregates',
+    'Referenced Cells', 'Total Cost', 'Share %',
+]
+FORMULA_COLUMNS = [
+    'Rank', 'Sheet', 'Example Cell', 'Cells', 'Canonical Formula', 'Volatile Functions',
+    'Referenced Cells', 'Lookups', 'Aggregates', 'Depth', 'Cost Per Cell', 'Total Cost', 'Share %',
+]
+
+
+def _range_size(reference):
+    first_row, last_row, first_col, last_col = reference_bounds(reference)
+    if last_row == UNBOUNDED:
+        last_row = max(first_row, DEFAULT_GRID_ROWS - 1)
+    if last_col == UNBOUNDED:
+        last_col = max(first_col, DEFAULT_GRID_COLUMNS - 1)
+    return (last_row - first_row + 1) * (last_col - first_col + 1)
+
+
+def formula_metrics(formula):
+    """
+    Returns the cost metrics of one formula as a dict, or None when it
+    cannot be parsed.
+    """
+    try:
+        tree = parse_formula(formula)
+    except FormulaSyntaxError:
+        return None
+    functions = Counter()
+    referenced_cells = 0
+    for node in walk(tree):
+        if isinstance(node, Function):
+            functions[node.name] += 1
+        elif isinstance(node, Reference):
+            referenced_cells += _range_size(node)
+    volatile = sorted(name for name in functions if name in VOLATILE_FUNCTIONS)
+    lookups = sum(count for name, count in functions.items() if name in LOOKUP_FUNCTIONS)
+    aggregates = sum(count for name, count in functions.items() if name in AGGREGATE_FUNCTIONS)
+    nesting = depth(tree)
+    work = (sum(functions.values()) + nesting +
+            RANGE_CELL_WEIGHT * referenced_cells * max(1, lookups + aggregates))
+    return {
+        'volatile': volatile,
+        'volatile_calls': sum(functions[name] for name in volatile),
+        'referenced_cells': referenced_cells,
+        'lookups': lookups,
+        'aggregates': aggregates,
+        'depth': nesting,
+        'cost': round(work * (VOLATILE_WEIGHT if volatile else 1), 2),
+    }
+
+
+class RecalcProfiler:
+    """
+    Accumulates per-sheet and per-canonical-formula costs from formula
+    records. Cells sharing a canonical formula share its metrics, so each
+    distinct formula shape is only parsed once.
+    """
+
+    def __init__(self):
+        self.groups = {}   # (sheet, canonical) -> aggregate dict
+        self.sheets = {}   # sheet -> aggregate dict
+        self.unparsed = 0
+
+    def add(self, record):
+        """Adds one {'Sheet Name', 'Cell', 'Formula'} record."""
+        sheet = sheet_from_export_name(record['Sheet Name'])
+        row, col = parse_cell(record['Cell'])
+        canonical = to_r1c1(record['Formula'], row, col)
+        group = self.groups.get((sheet, canonical))
+        if group is None:
+            metrics = formula_metrics(record['Formula'])
+            if metrics is None:
+                self.unparsed += 1
+                return
+            group = self.groups[(sheet, canonical)] = dict(
+                metrics, sheet=sheet, canonical=canonical, example=cell_name(row, col), cells=0
+            )
+        group['cells'] += 1
+
+        totals = self.sheets.setdefault(sheet, {
+            'sheet': sheet, 'cells': 0, 'volatile_cells': 0, 'lookups': 0,
+            'aggregates': 0, 'referenced_cells': 0, 'cost': 0.0,
+        })
+        totals['cells'] += 1
+        totals['volatile_cells'] += bool(group['volatile'])
+        totals['lookups'] += group['lookups']
+        totals['aggregates'] += group['aggregates']
+        totals['referenced_cells'] += group['referenced_cells']
+        totals['cost'] += group['cost']
+
+    def add_all(self, records):
+        for record in records:
+            self.add(record)
+
+    def total_cost(self):
+        return sum(sheet['cost'] for sheet in self.sheets.values())
+
+    def sheet_report(self):
+        """Returns per-sheet rows ranked by total cost."""
+        total = self.total_cost() or 1
+        ranked = sorted(self.sheets.values(), key=lambda sheet: -sheet['cost'])
+        return [{
+            'Rank': rank,
+            'Sheet': sheet['sheet'],
+            'Formula Cells': sheet['cells'],
+            'Volatile Cells': sheet['volatile_cells'],
+            'Lookups': sheet['lookups'],
+            'Aggregates': sheet['aggregates'],
+            'Referenced Cells': sheet['referenced_cells'],
+            'Total Cost': round(sheet['cost'], 2),
+            'Share %': round(100 * sheet['cost'] / total, 2),
+        } for rank, sheet in enumerate(ranked, 1)]
+
+    def formula_report(self):
+        """Returns per-canonical-formula rows ranked by total cost."""
+        total = self.total_cost() or 1
+        ranked = sorted(self.groups.values(), key=lambda group: -group['cost'] * group['cells'])
+        return [{
+            'Rank': rank,
+            'Sheet': group['sheet'],
+            'Example Cell': group['example'],
+            'Cells': group['cells'],
+            'Canonical Formula': group['canonical'],
+            'Volatile Functions': ' '.join(group['volatile']),
+            'Referenced Cells': group['referenced_cells'],
+            'Lookups': group['lookups'],
+            'Aggregates': group['aggregates'],
+            'Depth': group['depth'],
+            'Cost Per Cell': group['cost'],
+            'Total Cost': round(group['cost'] * group['cells'], 2),
+            'Share %': round(100 * group['cost'] * group['cells'] / total, 2),
+        } for rank, group in enumerate(ranked, 1)]
+
+    def write_reports(self, prefix):
+        """
+        Writes <prefix>_sheets.csv, <prefix>_formulas.csv and <prefix>.json.
+        Returns the list of written paths.
+        """
+        sheets = self.sheet_report()
+        formulas = self.formula_report()
+        paths = []
+        for suffix, columns, rows in (('_sheets.csv', SHEET_COLUMNS, sheets),
+                                      ('_formulas.csv', FORMULA_COLUMNS, formulas)):
+            path = f"{prefix}{suffix}"
+            with open(path, 'w', encoding='utf-8', newline='') as f:
+                writer = csv.DictWriter(f, fieldnames=columns, lineterminator='\n')
+                writer.writeheader()
+                writer.writerows(rows)
+            paths.append(path)
+        path = f"{prefix}.json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'model': {
+                    'volatile_weight': VOLATILE_WEIGHT,
+                    'range_cell_weight': RANGE_CELL_WEIGHT,
+                    'default_grid': [DEFAULT_GRID_ROWS, DEFAULT_GRID_COLUMNS],
+                },
+                'total_cost': round(self.total_cost(), 2),
+                'unparsed_formulas': self.unparsed,
+                'sheets': sheets,
+                'formulas': formulas,
+            }, f, ensure_ascii=False, indent=2)
+        paths.append(path)
+        return paths
+
+
+def profile_stream(records, profiler):
+    """Passes formula records through unchanged while adding them to a profiler."""
+    for record in records:
+        profiler.add(record)
+        yield record
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: python3 recalc_profiler.py <formulas.csv> [output_prefix]")
+        return
+    source = sys.argv[1]
+    prefix = sys.argv[2] if len(sys.argv) > 2 else \
+        os.path.join(os.path.dirname(source), 'hotspots_' + os.path.basename(source)[:-len('.csv')])
+    profiler = RecalcProfiler()
+    with open(source, 'r', encoding='utf-8', newline='') as f:
+        profiler.add_all(csv.DictReader(f))
+    for row in profiler.sheet_report():
+        print(f"{row['Rank']:>3}. {row['Sheet']:<30} {row['Share %']:>6}%  "
+              f"({row['Formula Cells']} cells, {row['Volatile Cells']} volatile)")
+    for path in profiler.write_reports(prefix):
+        print(f"Report saved to: {path}")
+
+
+if __name__ == "__main__":
+    main()
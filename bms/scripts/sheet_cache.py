@@ -0,0 +1,124 @@
+import hashlib
+import json
+import os
+
+from googleapiclient.errors import HttpError
+
+CACHE_ROOT = 'formula_cache'
+MANIFEST_NAME = 'manifest.json'
+
+
+def content_hash(values):
+    """Returns a stable SHA-256 hash of a sheet's value matrix."""
+    payload = json.dumps(values, ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def config_hash(config):
+    """Returns a hash of the config settings that decide which sheets are extracted."""
+    resolved = [config.get('templateSheetName'), config.get('houseSheetNamePattern'),
+                config.get('otherSheetsToProcess', [])]
+    return hashlib.sha256(json.dumps(resolved, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+
+def get_spreadsheet_revision(drive_service, spreadsheet_id):
+    """
+    Returns the spreadsheet's Drive revision marker ({'version', 'modifiedTime'})
+    or None when it cannot be read, e.g. because the token lacks the Drive
+    metadata scope. Any edit to any sheet bumps the version.
+    """
+    try:
+        return drive_service.files().get(
+            fileId=spreadsheet_id,
+            fields='version,modifiedTime'
+        ).execute()
+    except HttpError as err:
+        print(f"Could not read the spreadsheet revision, falling back to content hashes: {err}")
+        return None
+
+
+class SheetCache:
+    """
+    Per-system cache of extracted formulas. The manifest records the
+    spreadsheet revision, a hash of the config the targets were resolved
+    with, the resolved target sheets of the last run and a content hash per
+    sheet; each sheet's formulas are stored in a file named after that hash.
+    """
+
+    def __init__(self, system, spreadsheet_id, config=None, cache_root=CACHE_ROOT):
+        self.directory = os.path.join(cache_root, system)
+        self.spreadsheet_id = spreadsheet_id
+        self.config_hash = config_hash(config or {})
+        self.cached_config_hash = None
+        self.revision = None
+        self.targets = []
+        self.sheets = {}
+        manifest_path = os.path.join(self.directory, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            # A cache built for another spreadsheet is useless; start empty.
+            if manifest.get('spreadsheet_id') == spreadsheet_id:
+                self.revision = manifest.get('revision')
+                self.cached_config_hash = manifest.get('config_hash')
+                self.targets = manifest.get('targets', [])
+                self.sheets = manifest.get('sheets', {})
+
+    def is_current(self, revision):
+        """
+        True when the cache was written at the given spreadsheet revision with
+        the current config, and still holds the formulas of every target sheet.
+        """
+        if not revision or self.revision != revision or not self.targets:
+            return False
+        if self.cached_config_hash != self.config_hash:
+            return False
+        return all(self._formula_path(target[0]) for target in self.targets)
+
+    def _formula_path(self, sheet_name, sheet_hash=None):
+        entry = self.sheets.get(sheet_name)
+        if entry is None or (sheet_hash is not None and entry['hash'] != sheet_hash):
+            return None
+        path = os.path.join(self.directory, f"{entry['hash']}.json")
+        return path if os.path.exists(path) else None
+
+    def get_formulas(self, sheet_name, sheet_hash=None):
+        """
+        Returns the cached [cell, formula] pairs of a sheet, or None when the
+        sheet is not cached or its cached content hash differs from sheet_hash.
+        """
+        path = self._formula_path(sheet_name, sheet_hash)
+        if path is None:
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+
+    def put_formulas(self, sheet_name, sheet_hash, cells):
+        """Stores a sheet's [cell, formula] pairs under its content hash."""
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, f"{sheet_hash}.json")
+        if not os.path.exists(path):
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(cells, f, ensure_ascii=False)
+        self.sheets[sheet_name] = {'hash': sheet_hash}
+
+    def save(self, revision, targets):
+        """Writes the manifest and removes formula files no sheet refers to any more."""
+        os.makedirs(self.directory, exist_ok=True)
+        target_names = {target[0] for target in targets}
+        self.sheets = {name: entry for name, entry in self.sheets.items() if name in target_names}
+        self.revision = revision
+        self.cached_config_hash = self.config_hash
+        self.targets = [list(target) for target in targets]
+        with open(os.path.join(self.directory, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump({
+                'spreadsheet_id': self.spreadsheet_id,
+                'revision': revision,
+                'config_hash': self.config_hash,
+                'targets': self.targets,
+                'sheets': self.sheets,
+            }, f, ensure_ascii=False, indent=2)
+        live_files = {f"{entry['hash']}.json" for entry in self.sheets.values()}
+        for name in os.listdir(self.directory):
+            if name != MANIFEST_NAME and name.endswith('.json') and name not in live_files:
+                os.remove(os.path.join(self.directory, name))
@@ -0,0 +1,277 @@
+"""
+Columnar value snapshots of whole workbooks.
+
+A snapshot fetches every sheet's values once (valueRenderOption=
+UNFORMATTED_VALUE) and stores them as typed NumPy arrays, so evaluation and
+reporting jobs can share the data without calling the API again. Each
+sheet gets its own directory of .npy files, all in column-major order:
+
+    numbers.npy       float64 rows x columns, NaN where the cell holds no number
+    kinds.npy         int8 rows x columns: 0 empty, 1 number, 2 text, 3 boolean
+    text_offsets.npy  int64, one offset per cell (column-major) plus an end offset
+    text_data.npy     uint8, the UTF-8 text of all text cells back to back
+
+manifest.json records the spreadsheet, its Drive revision, the fetch time
+and the shape of every sheet. Snapshot.open memory-maps the arrays, so
+opening a snapshot reads only the manifest and columns are zero-copy views.
+The API calls of a create are measured into
+formula_exports/<system>/snapshot_metrics_<ts>.json.
+
+Usage:
+    python3 snapshot.py create <system> [sheet ...]
+    python3 snapshot.py show <snapshot_dir>
+"""
+import datetime
+import json
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+SNAPSHOT_ROOT = 'snapshots'
+MANIFEST_NAME = 'manifest.json'
+SNAPSHOT_VERSION = 1
+
+EMPTY, NUMBER, TEXT, BOOLEAN = 0, 1, 2, 3
+
+
+def fetch_values(service, spreadsheet_id, sheet_names=None):
+    """
+    Fetches the unformatted values of the given sheets (default: all of
+    them). Returns None when any sheet could not be fetched, since a missing
+    sheet would later read as #REF!.
+    """
+    from main import DEFAULT_BATCH_SIZE, batch_get_sheet_values, get_all_sheet_names
+    if sheet_names is None:
+        sheet_names = get_all_sheet_names(service, spreadsheet_id) or []
+    values = batch_get_sheet_values(service, spreadsheet_id, sheet_names, DEFAULT_BATCH_SIZE,
+                                    value_render_option='UNFORMATTED_VALUE')
+    missing = [name for name in sheet_names if name not in values]
+    if missing:
+        print(f"Could not fetch {len(missing)} sheets: {', '.join(missing)}")
+        return None
+    return values
+
+
+def encode_sheet(rows):
+    """Converts a value matrix into the (numbers, kinds, text_offsets, text_data) arrays."""
+    height = len(rows)
+    width = max((len(row) for row in rows), default=0)
+    numbers = np.full((height, width), np.nan, dtype=np.float64, order='F')
+    kinds = np.zeros((height, width), dtype=np.int8, order='F')
+    text_cells = []
+    for r_idx, row in enumerate(rows):
+        for c_idx, value in enumerate(row):
+            if value is None or value == '':
+                continue
+            if isinstance(value, bool):
+                kinds[r_idx, c_idx] = BOOLEAN
+                numbers[r_idx, c_idx] = float(value)
+            elif isinstance(value, (int, float)):
+                kinds[r_idx, c_idx] = NUMBER
+                numbers[r_idx, c_idx] = value
+            else:
+                kinds[r_idx, c_idx] = TEXT
+                text_cells.append((c_idx * height + r_idx, str(value).encode('utf-8')))
+
+    text_cells.sort()
+    lengths = np.zeros(height * width, dtype=np.int64)
+    for position, encoded in text_cells:
+        lengths[position] = len(encoded)
+    text_offsets = np.zeros(height * width + 1, dtype=np.int64)
+    np.cumsum(lengths, out=text_offsets[1:])
+    text_data = np.frombuffer(b''.join(encoded for _, encoded in text_cells), dtype=np.uint8)
+    return numbers, kinds, text_offsets, text_data
+
+
+class SheetSnapshot:
+    """One sheet of a snapshot, backed by memory-mapped arrays."""
+
+    def __init__(self, name, directory, mmap_mode='r'):
+        self.name = name
+        self.numbers = np.load(os.path.join(directory, 'numbers.npy'), mmap_mode=mmap_mode)
+        self.kinds = np.load(os.path.join(directory, 'kinds.npy'), mmap_mode=mmap_mode)
+        self.text_offsets = np.load(os.path.join(directory, 'text_offsets.npy'), mmap_mode=mmap_mode)
+        self.text_data = np.load(os.path.join(directory, 'text_data.npy'), mmap_mode=mmap_mode)
+
+    @property
+    def shape(self):
+        return self.kinds.shape
+
+    def column(self, col):
+        """Returns the numeric view of one column (NaN for non-numbers) without copying."""
+        return self.numbers[:, col]
+
+    def text(self, row, col):
+        position = col * self.shape[0] + row
+        start, end = self.text_offsets[position], self.text_offsets[position + 1]
+        return self.text_data[start:end].tobytes().decode('utf-8')
+
+    def value(self, row, col):
+        """Returns one cell the way the API renders it ('' for empty cells)."""
+        if row >= self.shape[0] or col >= self.shape[1]:
+            return ''
+        kind = self.kinds[row, col]
+        if kind == NUMBER:
+            return float(self.numbers[row, col])
+        if kind == TEXT:
+            return self.text(row, col)
+        if kind == BOOLEAN:
+            return bool(self.numbers[row, col])
+        return ''
+
+    def to_rows(self):
+        """Rebuilds the sheet's value matrix as lists, like a values().get response."""
+        height, width = self.shape
+        cells = np.array(self.numbers, dtype=object)
+        cells[self.kinds == EMPTY] = ''
+        booleans = self.kinds == BOOLEAN
+        cells[booleans] = np.asarray(self.numbers)[booleans] != 0
+        texts = self.kinds == TEXT
+        if texts.any():
+            # Column-major positions match the order the text was stored in.
+            positions = np.flatnonzero(texts.ravel(order='F'))
+            starts = self.text_offsets[positions].tolist()
+            ends = self.text_offsets[positions + 1].tolist()
+            data = self.text_data.tobytes()
+            cells.T[texts.T] = [data[start:end].decode('utf-8') for start, end in zip(starts, ends)]
+        return cells.tolist()
+
+
+class Snapshot:
+    """An opened snapshot directory. Sheets are memory-mapped on first access."""
+
+    def __init__(self, path, manifest):
+        self.path = path
+        self.manifest = manifest
+        self._sheets = {}
+
+    @classmethod
+    def open(cls, path):
+        with open(os.path.join(path, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest.get('version') != SNAPSHOT_VERSION:
+            raise ValueError(f"Unsupported snapshot version in {path}: {manifest.get('version')}")
+        return cls(path, manifest)
+
+    def sheet_names(self):
+        return [sheet['name'] for sheet in self.manifest['sheets']]
+
+    def sheet(self, name):
+        if name not in self._sheets:
+            entry = next((sheet for sheet in self.manifest['sheets'] if sheet['name'] == name), None)
+            if entry is None:
+                raise KeyError(name)
+            self._sheets[name] = SheetSnapshot(name, os.path.join(self.path, entry['directory']))
+        return self._sheets[name]
+
+    def values(self):
+        """Returns {sheet name: value matrix} for every sheet, e.g. for the evaluator."""
+        return {name: self.sheet(name).to_rows() for name in self.sheet_names()}
+
+
+def write_snapshot(path, values, spreadsheet_id, revision=None):
+    """
+    Writes a snapshot of {sheet name: value matrix} to a new directory. The
+    snapshot is assembled next to its destination and renamed into place, so
+    readers never see a partial snapshot.
+    """
+    staging = path + '.part'
+    shutil.rmtree(staging, ignore_errors=True)
+    os.makedirs(staging)
+    sheets = []
+    for index, (sheet_name, rows) in enumerate(values.items()):
+        directory = f"sheet_{index:03d}"
+        os.makedirs(os.path.join(staging, directory))
+        numbers, kinds, text_offsets, text_data = encode_sheet(rows)
+        for filename, array in (('numbers.npy', numbers), ('kinds.npy', kinds),
+                                ('text_offsets.npy', text_offsets), ('text_data.npy', text_data)):
+            np.save(os.path.join(staging, directory, filename), array)
+        sheets.append({
+            'name': sheet_name,
+            'directory': directory,
+            'rows': kinds.shape[0],
+            'columns': kinds.shape[1],
+            'numbers': int((kinds == NUMBER).sum()),
+            'texts': int((kinds == TEXT).sum()),
+        })
+    with open(os.path.join(staging, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': SNAPSHOT_VERSION,
+            'spreadsheet_id': spreadsheet_id,
+            'revision': revision,
+            'fetched_at': datetime.datetime.now().isoformat(timespec='seconds'),
+            'value_render_option': 'UNFORMATTED_VALUE',
+            'sheets': sheets,
+        }, f, ensure_ascii=False, indent=2)
+    os.replace(staging, path)
+    return path
+
+
+def latest_snapshot(system, root=SNAPSHOT_ROOT):
+    """Returns the directory of a system's newest snapshot, or None."""
+    directory = os.path.join(root, system)
+    if not os.path.isdir(directory):
+        return None
+    names = sorted(name for name in os.listdir(directory)
+                   if os.path.isfile(os.path.join(directory, name, MANIFEST_NAME)))
+    return os.path.join(directory, names[-1]) if names else None
+
+
+def create(system, sheet_names=None):
+    from api_metrics import ApiMetrics, write_metrics
+    from auth import get_authenticated_service
+    from sheet_cache import get_spreadsheet_revision
+
+    with open('config.json', 'r') as f:
+        all_configs = json.load(f)
+    if system not in all_configs:
+        print(f"Error: Target system '{system}' not found in config.json.")
+        return None
+    spreadsheet_id = all_configs[system]['spreadsheet_id']
+
+    metrics = ApiMetrics()
+    service = get_authenticated_service("sheets", "v4", metrics=metrics)
+    revision = get_spreadsheet_revision(get_authenticated_service("drive", "v3", metrics=metrics), spreadsheet_id)
+    values = fetch_values(service, spreadsheet_id, sheet_names)
+    timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    metrics_dir = os.path.join('formula_exports', system)
+    os.makedirs(metrics_dir, exist_ok=True)
+    write_metrics(metrics, metrics_dir, timestamp, prefix='snapshot_')
+    if not values:
+        print("Not all values were fetched; no snapshot written.")
+        return None
+    os.makedirs(os.path.join(SNAPSHOT_ROOT, system), exist_ok=True)
+    path = write_snapshot(os.path.join(SNAPSHOT_ROOT, system, timestamp), values, spreadsheet_id, revision)
+    print(f"Snapshot of {len(values)} sheets saved to: {path}")
+    return path
+
+
+def show(path):
+    start = time.perf_counter()
+    snapshot = Snapshot.open(path)
+    for name in snapshot.sheet_names():
+        snapshot.sheet(name)
+    elapsed = time.perf_counter() - start
+    manifest = snapshot.manifest
+    print(f"Spreadsheet {manifest['spreadsheet_id']} (revision {manifest['revision']}), "
+          f"fetched {manifest['fetched_at']}; opened {len(manifest['sheets'])} sheets in {elapsed * 1000:.1f} ms")
+    for sheet in manifest['sheets']:
+        print(f"  {sheet['name']:<30} {sheet['rows']:>6} x {sheet['columns']:<4} "
+              f"{sheet['numbers']} numbers, {sheet['texts']} texts")
+
+
+def main():
+    if len(sys.argv) < 3 or sys.argv[1] not in ('create', 'show'):
+        print(__doc__.split('Usage:')[1].rstrip())
+        return
+    if sys.argv[1] == 'create':
+        create(sys.argv[2], sys.argv[3:] or None)
+    else:
+        show(sys.argv[2])
+
+
+if __name__ == "__main__":
+    main()
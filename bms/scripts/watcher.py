@@ -0,0 +1,116 @@
+import json
+import os
+import time
+
+# Seconds between revision checks while nothing changes; the interval grows
+# by IDLE_BACKOFF per quiet check up to the maximum and resets on a change.
+DEFAULT_POLL_INTERVAL = 60.0
+DEFAULT_MAX_POLL_INTERVAL = 900.0
+IDLE_BACKOFF = 1.5
+
+# An edit burst is considered over once the revision has not moved for the
+# quiet period. Continuous editing still triggers a run after MAX_COALESCE
+# quiet periods, so exports never fall arbitrarily far behind.
+DEFAULT_QUIET_PERIOD = 120.0
+MAX_COALESCE = 5
+
+STATE_NAME = 'watch_state.json'
+
+
+def revision_key(revision):
+    """Returns the comparable part of a Drive revision marker, or None."""
+    if not revision:
+        return None
+    return revision.get('version') or revision.get('modifiedTime')
+
+
+class RevisionWatcher:
+    """
+    Polls a spreadsheet's revision and calls on_change() once per settled
+    change; on_change returns a true value when the export succeeded.
+    poll() returns a revision dict (or None when it cannot be read); failed
+    polls back off exponentially up to max_interval. The last exported
+    revision is kept in state_path, so a restart does not export again.
+    """
+
+    def __init__(self, poll, on_change, state_path=None, interval=DEFAULT_POLL_INTERVAL,
+                 max_interval=DEFAULT_MAX_POLL_INTERVAL, quiet_period=DEFAULT_QUIET_PERIOD,
+                 sleep=time.sleep, clock=time.monotonic):
+        self.poll = poll
+        self.on_change = on_change
+        self.state_path = state_path
+        self.interval = interval
+        self.max_interval = max(max_interval, interval)
+        self.quiet_period = quiet_period
+        self.sleep = sleep
+        self.clock = clock
+        self.exported = self._load_state()
+        self.runs = 0
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return None
+        with open(self.state_path, 'r') as f:
+            return json.load(f).get('revision')
+
+    def _save_state(self, revision):
+        self.exported = revision
+        if not self.state_path:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        with open(self.state_path, 'w') as f:
+            json.dump({'revision': revision}, f, indent=2)
+
+    def _poll_key(self):
+        try:
+            return revision_key(self.poll())
+        except Exception as err:  # network errors surface as many exception types
+            print(f"Revision check failed: {err}")
+            return None
+
+    def _settle(self, key):
+        """Waits until the revision stops moving and returns the settled key."""
+        first_seen = last_change = self.clock()
+        step = min(self.interval, self.quiet_period) if self.quiet_period else 0
+        while self.quiet_period and self.clock() - last_change < self.quiet_period:
+            if self.clock() - first_seen >= self.quiet_period * MAX_COALESCE:
+                print("Spreadsheet is still being edited; exporting the current revision.")
+                break
+            self.sleep(step)
+            current = self._poll_key()
+            if current is not None and current != key:
+                print(f"Revision moved to {current} while settling; waiting for edits to stop.")
+                key, last_change = current, self.clock()
+        return key
+
+    def run(self, max_runs=None):
+        """Watches until interrupted (or until max_runs exports have been made)."""
+        delay = self.interval
+        failures = 0
+        while max_runs is None or self.runs < max_runs:
+            key = self._poll_key()
+            if key is None:
+                failures += 1
+                delay = min(self.max_interval, self.interval * 2 ** failures)
+                print(f"Could not read the revision; checking again in {delay:.0f}s.")
+            elif key == self.exported:
+                failures = 0
+                delay = min(self.max_interval, delay * IDLE_BACKOFF)
+            else:
+                failures = 0
+                print(f"Revision changed ({self.exported} -> {key}).")
+                key = self._settle(key)
+                try:
+                    exported = self.on_change()
+                except Exception as err:
+                    print(f"Export failed: {err}")
+                    exported = False
+                if exported:
+                    self._save_state(key)
+                    self.runs += 1
+                else:
+                    print("Revision not marked as exported; retrying on the next check.")
+                delay = self.interval
+                if max_runs is not None and self.runs >= max_runs:
+                    break
+            self.sleep(delay)
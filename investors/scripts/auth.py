@@ -6,6 +6,8 @@ from google_auth_oauthlib.flow import InstalledAppFlow
 from googleapiclient.discovery import build
 from googleapiclient.errors import HttpError
 
+from api_metrics import instrument
+
 # Define the paths relative to this file's location
 AUTH_DIR = os.path.dirname(os.path.abspath(__file__))
 CREDENTIALS_PATH = os.path.join(AUTH_DIR, 'credentials.json')
@@ -17,10 +19,12 @@ SCOPES = [
     "https://www.googleapis.com/auth/drive.file" # Added scope to manage files (for deletion)
 ]
 
-def get_authenticated_service(service_name, version):
+def get_authenticated_service(service_name, version, metrics=None):
     """
     Authenticates with a Google API and returns a service object.
     Handles the OAuth 2.0 flow, including token creation and refresh.
+    With metrics (an api_metrics.ApiMetrics), every executed request is
+    recorded in it.
     """
     creds = None
     # The file token.json stores the user's access and refresh tokens, and is
@@ -43,7 +47,8 @@ def get_authenticated_service(service_name, version):
         with open(TOKEN_PATH, "w") as token:
             token.write(creds.to_json())
 
-    return build(service_name, version, credentials=creds)
+    service = build(service_name, version, credentials=creds)
+    return instrument(service, metrics) if metrics is not None else service
 
 def main():
     """
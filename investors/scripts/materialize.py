@@ -0,0 +1,351 @@
+"""
+Materializes the investor portal's dashboards from the spreadsheet.
+
+The web app's getUserDashboard and getGroupDetails open the spreadsheet and
+scan '[DB] Portal_Users' and the investor sheets on every request. This job
+reads those sheets once, in one batched values fetch, and writes the same
+responses as compact JSON documents:
+
+    dashboards/<system>/index.json         email -> sheet, investor id, group and document paths
+    dashboards/<system>/users/<key>.json   one getUserDashboard response per user
+    dashboards/<system>/groups/<key>.json  one getGroupDetails response per group
+
+so serving a request is one dictionary lookup and one file read. Password
+hashes are not copied into any document.
+
+Each sheet's values are cached with a content hash in
+dashboard_state/<system>/state.json, outside the published directory; of
+'[DB] Portal_Users' only the columns the documents use (A-C) are kept. A
+refresh with --sheets fetches only the named sheets and reuses the cached
+values of the others, and only documents whose content changed are rewritten.
+
+The job's API calls are measured into
+formula_exports/<system>/materialize_metrics_<ts>.json.
+
+Usage: python3 materialize.py <system_name> [--sheets SHEET ...] [--output DIR]
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import re
+
+from googleapiclient.errors import HttpError
+
+from api_metrics import ApiMetrics, write_metrics
+from auth import get_authenticated_service
+
+PORTAL_USERS_SHEET_NAME = '[DB] Portal_Users'
+OUTPUT_ROOT = 'dashboards'
+STATE_ROOT = 'dashboard_state'
+STATE_NAME = 'state.json'
+# Portal_Users columns the documents use: email, sheet name, investor id.
+# Column D holds password hashes and is never cached.
+PORTAL_USERS_COLUMNS = 3
+
+# Sheets serial dates count days from 1899-12-30.
+SHEETS_EPOCH = datetime.date(1899, 12, 30)
+
+
+def quote_sheet_name(sheet_name):
+    return "'" + sheet_name.replace("'", "''") + "'"
+
+
+def fetch_ranges(service, spreadsheet_id, ranges, render_option='UNFORMATTED_VALUE'):
+    """Fetches A1 ranges in one values.batchGet and returns {range: rows}."""
+    if not ranges:
+        return {}
+    try:
+        result = service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=ranges,
+            valueRenderOption=render_option
+        ).execute()
+    except HttpError as err:
+        print(f"An error occurred while fetching {len(ranges)} ranges: {err}")
+        return None
+    return {a1_range: value_range.get('values', [])
+            for a1_range, value_range in zip(ranges, result.get('valueRanges', []))}
+
+
+def sheet_hash(rows):
+    return hashlib.sha256(json.dumps(rows, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def cell(rows, a1_cell):
+    """Returns the value of one cell (e.g. 'K5') of a value matrix, or '' when it is empty."""
+    match = re.match(r'^([A-Z]+)(\d+)$', a1_cell)
+    col = 0
+    for letter in match.group(1):
+        col = col * 26 + ord(letter) - ord('A') + 1
+    row = int(match.group(2)) - 1
+    if row < len(rows) and col - 1 < len(rows[row]):
+        return rows[row][col - 1]
+    return ''
+
+
+def to_number(value):
+    """Mirrors the web app's parseFloat(String(value).replace(/[^0-9.-]+/g, "")) || 0."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    match = re.match(r'^-?\d*\.?\d+', re.sub(r'[^0-9.-]+', '', str(value)))
+    return float(match.group()) if match else 0
+
+
+def to_date(value):
+    """Converts a serial date to YYYY-MM-DD; other values are returned unchanged."""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return (SHEETS_EPOCH + datetime.timedelta(days=int(value))).isoformat()
+    return value
+
+
+def next_payment_date(today):
+    """The first day of the next quarter, as the web app's getNextPaymentDate."""
+    if today.month <= 3:
+        return f"{today.year}-04-01"
+    if today.month <= 6:
+        return f"{today.year}-07-01"
+    if today.month <= 9:
+        return f"{today.year}-10-01"
+    return f"{today.year + 1}-01-01"
+
+
+def portal_users(rows):
+    """Returns the portal users (email, sheet name, investor id), skipping the header row."""
+    users = []
+    for row in rows[1:]:
+        if row and row[0]:
+            users.append({
+                'email': row[0],
+                'sheetName': row[1] if len(row) > 1 else '',
+                'investorId': row[2] if len(row) > 2 else '',
+            })
+    return users
+
+
+def build_user_dashboard(rows, today):
+    """Builds one getUserDashboard response from an investor sheet's values."""
+    ledger = []
+    for row in rows[4:]:
+        row = list(row) + [''] * (6 - len(row))
+        if not row[0]:
+            continue
+        ledger.append({
+            'date': to_date(row[0]),
+            'openingBalance': row[1],
+            'deposit': row[2],
+            'withdrawal': row[3],
+            'interest': row[4],
+            'endingBalance': row[5],
+        })
+    return {
+        'fullName': cell(rows, 'B2'),
+        'currentBalance': cell(rows, 'K5'),
+        'nextPaymentAmount': cell(rows, 'L5'),
+        'nextPaymentDate': next_payment_date(today),
+        'investmentGroupId': cell(rows, 'M5'),
+        'ledgerData': ledger,
+    }
+
+
+def build_group_details(group_id, rows, collateral_ratio, email_map):
+    """Builds one getGroupDetails response from a group sheet's values."""
+    investor_mix = []
+    for row in rows[4:]:
+        if not row or not row[0]:
+            break
+        row = list(row) + [''] * (3 - len(row))
+        investor_mix.append({
+            'investor': row[0],
+            'email': email_map.get(row[0]),
+            'currentBalance': row[1],
+            'percentage': row[2],
+        })
+    associated_assets = []
+    for row in rows[4:]:
+        if len(row) < 5 or not row[4]:
+            break
+        associated_assets.append({
+            'property': row[4],
+            'currentUPB': row[5] if len(row) > 5 else '',
+        })
+    return {
+        'groupName': group_id,
+        'partnershipAgreementLink': cell(rows, 'B2'),
+        'collateralCoverageRatio': collateral_ratio,
+        'totalFunds': to_number(cell(rows, 'D2')),
+        'investorMix': investor_mix,
+        'associatedAssets': associated_assets,
+    }
+
+
+def document_key(name):
+    """A file name for a user or group document, e.g. 'hila kligman' -> 'hila-kligman-1a2b3c4d'."""
+    slug = re.sub(r'[^a-z0-9]+', '-', str(name).lower()).strip('-') or 'sheet'
+    return f"{slug}-{hashlib.sha256(str(name).encode('utf-8')).hexdigest()[:8]}"
+
+
+def write_document(output_dir, relative_path, document, previous_hashes, hashes):
+    """Writes a compact JSON document unless its content is unchanged; returns True if written."""
+    text = json.dumps(document, ensure_ascii=False, separators=(',', ':'), sort_keys=True)
+    digest = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+    hashes[relative_path] = digest
+    path = os.path.join(output_dir, relative_path)
+    if previous_hashes.get(relative_path) == digest and os.path.exists(path):
+        return False
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(f"{path}.part", 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(f"{path}.part", path)
+    return True
+
+
+def load_state(state_dir):
+    path = os.path.join(state_dir, STATE_NAME)
+    if not os.path.exists(path):
+        return {'sheets': {}, 'documents': {}}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_state(state_dir, state):
+    os.makedirs(state_dir, exist_ok=True)
+    path = os.path.join(state_dir, STATE_NAME)
+    with open(f"{path}.part", 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(f"{path}.part", path)
+
+
+def materialize(service, spreadsheet_id, sheet_names, output_dir, state_dir, only=None, today=None):
+    """
+    Refreshes the dashboard documents in output_dir. With only, just those
+    sheets are fetched and every other sheet comes from the cached state in
+    state_dir.
+    Returns (documents written, documents unchanged), or None on a fetch error.
+    """
+    today = today or datetime.date.today()
+    state = load_state(state_dir)
+    cached = state['sheets']
+    wanted = [PORTAL_USERS_SHEET_NAME] + [name for name in sheet_names if name != PORTAL_USERS_SHEET_NAME]
+    to_fetch = [name for name in wanted if only is None or name in only or name not in cached]
+    print(f"Fetching {len(to_fetch)} of {len(wanted)} sheets in one batch...")
+    fetched = fetch_ranges(service, spreadsheet_id, [quote_sheet_name(name) for name in to_fetch])
+    if fetched is None:
+        return None
+    fetched = {name: fetched[quote_sheet_name(name)] for name in to_fetch}
+
+    changed = set()
+    for name, rows in fetched.items():
+        if name == PORTAL_USERS_SHEET_NAME:
+            rows = [row[:PORTAL_USERS_COLUMNS] for row in rows]
+        digest = sheet_hash(rows)
+        if cached.get(name, {}).get('hash') != digest:
+            changed.add(name)
+        cached[name] = {'hash': digest, 'values': rows}
+    print(f"{len(changed)} sheets changed: {', '.join(sorted(changed)) or 'none'}")
+    sheets = {name: cached[name]['values'] for name in wanted if name in cached}
+
+    users = portal_users(sheets.get(PORTAL_USERS_SHEET_NAME, []))
+    email_map = {user['sheetName']: user['email'] for user in users}
+
+    previous_hashes, hashes = state['documents'], {}
+    written = unchanged = 0
+    index = {}
+    group_ids = set()
+    for user in users:
+        if user['email'] in index:
+            continue
+        rows = sheets.get(user['sheetName'])
+        if rows is None:
+            print(f"Warning: Investor sheet '{user['sheetName']}' for {user['email']} not found.")
+            continue
+        dashboard = build_user_dashboard(rows, today)
+        relative_path = f"users/{document_key(user['email'])}.json"
+        if write_document(output_dir, relative_path, dashboard, previous_hashes, hashes):
+            written += 1
+        else:
+            unchanged += 1
+        group_id = dashboard['investmentGroupId']
+        index[user['email']] = dict(user, investmentGroupId=group_id, dashboard=relative_path)
+        if group_id in sheets:
+            group_ids.add(group_id)
+        elif group_id:
+            print(f"Warning: Group sheet '{group_id}' for {user['email']} is not in the configured sheets.")
+
+    # The collateral ratio is shown as displayed in the sheet, so it comes from
+    # a second, formatted fetch of one cell per refreshed group sheet.
+    ratios = state.setdefault('ratios', {})
+    stale = [group_id for group_id in sorted(group_ids) if group_id in fetched or group_id not in ratios]
+    formatted = fetch_ranges(service, spreadsheet_id,
+                             [f"{quote_sheet_name(group_id)}!F2" for group_id in stale],
+                             render_option='FORMATTED_VALUE')
+    if formatted is None:
+        return None
+    for group_id in stale:
+        ratios[group_id] = cell(formatted.get(f"{quote_sheet_name(group_id)}!F2", []), 'A1')
+    groups = {}
+    for group_id in sorted(group_ids):
+        details = build_group_details(group_id, sheets[group_id], ratios[group_id], email_map)
+        relative_path = f"groups/{document_key(group_id)}.json"
+        if write_document(output_dir, relative_path, details, previous_hashes, hashes):
+            written += 1
+        else:
+            unchanged += 1
+        groups[group_id] = relative_path
+
+    for relative_path in set(previous_hashes) - set(hashes) - {'index.json'}:
+        path = os.path.join(output_dir, relative_path)
+        if os.path.exists(path):
+            os.remove(path)
+    write_document(output_dir, 'index.json', {'users': index, 'groups': groups}, previous_hashes, hashes)
+
+    # Sheets that are no longer configured are dropped from the cache.
+    state['sheets'] = {name: cached[name] for name in wanted if name in cached}
+    state['ratios'] = {group_id: ratios[group_id] for group_id in group_ids}
+    state['documents'] = hashes
+    state['refreshed'] = datetime.datetime.now().isoformat(timespec='seconds')
+    save_state(state_dir, state)
+    return written, unchanged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the investor portal's dashboard documents.")
+    parser.add_argument('system', help="System name from config.json, e.g. investors")
+    parser.add_argument('--sheets', nargs='+', metavar='SHEET',
+                        help="Refresh only these sheets and reuse the cached values of the others")
+    parser.add_argument('--output', help="Output directory (default: dashboards/<system>)")
+    args = parser.parse_args()
+
+    with open('config.json', 'r') as f:
+        all_configs = json.load(f)
+    if args.system not in all_configs:
+        print(f"Error: Target system '{args.system}' not found in config.json.")
+        print(f"Available systems: {list(all_configs.keys())}")
+        return
+
+    config = all_configs[args.system]['config']
+    spreadsheet_id = all_configs[args.system]['spreadsheet_id']
+    output_dir = args.output or os.path.join(OUTPUT_ROOT, args.system)
+    os.makedirs(output_dir, exist_ok=True)
+
+    print(f"--- Materializing dashboards for system: {args.system} ---")
+    metrics = ApiMetrics()
+    service = get_authenticated_service("sheets", "v4", metrics=metrics)
+    result = materialize(service, spreadsheet_id, config.get('otherSheetsToProcess', []), output_dir,
+                         os.path.join(STATE_ROOT, args.system),
+                         only=set(args.sheets) if args.sheets else None)
+    metrics_dir = os.path.join('formula_exports', args.system)
+    os.makedirs(metrics_dir, exist_ok=True)
+    write_metrics(metrics, metrics_dir, datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S"),
+                  prefix='materialize_')
+    if result is None:
+        print("Could not fetch the sheets. Exiting.")
+        return
+    written, unchanged = result
+    print(f"{written} documents written, {unchanged} unchanged.")
+    print(f"Dashboards saved to: {output_dir}")
+
+
+if __name__ == "__main__":
+    main()